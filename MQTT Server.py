@@ -1,20 +1,36 @@
 import sys
+import argparse
+import signal
 import threading
 import paho.mqtt.client as mqtt
-import cx_Oracle
 import logging
+import logging.handlers
 import re
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, wait
 import time
 import json
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
-from tkinter.font import Font
 import traceback
 import queue
-import psutil
-from collections import defaultdict
+import heapq
+import struct
+import itertools
+import random
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict, deque, OrderedDict
+
+# tkinter is only needed by the dashboard; load_tk() imports it on demand so a
+# headless server never loads Tk
+tk = ttk = scrolledtext = None
+
+def load_tk():
+    global tk, ttk, scrolledtext
+    import tkinter
+    from tkinter import ttk as tkinter_ttk, scrolledtext as tkinter_scrolledtext
+    tk, ttk, scrolledtext = tkinter, tkinter_ttk, tkinter_scrolledtext
 
 # Enhanced logging configuration
 logging.basicConfig(
@@ -37,7 +53,8 @@ CONFIG = {
         "retain": True,
         "max_inflight_messages": 50,
         "max_queued_messages": 500,
-        "reconnect_delay": 5
+        "reconnect_delay": 5,      # first retry delay in seconds
+        "reconnect_max_delay": 60  # retries back off exponentially up to this
     },
     "database": {
         "username": "rfid",
@@ -49,12 +66,21 @@ CONFIG = {
             "min": 5,
             "max": 20,
             "increment": 2,
-            "timeout": 30
+            "timeout": 30,
+            "ping_interval": 60  # a session idle this long is pinged on acquire; failures are counted after a pool-wide lull
         }
     },
+    "storage": {
+        "backend": "oracle",           # "oracle" or "sqlite"
+        "sqlite_path": "rfid.db",      # database file for the sqlite backend
+        "sqlite_synchronous": "NORMAL",  # WAL with NORMAL survives process crashes; FULL also power loss
+        "sqlite_busy_timeout": 5       # seconds a writer waits for the database lock
+    },
     "threading": {
-        "max_workers": 50,
-        "queue_size": 500
+        "shards": 16,              # worker threads; each MAC always maps to one shard
+        "queue_size": 500,         # bounded FIFO per shard
+        "full_policy": "shed_polls",  # "block", "shed_polls" or "reject"
+        "block_timeout": 0.05      # seconds the paho thread may wait on a full shard
     },
     "tables": {
         "employee": "MV_EMPLOYEES",
@@ -64,6 +90,12 @@ CONFIG = {
         "workstation_status": "WORKSTATION_STATUS",
         "error_logs": "RFID_SYSTEM_ERROR_LOGS"
     },
+    "columns": {
+        "employee_card": "CARD_NO",
+        "employee_id": "EMP_ID",
+        "bundle_rfid": "RFID",
+        "bundle_id": "BUNDLE_ID"
+    },
     "responses": {
         "login_success": "LOGIN_SUCCESS",
         "login_exists": "LOGIN_EXISTS",
@@ -82,58 +114,1031 @@ CONFIG = {
     },
     "device": {
         "timeout_minutes": 5,
+        "timeout_check_interval": 60,  # seconds between inactive device scans
         "heartbeat_interval": 30,
-        "max_message_rate": 100  # messages per second
+        "heartbeat_anomaly_interval": 300,  # seconds between malformed-heartbeat summaries
+        "max_message_rate": 100,  # messages per second across all devices
+        "global_burst": 200,
+        "device_message_rate": 5,  # messages per second from one device
+        "device_burst": 10,
+        "admission_prune_interval": 60,  # seconds between sweeps of idle per-device buckets
+        "rejected_devices_tracked": 100  # devices kept in the rate-limited counts
+    },
+    "protocol": {
+        # A v2 sequence number this far below the last one means the device restarted
+        "sequence_reset_window": 1000
+    },
+    "error_log": {
+        "queue_size": 5000,     # rows held in memory before dropping the oldest
+        "batch_size": 100,      # flush as soon as this many rows are queued
+        "flush_interval": 2.0,  # seconds between time-triggered flushes
+        "aggregate_window": 60,      # repeats of one event within this many seconds become one row
+        "aggregate_max_keys": 10000  # distinct open events; beyond this rows bypass aggregation
+    },
+    "card_index": {
+        "refresh_interval": 300,  # seconds between full reloads
+        "negative_ttl": 60        # seconds an unknown card is remembered
+    },
+    "observer": {
+        "stats_log_interval": 60  # seconds between stats lines in headless mode
+    },
+    "tracing": {
+        "sample_rate": 1.0,     # fraction of messages traced; 0 turns tracing off
+        "slow_ms": 500,         # traced messages slower than this end to end are logged
+        "slow_log": "slow_messages.jsonl",
+        "slow_log_bytes": 5 * 1024 * 1024,
+        "slow_log_backups": 3,
+        "gui_rows": 500
+    },
+    "journal": {
+        # Session writes go to a local journal first and are forwarded to the
+        # database in the background, so scans are answered during outages.
+        # Only for the "session" bundle_scan mode; "plsql" reads logins back from the database.
+        "enabled": False,
+        "path": "rfid_journal.db",  # SQLite file in WAL mode
+        "commit_interval": 0.002,   # seconds an append waits for others to share its fsync
+        "max_batch": 256,           # entries per commit
+        "replay_batch": 100,        # entries forwarded to the database per pass
+        "retry_delay": 1,           # first retry after a failed replay; doubles up to retry_max_delay
+        "retry_max_delay": 30,
+        "max_attempts": 5           # an entry the database keeps rejecting moves to JOURNAL_DEAD
+    },
+    "metrics": {
+        "enabled": True,
+        "host": "127.0.0.1",  # Prometheus text on http://host:port/metrics
+        "port": 9108
+    },
+    "gui": {
+        "frame_rate": 15,       # GUI refreshes per second
+        "event_buffer": 20000,  # pending GUI updates before the oldest are dropped
+        "recent_lines": 200,    # lines kept in the dashboard's Recent Messages
+        "log_lines": 3000       # lines kept in the Messages tab
+    },
+    "bundle_cache": {
+        "max_size": 5000,  # entries before least recently used are evicted
+        "ttl": 3600        # seconds before an RFID is resolved again
+    },
+    "debounce": {
+        "hold_off": 3.0,       # seconds a repeat of the same card on the same reader replays the last answer
+        "max_entries": 10000
+    },
+    "session": {
+        "login_hours": 12,         # an operator login stays valid for one shift
+        "bundle_history_days": 30,  # completed bundle scans kept in memory
+        "history_prune_interval": 3600  # seconds between sweeps of older bundle scans
+    },
+    "bundle_scan": {
+        # "session": checks in memory, one write per scan
+        # "plsql": checks and transition in one server-side PL/SQL block
+        "mode": "session",
+        "lock_timeout": 5  # seconds to wait for the per-bundle lock in plsql mode
+    },
+    "workstation": {
+        "warning_minutes": 8,  # STATUS_YELLOW once a bundle has run this long
+        "limit_minutes": 10,   # STATUS_RED once a bundle is overdue
+        "push_status": True,   # publish status changes instead of waiting for polls
+        "push_delay": 0.5      # seconds after a session event, so the scan response goes first
     }
 }
 
+# Key for message events in DashboardGUI's ring buffer; these are batched, not coalesced
+MESSAGE_EVENT = "message"
+
+# Message kinds on nodemcu/rfid, keyed by the payload's first token
+MESSAGE_LOGIN_STATUS = "loginstatus"
+MESSAGE_WORKSTATION_STATUS = "workstationstatus"
+MESSAGE_SCAN = "scan"
+RFID_COMMANDS = {
+    "loginstatus": MESSAGE_LOGIN_STATUS,
+    "workstationstatus": MESSAGE_WORKSTATION_STATUS
+}
+
+# Card numbers are hex; MAC addresses are hex with ':' separators
+HEX_CHARS = "0123456789abcdefABCDEF"
+MAC_CHARS = HEX_CHARS + ":"
+# Fallback for scans with irregular spacing, e.g. "ID:1234 Mac ID: AA:BB:..."
+SCAN_PATTERN = re.compile(r'ID:\s*([0-9A-Fa-f]+)\s*Mac ID:\s*([0-9A-Fa-f:]+)')
+
+def parse_rfid_payload(payload):
+    """Split a nodemcu/rfid payload into (message kind, mac, rfid); None when unrecognised"""
+    tokens = payload.split()
+    if not tokens:
+        return None
+        
+    # "loginstatus <mac>" and "workstationstatus <mac>"
+    kind = RFID_COMMANDS.get(tokens[0])
+    if kind is not None:
+        return (kind, tokens[1], None) if len(tokens) > 1 else None
+        
+    # Firmware scan format: "ID: <card> Mac ID: <mac>"
+    if (len(tokens) == 5 and tokens[0] == "ID:" and tokens[2] == "Mac" and tokens[3] == "ID:"
+            and not tokens[1].strip(HEX_CHARS) and not tokens[4].strip(MAC_CHARS)):
+        return MESSAGE_SCAN, tokens[4], tokens[1]
+        
+    match = SCAN_PATTERN.search(payload)
+    if match:
+        return MESSAGE_SCAN, match.group(2), match.group(1)
+    return None
+
+# v2 compact protocol, sent on nodemcu/rfid next to the legacy text. Frames
+# start with the version byte, which no legacy payload can begin with.
+#   request:  version, message type, MAC (6 bytes), card number, sequence, device timestamp
+#   response: version, response code, echoed sequence [, MAC (6 bytes) for BUNDLE_ACTIVE_AT]
+PROTOCOL_V2 = 0x02
+V2_REQUEST = struct.Struct(">BB6sIII")
+V2_RESPONSE = struct.Struct(">BBI")
+V2_MESSAGE_TYPES = {
+    1: MESSAGE_SCAN,
+    2: MESSAGE_LOGIN_STATUS,
+    3: MESSAGE_WORKSTATION_STATUS
+}
+# Response codes, keyed by the CONFIG["responses"] entry they replace
+V2_RESPONSE_CODES = {
+    "login_success": 0x01,
+    "login_exists": 0x02,
+    "login_required": 0x03,
+    "bundle_started": 0x10,
+    "bundle_ended": 0x11,
+    "bundle_active_elsewhere": 0x12,
+    "bundle_completed": 0x13,
+    "previous_bundle_active": 0x14,
+    "status_green": 0x20,
+    "status_yellow": 0x21,
+    "status_red": 0x22,
+    "no_operator": 0x23,
+    "unauthorized": 0x30,
+    "error_generic": 0x3F
+}
+# loginstatus answers, which the legacy protocol sends as LED levels
+V2_LOGGED_IN = 0x04
+V2_LOGGED_OUT = 0x05
+
+def parse_v2_payload(raw):
+    """Unpack a v2 frame into ((message kind, mac, rfid), sequence, device timestamp); None when malformed"""
+    if len(raw) != V2_REQUEST.size:
+        return None
+    _, message_type, mac, card, sequence, device_time = V2_REQUEST.unpack(raw)
+    kind = V2_MESSAGE_TYPES.get(message_type)
+    if kind is None:
+        return None
+    # Same spelling as the firmware's WiFi.macAddress() and the 10-digit card numbers
+    mac_address = mac.hex(":").upper()
+    rfid = f"{card:010d}" if kind is MESSAGE_SCAN else None
+    return (kind, mac_address, rfid), sequence, device_time
+
+class V2ResponseClient:
+    """Stands in for the MQTT client in handlers, encoding their text responses as v2 frames"""
+    codes = {CONFIG["responses"][name]: code for name, code in V2_RESPONSE_CODES.items()}
+    codes.update({"LOW": V2_LOGGED_IN, "HIGH": V2_LOGGED_OUT})
+    active_elsewhere = CONFIG["responses"]["bundle_active_elsewhere"]
+    
+    def __init__(self, client, sequence):
+        self.client = client
+        self.sequence = sequence
+        self.sent = []  # frames published, kept for retransmissions
+        
+    def encode(self, response):
+        code = self.codes.get(response)
+        if code is not None:
+            return V2_RESPONSE.pack(PROTOCOL_V2, code, self.sequence)
+        if response.startswith(self.active_elsewhere):
+            other_mac = response[len(self.active_elsewhere):]
+            return (V2_RESPONSE.pack(PROTOCOL_V2, V2_RESPONSE_CODES["bundle_active_elsewhere"], self.sequence)
+                    + bytes.fromhex(other_mac.replace(":", "")))
+        logging.warning(f"No v2 code for response {response}")
+        return V2_RESPONSE.pack(PROTOCOL_V2, V2_RESPONSE_CODES["error_generic"], self.sequence)
+        
+    def publish(self, topic, payload, qos=0, retain=False):
+        frame = self.encode(payload)
+        self.sent.append(frame)
+        return self.client.publish(topic, frame, qos=qos, retain=retain)
+
+class InboundMessage:
+    """A parsed nodemcu/rfid message on its way from the network thread to a worker"""
+    __slots__ = ('client', 'topic', 'payload', 'kind', 'mac_address', 'rfid', 'sequence',
+                 'received_at', 'queued_at', 'trace')
+    
+    def __init__(self, client, topic, payload, parsed, sequence, received_at, trace):
+        self.client = client
+        self.topic = topic
+        self.payload = payload
+        self.kind, self.mac_address, self.rfid = parsed
+        self.sequence = sequence
+        self.received_at = received_at
+        self.queued_at = None
+        self.trace = trace
+
+class SequenceTracker:
+    """Per-device v2 sequence numbers: spots duplicates, counts gaps as lost messages and
+    keeps the frames sent for each device's latest request so a retransmission gets them again.
+    """
+    def __init__(self):
+        self.reset_window = CONFIG["protocol"]["sequence_reset_window"]
+        self.last_sequence = {}
+        self.responses = {}  # mac -> (sequence, frames sent in reply)
+        self.lock = threading.Lock()
+        self.stats = {'received': 0, 'duplicates': 0, 'lost': 0, 'restarts': 0, 'resent': 0}
+        
+    def is_duplicate(self, mac_address, sequence):
+        """True if this sequence number was already accepted from the device"""
+        with self.lock:
+            last = self.last_sequence.get(mac_address)
+            if last is not None and sequence <= last and last - sequence < self.reset_window:
+                self.stats['duplicates'] += 1
+                return True
+            return False
+            
+    def accept(self, mac_address, sequence):
+        """Record a message once it is queued, so one that was rejected can be retransmitted"""
+        with self.lock:
+            last = self.last_sequence.get(mac_address)
+            if last is not None and sequence <= last:
+                # Counter started over after a reboot
+                self.stats['restarts'] += 1
+            elif last is not None:
+                self.stats['lost'] += sequence - last - 1
+            self.last_sequence[mac_address] = sequence
+            self.stats['received'] += 1
+            
+    def remember_responses(self, mac_address, sequence, frames):
+        with self.lock:
+            self.responses[mac_address] = (sequence, frames)
+            
+    def cached_responses(self, mac_address, sequence):
+        """Frames already sent for this sequence, or None if it has not been answered yet"""
+        with self.lock:
+            entry = self.responses.get(mac_address)
+            if entry is None or entry[0] != sequence:
+                return None
+            self.stats['resent'] += 1
+            return entry[1]
+            
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['devices'] = len(self.last_sequence)
+        return stats
+
+# Card kinds returned by CardIndex.classify
+CARD_EMPLOYEE = "employee"
+CARD_BUNDLE = "bundle"
+CARD_UNKNOWN = "unknown"
+
+class LatencyHistogram:
+    """HDR-style histogram of microsecond latencies.
+    
+    Each power of two is split into 8 linear sub-buckets, so any recorded
+    value is known to within 12.5% while a handful of buckets covers
+    microseconds to minutes. Recording is a bit_length and an increment.
+    """
+    SUB_BITS = 3
+    LINEAR = 1 << (SUB_BITS + 1)   # values below this get a bucket each
+    BUCKETS = 256                  # enough for about 2**30 us (18 minutes)
+    
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        
+    @classmethod
+    def index(cls, micros):
+        if micros < cls.LINEAR:
+            return micros
+        shift = micros.bit_length() - cls.SUB_BITS - 1
+        return min((shift << cls.SUB_BITS) + (micros >> shift), cls.BUCKETS - 1)
+        
+    @classmethod
+    def upper_bound(cls, index):
+        """Largest value that lands in a bucket"""
+        if index < cls.LINEAR:
+            return index
+        shift = (index >> cls.SUB_BITS) - 1
+        mantissa = (index & ((1 << cls.SUB_BITS) - 1)) + (1 << cls.SUB_BITS)
+        return ((mantissa + 1) << shift) - 1
+        
+    def record(self, micros):
+        self.counts[self.index(micros)] += 1
+        self.count += 1
+        self.total += micros
+        if micros > self.max:
+            self.max = micros
+            
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile, in microseconds"""
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * pct / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+class Metrics:
+    """Process-wide latency histograms and counters, keyed by name and labels"""
+    QUANTILES = (50, 95, 99)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> LatencyHistogram
+        self.counters = defaultdict(int)  # (name, labels) -> count
+        
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        micros = int(seconds * 1000000)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(micros)
+            
+    def increment(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+            
+    def snapshot(self):
+        """Rows of (name, labels, count, p50, p95, p99, max) in milliseconds, for the dashboard"""
+        with self.lock:
+            rows = [
+                (name, labels, histogram.count,
+                 *(histogram.percentile(pct) / 1000 for pct in self.QUANTILES),
+                 histogram.max / 1000)
+                for (name, labels), histogram in self.histograms.items()
+            ]
+        return sorted(rows)
+        
+    def counter_snapshot(self):
+        with self.lock:
+            return sorted(self.counters.items())
+            
+    def render_prometheus(self):
+        """Prometheus text exposition: histograms as summaries in seconds, counters as totals"""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            
+            current = None
+            for (name, labels), histogram in histograms:
+                metric = f"rfid_{name}_seconds"
+                if metric != current:
+                    lines.append(f"# TYPE {metric} summary")
+                    current = metric
+                for pct in self.QUANTILES:
+                    quantile_labels = labels + (("quantile", str(pct / 100)),)
+                    lines.append(f"{metric}{format_labels(quantile_labels)} {histogram.percentile(pct) / 1e6:.6f}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.total / 1e6:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+                
+        current = None
+        for (name, labels), value in counters:
+            metric = f"rfid_{name}_total"
+            if metric != current:
+                lines.append(f"# TYPE {metric} counter")
+                current = metric
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    """Prometheus label set, e.g. {type="scan"}; empty when there are no labels"""
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+METRICS = Metrics()
+
+class Trace:
+    """Timestamped spans of one message, from the network thread to its last publish"""
+    __slots__ = ('started', 'wall_time', 'topic', 'payload', 'spans', 'depth')
+    
+    def __init__(self, topic, payload, started):
+        self.started = started
+        self.wall_time = datetime.now()
+        self.topic = topic
+        self.payload = payload
+        self.spans = []  # (name, depth, start offset, duration) in seconds
+        self.depth = 0
+        
+    def add(self, name, start, end):
+        self.spans.append((name, self.depth, start - self.started, end - start))
+        
+    def to_record(self, kind, mac_address, total):
+        """JSON-ready breakdown; spans are ordered by start time and nested by depth"""
+        return {
+            'time': self.wall_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            'type': kind,
+            'mac_address': mac_address,
+            'topic': self.topic,
+            'payload': self.payload,
+            'total_ms': round(total * 1000, 3),
+            'spans': [
+                {'name': name, 'depth': depth, 'start_ms': round(offset * 1000, 3), 'ms': round(duration * 1000, 3)}
+                for name, depth, offset, duration in sorted(self.spans, key=lambda span: span[2])
+            ]
+        }
+
+# Trace of the message the current thread is working on, if it is sampled
+TRACE_CONTEXT = threading.local()
+
+def traced(func):
+    """Add a span for every call to the current thread's trace; a single attribute lookup when untraced"""
+    name = func.__name__
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = getattr(TRACE_CONTEXT, 'trace', None)
+        if trace is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        trace.depth += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.depth -= 1
+            trace.add(name, start, time.perf_counter())
+    return wrapper
+
+def timed(stage):
+    """Record a method's latency in the stage histogram, labelled with the method name, and trace it"""
+    def decorator(func):
+        operation = func.__name__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = getattr(TRACE_CONTEXT, 'trace', None)
+            if trace is not None:
+                trace.depth += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                METRICS.observe(stage, end - start, operation=operation)
+                if trace is not None:
+                    trace.depth -= 1
+                    trace.add(f"{stage}.{operation}", start, end)
+        return wrapper
+    return decorator
+
+class SlowMessageLog:
+    """Rotating JSONL file of traces slower than tracing.slow_ms"""
+    def __init__(self):
+        settings = CONFIG["tracing"]
+        self.logger = logging.getLogger("rfid.slow_messages")
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            # delay=True: the file only appears once something is slow
+            handler = logging.handlers.RotatingFileHandler(
+                settings["slow_log"],
+                maxBytes=settings["slow_log_bytes"],
+                backupCount=settings["slow_log_backups"],
+                delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            
+    def write(self, record):
+        self.logger.info(json.dumps(record))
+
+class TimedClient:
+    """Wraps the MQTT client so every publish is timed and counted by response code"""
+    def __init__(self, client):
+        self.client = client
+        
+    def publish(self, topic, payload, qos=0, retain=False):
+        start = time.perf_counter()
+        try:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)
+        finally:
+            end = time.perf_counter()
+            METRICS.observe("publish", end - start)
+            METRICS.increment("responses", code=response_code(payload))
+            trace = getattr(TRACE_CONTEXT, 'trace', None)
+            if trace is not None:
+                trace.add(f"publish {payload}", start, end)
+
+def response_code(response):
+    """Response label without per-device parts, e.g. BUNDLE_ACTIVE_AT_ instead of BUNDLE_ACTIVE_AT_<mac>"""
+    prefix = CONFIG["responses"]["bundle_active_elsewhere"]
+    return prefix if response.startswith(prefix) else response
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the server log
+        pass
+
+class MetricsServer:
+    """Serves METRICS on a local HTTP port for Prometheus to scrape"""
+    def __init__(self):
+        self.httpd = None
+        
+    def start(self):
+        settings = CONFIG["metrics"]
+        try:
+            self.httpd = ThreadingHTTPServer((settings["host"], settings["port"]), MetricsHandler)
+        except OSError as e:
+            logging.error(f"Metrics endpoint disabled, cannot bind {settings['host']}:{settings['port']}: {e}")
+            return
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics_http", daemon=True).start()
+        logging.info(f"Metrics available at http://{settings['host']}:{settings['port']}/metrics")
+        
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+class TokenBucket:
+    """Classic token bucket; tokens refill continuously at rate up to capacity"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+    
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        
+    def consume(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+        
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class AdmissionController:
+    """Rate limits device messages before they are queued.
+    
+    Each device has its own bucket in front of the global one, so a flooding
+    terminal exhausts its own allowance without starving the others. Buckets
+    refill over time, so limits lift on their own once load falls. Only the
+    paho network thread calls admit(), so no locking is needed; admit() also
+    sweeps idle buckets, since MAC addresses come from untrusted payloads.
+    """
+    def __init__(self):
+        self.device_rate = CONFIG["device"]["device_message_rate"]
+        self.device_burst = CONFIG["device"]["device_burst"]
+        self.global_bucket = TokenBucket(
+            CONFIG["device"]["max_message_rate"],
+            CONFIG["device"]["global_burst"],
+            time.monotonic()
+        )
+        self.device_buckets = {}
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        self.rejected_by_device = defaultdict(int)
+        self.prune_interval = CONFIG["device"]["admission_prune_interval"]
+        self.devices_tracked = CONFIG["device"]["rejected_devices_tracked"]
+        self.next_prune = time.monotonic() + self.prune_interval
+        
+    def admit(self, mac_address):
+        """Return None if the message may be queued, otherwise the rejection reason"""
+        now = time.monotonic()
+        if now >= self.next_prune:
+            self.prune(now)
+        bucket = self.device_buckets.get(mac_address)
+        if bucket is None:
+            bucket = self.device_buckets[mac_address] = TokenBucket(self.device_rate, self.device_burst, now)
+            
+        if not bucket.consume(now):
+            reason = "device_rate"
+        elif not self.global_bucket.consume(now):
+            bucket.refund()
+            reason = "global_rate"
+        else:
+            self.admitted += 1
+            return None
+            
+        self.rejected[reason] += 1
+        self.rejected_by_device[mac_address] += 1
+        return reason
+        
+    def prune(self, now):
+        """Drop buckets that have refilled, which a new bucket would match, and keep only the top offenders"""
+        self.next_prune = now + self.prune_interval
+        idle = [mac for mac, bucket in self.device_buckets.items()
+                if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity]
+        for mac in idle:
+            del self.device_buckets[mac]
+        if len(self.rejected_by_device) > self.devices_tracked:
+            top = sorted(self.rejected_by_device.items(), key=lambda item: item[1], reverse=True)
+            self.rejected_by_device = defaultdict(int, top[:self.devices_tracked])
+        
+    def get_stats(self):
+        top_devices = sorted(self.rejected_by_device.items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'top_devices': top_devices
+        }
+
+class DeviceDispatcher:
+    """Shards messages by MAC address onto worker threads with bounded queues.
+    
+    Every message from one device lands on the same shard, so a login and a
+    bundle scan from a terminal are processed in the order they arrived.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.shard_count = CONFIG["threading"]["shards"]
+        self.full_policy = CONFIG["threading"]["full_policy"]
+        self.block_timeout = CONFIG["threading"]["block_timeout"]
+        self.queues = [queue.Queue(maxsize=CONFIG["threading"]["queue_size"]) for _ in range(self.shard_count)]
+        # Each counter is only written by one thread: the worker or the paho thread
+        self.stats = [
+            {'processed': 0, 'shed': 0, 'rejected': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for _ in range(self.shard_count)
+        ]
+        self.threads = []
+        
+    def start(self):
+        for index in range(self.shard_count):
+            thread = threading.Thread(target=self.worker, args=(index,), name=f"mqtt_worker_{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            
+    def stop(self, timeout=10):
+        """Let workers drain their queues, then stop them"""
+        for shard in self.queues:
+            shard.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
+        
+    def submit(self, key, item, is_poll=False):
+        """Queue an item on the shard for key; returns False if it was shed or rejected"""
+        index = hash(key) % self.shard_count
+        shard = self.queues[index]
+        entry = (time.perf_counter(), item)
+        try:
+            shard.put_nowait(entry)
+            return True
+        except queue.Full:
+            pass
+            
+        if self.full_policy == "reject":
+            self.stats[index]['rejected'] += 1
+            return False
+        if self.full_policy == "shed_polls" and is_poll:
+            self.stats[index]['shed'] += 1
+            return False
+            
+        try:
+            shard.put(entry, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            self.stats[index]['rejected'] += 1
+            return False
+            
+    def worker(self, index):
+        shard = self.queues[index]
+        stats = self.stats[index]
+        while True:
+            entry = shard.get()
+            if entry is None:
+                break
+                
+            enqueued_at, item = entry
+            wait = time.perf_counter() - enqueued_at
+            METRICS.observe("queue_wait", wait)
+            stats['processed'] += 1
+            stats['wait_total'] += wait
+            if wait > stats['wait_max']:
+                stats['wait_max'] = wait
+                
+            try:
+                self.handler(item)
+            except Exception as e:
+                logging.error(f"Message processing failed: {e}", exc_info=True)
+                
+    def get_stats(self):
+        """Per-shard queue depth and wait-time counters"""
+        shards = []
+        for index, stats in enumerate(self.stats):
+            processed = stats['processed']
+            shards.append({
+                'shard': index,
+                'depth': self.queues[index].qsize(),
+                'processed': processed,
+                'shed': stats['shed'],
+                'rejected': stats['rejected'],
+                'avg_wait_ms': (stats['wait_total'] / processed * 1000) if processed else 0.0,
+                'max_wait_ms': stats['wait_max'] * 1000
+            })
+        return shards
+
+class ScheduledJob:
+    """Handle for a Scheduler job; cancel() stops any further runs"""
+    __slots__ = ('func', 'name', 'interval', 'jitter', 'backoff', 'delay', 'cancelled')
+    
+    def __init__(self, func, name, interval=None, jitter=0.0, backoff=None):
+        self.func = func
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff = backoff  # (base_delay, max_delay) or None
+        self.delay = backoff[0] if backoff else interval
+        self.cancelled = False
+        
+    def cancel(self):
+        # Cancelled entries stay in the heap and are skipped when they come due
+        self.cancelled = True
+        
+    @property
+    def active(self):
+        return not self.cancelled
+        
+    def next_delay(self, result):
+        """Delay before the next run, or None when the job is finished"""
+        if self.cancelled:
+            return None
+        if self.backoff:
+            # Backoff jobs return True once they succeed
+            if result is True:
+                return None
+            delay = self.delay
+            self.delay = min(self.delay * 2, self.backoff[1])
+        elif self.interval is not None:
+            delay = self.interval
+        else:
+            return None
+        return self.apply_jitter(delay)
+        
+    def apply_jitter(self, delay):
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+class Scheduler:
+    """One thread running one-shot, periodic and backoff jobs off a min-heap of deadlines"""
+    def __init__(self):
+        self.heap = []  # (deadline, sequence, job)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Cancel all pending jobs and wait for a running one to finish"""
+        with self.condition:
+            self.running = False
+            for _, _, job in self.heap:
+                job.cancel()
+            self.heap.clear()
+            self.condition.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=10)
+        self.thread = None
+        
+    def call_later(self, delay, func, name=None):
+        """Run func once after delay seconds"""
+        job = ScheduledJob(func, name or func.__name__)
+        self.push(job, delay)
+        return job
+        
+    def call_every(self, interval, func, jitter=0.0, initial_delay=None, name=None):
+        """Run func every interval seconds, spread by +/- jitter as a fraction of interval"""
+        job = ScheduledJob(func, name or func.__name__, interval=interval, jitter=jitter)
+        self.push(job, job.apply_jitter(interval) if initial_delay is None else initial_delay)
+        return job
+        
+    def call_with_backoff(self, func, base_delay, max_delay, jitter=0.1, name=None):
+        """Retry func until it returns True, doubling the delay up to max_delay"""
+        job = ScheduledJob(func, name or func.__name__, jitter=jitter, backoff=(base_delay, max_delay))
+        self.push(job, job.next_delay(None))
+        return job
+        
+    def push(self, job, delay):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), job))
+            # Wake the thread in case this deadline is earlier than the one it sleeps on
+            self.condition.notify()
+            
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    remaining = self.heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if not self.running:
+                    return
+                _, _, job = heapq.heappop(self.heap)
+                
+            if job.cancelled:
+                continue
+                
+            result = None
+            try:
+                result = job.func()
+            except Exception as e:
+                logging.error(f"Scheduled job {job.name} failed: {e}", exc_info=True)
+                
+            delay = job.next_delay(result)
+            if delay is None:
+                job.cancelled = True
+            elif self.running:
+                self.push(job, delay)
+
 class ResourceMonitor:
     def __init__(self, server):
         self.server = server
-        self.running = True
         self.message_rate = 0
         self.message_count = 0
         self.last_check = time.time()
+        self.job = None
         
-    def start(self):
-        threading.Thread(target=self.monitor_resources, daemon=True).start()
+    def start(self, scheduler):
+        self.job = scheduler.call_every(5.0, self.monitor_resources, name="resource_monitor")
         
     def stop(self):
-        self.running = False
+        if self.job:
+            self.job.cancel()
+            self.job = None
         
     def monitor_resources(self):
-        while self.running:
-            try:
+        observer = self.server.observer
+        try:
+            if observer.wants_resource_usage:
+                # psutil is only loaded when someone displays the numbers
+                import psutil
+                
                 # Check memory usage
                 process = psutil.Process()
                 mem_info = process.memory_info()
                 mem_mb = mem_info.rss / (1024 * 1024)
                 
-                # Check CPU usage
-                cpu_percent = psutil.cpu_percent(interval=1)
+                # CPU usage since the previous sample; never blocks the scheduler
+                cpu_percent = psutil.cpu_percent(interval=None)
                 
                 # Update GUI with resource usage
-                self.server.gui.update_resource_usage(cpu_percent, mem_mb)
-                
-                # Calculate message rate
-                now = time.time()
-                elapsed = now - self.last_check
-                if elapsed >= 1.0:
-                    self.message_rate = self.message_count / elapsed
-                    self.message_count = 0
-                    self.last_check = now
-                    
-                    if self.message_rate > CONFIG["device"]["max_message_rate"]:
-                        logging.warning(f"High message rate detected: {self.message_rate:.2f} msg/sec")
-                        self.server.throttle_messages()
+                observer.update_resource_usage(cpu_percent, mem_mb)
                 
-                time.sleep(5)
+            observer.update_pool_stats(self.server.db_manager.get_pool_stats())
+            # The plsql mode resolves bundles inside its PL/SQL block
+            if self.server.bundle_scan_mode == "session":
+                observer.update_cache_stats(self.server.bundle_cache.get_stats())
+            else:
+                observer.update_cache_stats(None)
+            observer.update_dispatcher_stats(self.server.dispatcher.get_stats())
+            observer.update_admission_stats(self.server.admission.get_stats())
+            observer.update_protocol_stats(self.server.sequences.get_stats())
+            observer.update_debounce_stats(self.server.debouncer.get_stats())
+            observer.update_status_cache_stats(self.server.status_cache.get_stats())
+            observer.update_push_stats(self.server.status_pusher.get_stats())
+            if self.server.journal is not None:
+                observer.update_journal_stats(self.server.journal.get_stats())
+            observer.update_metrics(METRICS.snapshot(), METRICS.counter_snapshot())
+            
+            # Calculate message rate
+            now = time.time()
+            elapsed = now - self.last_check
+            if elapsed >= 1.0:
+                self.message_rate = self.message_count / elapsed
+                self.message_count = 0
+                self.last_check = now
                 
-            except Exception as e:
-                logging.error(f"Resource monitor error: {str(e)}", exc_info=True)
-                time.sleep(10)
+                if self.message_rate > CONFIG["device"]["max_message_rate"]:
+                    logging.warning(f"High message rate detected: {self.message_rate:.2f} msg/sec")
+                    
+        except Exception as e:
+            logging.error(f"Resource monitor error: {str(e)}", exc_info=True)
+
+class ServerObserver:
+    """Receives MQTTServer state changes. Every hook is a no-op, so this class
+    doubles as the null sink; subclasses override what they display."""
+    wants_resource_usage = False
+    
+    def update_connection_status(self, status, is_connected):
+        pass
+        
+    def update_device_count(self, count):
+        pass
+        
+    def update_device_table(self, device_data):
+        pass
+        
+    def add_message(self, topic, message, direction):
+        pass
+        
+    def update_message_stats(self, received, sent, rate):
+        pass
+        
+    def update_resource_usage(self, cpu_percent, mem_usage):
+        pass
+        
+    def update_pool_stats(self, stats):
+        pass
+        
+    def update_cache_stats(self, stats):
+        pass
+        
+    def update_dispatcher_stats(self, shards):
+        pass
+        
+    def update_admission_stats(self, stats):
+        pass
+        
+    def update_protocol_stats(self, stats):
+        pass
+        
+    def update_debounce_stats(self, stats):
+        pass
+        
+    def update_status_cache_stats(self, stats):
+        pass
+        
+    def update_push_stats(self, stats):
+        pass
+        
+    def update_journal_stats(self, stats):
+        pass
+        
+    def update_metrics(self, latencies, counters):
+        pass
+        
+    def show_error_logs(self, rows):
+        pass
+        
+    def add_slow_message(self, record):
+        pass
+
+class LoggingObserver(ServerObserver):
+    """Headless sink that writes state changes and periodic stats to the log"""
+    def __init__(self):
+        self.stats_log_interval = CONFIG["observer"]["stats_log_interval"]
+        self.last_stats_log = 0
+        self.pool_stats = None
+        self.journal_stats = None
+        
+    def update_connection_status(self, status, is_connected):
+        logging.info(f"Server status: {status}")
+        
+    def update_device_count(self, count):
+        logging.info(f"Connected devices: {count}")
+        
+    def update_pool_stats(self, stats):
+        self.pool_stats = stats
+        
+    def update_journal_stats(self, stats):
+        self.journal_stats = stats
+        
+    def add_slow_message(self, record):
+        line = f"Slow {record['type']} from {record['mac_address']}: {record['total_ms']:.0f}ms"
+        steps = [span for span in record['spans'] if span['depth'] > 0]
+        if steps:
+            slowest = max(steps, key=lambda span: span['ms'])
+            line += f", slowest step {slowest['name']} {slowest['ms']:.0f}ms"
+        logging.warning(line)
+        
+    def update_message_stats(self, received, sent, rate):
+        now = time.monotonic()
+        if now - self.last_stats_log < self.stats_log_interval:
+            return
+        self.last_stats_log = now
+        
+        line = f"Messages: {rate:.1f}/sec | Total: R:{received} S:{sent}"
+        if self.pool_stats:
+            line += (f" | DB Pool: {self.pool_stats['busy']}/{self.pool_stats['open']} busy, "
+                     f"{self.pool_stats['validation_failures']} validation failures")
+        if self.journal_stats:
+            line += (f" | Journal: {self.journal_stats['depth']} pending, "
+                     f"{self.journal_stats['replay_rate']:.1f}/sec replayed, "
+                     f"{self.journal_stats['dead_lettered']} dead-lettered")
+        logging.info(line)
 
-class DashboardGUI:
+class DashboardGUI(ServerObserver):
+    wants_resource_usage = True
+    
     def __init__(self, root):
         self.root = root
         self.root.title("MQTT RFID Server - Optimized")
@@ -186,6 +1191,9 @@ class DashboardGUI:
         self.message_stats_label = ttk.Label(self.stats_frame, text="Messages: 0/sec | Total: 0")
         self.message_stats_label.pack(side=tk.RIGHT)
         
+        self.pool_stats_label = ttk.Label(self.stats_frame, text="DB Pool: 0/0 busy")
+        self.pool_stats_label.pack(side=tk.RIGHT, padx=20)
+        
         # Notebook (tabs)
         self.notebook = ttk.Notebook(self.main_frame)
         self.notebook.pack(fill=tk.BOTH, expand=True)
@@ -202,6 +1210,12 @@ class DashboardGUI:
         # Errors Tab
         self.setup_errors_tab()
         
+        # Metrics Tab
+        self.setup_metrics_tab()
+        
+        # Slow Messages Tab
+        self.setup_slow_messages_tab()
+        
         # Status bar
         self.status_bar = ttk.Label(self.main_frame, text="Ready", relief=tk.SUNKEN)
         self.status_bar.pack(fill=tk.X, pady=(5, 0))
@@ -231,6 +1245,13 @@ class DashboardGUI:
         self.start_time = None
         self.server = None
         
+        # Ring buffer of pending GUI updates, drained at a fixed frame rate
+        self.events = deque(maxlen=CONFIG["gui"]["event_buffer"])
+        self.frame_interval = int(1000 / CONFIG["gui"]["frame_rate"])
+        self.recent_line_limit = CONFIG["gui"]["recent_lines"]
+        self.log_line_limit = CONFIG["gui"]["log_lines"]
+        self.root.after(self.frame_interval, self.drain_events)
+        
     def setup_dashboard_tab(self):
         self.dashboard_tab = ttk.Frame(self.notebook)
         self.notebook.add(self.dashboard_tab, text="Dashboard")
@@ -272,6 +1293,30 @@ class DashboardGUI:
         self.throughput_label = ttk.Label(right_stats, text="Message Rate: 0 msg/sec")
         self.throughput_label.pack(anchor=tk.W)
         
+        self.bundle_cache_label = ttk.Label(right_stats, text="Bundle Cache: 0 hits / 0 misses")
+        self.bundle_cache_label.pack(anchor=tk.W)
+        
+        self.status_cache_label = ttk.Label(right_stats, text="Status Cache: 0 hits / 0 misses")
+        self.status_cache_label.pack(anchor=tk.W)
+        
+        self.push_label = ttk.Label(right_stats, text="Status Pushes: 0")
+        self.push_label.pack(anchor=tk.W)
+        
+        self.journal_label = ttk.Label(right_stats, text="Journal: off")
+        self.journal_label.pack(anchor=tk.W)
+        
+        self.dispatcher_label = ttk.Label(left_stats, text="Queues: 0 pending")
+        self.dispatcher_label.pack(anchor=tk.W)
+        
+        self.admission_label = ttk.Label(left_stats, text="Rate Limited: 0")
+        self.admission_label.pack(anchor=tk.W)
+        
+        self.protocol_label = ttk.Label(right_stats, text="Protocol v2: 0 messages")
+        self.protocol_label.pack(anchor=tk.W)
+        
+        self.debounce_label = ttk.Label(left_stats, text="Repeated Scans: 0")
+        self.debounce_label.pack(anchor=tk.W)
+        
         # Recent messages
         recent_frame = ttk.Frame(self.dashboard_tab)
         recent_frame.pack(fill=tk.BOTH, expand=True)
@@ -291,6 +1336,33 @@ class DashboardGUI:
         self.devices_tab = ttk.Frame(self.notebook)
         self.notebook.add(self.devices_tab, text="Devices")
         
+        # Filter controls
+        filter_frame = ttk.Frame(self.devices_tab)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        
+        ttk.Label(filter_frame, text="Status:").pack(side=tk.LEFT)
+        self.device_status_filter = ttk.Combobox(
+            filter_frame,
+            values=("All", "Active", "Inactive", "Disconnected"),
+            state="readonly",
+            width=14
+        )
+        self.device_status_filter.current(0)
+        self.device_status_filter.pack(side=tk.LEFT, padx=5)
+        self.device_status_filter.bind("<<ComboboxSelected>>", lambda event: self.apply_device_filter())
+        
+        ttk.Label(filter_frame, text="Seen within (min, 0 = any):").pack(side=tk.LEFT, padx=(10, 0))
+        self.device_age_filter = ttk.Spinbox(
+            filter_frame,
+            from_=0,
+            to=1440,
+            width=6,
+            command=self.apply_device_filter
+        )
+        self.device_age_filter.set(0)
+        self.device_age_filter.pack(side=tk.LEFT, padx=5)
+        self.device_age_filter.bind("<Return>", lambda event: self.apply_device_filter())
+        
         # Create treeview with scrollbars
         tree_frame = ttk.Frame(self.devices_tab)
         tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -302,12 +1374,10 @@ class DashboardGUI:
             selectmode='browse'
         )
         
-        # Define headings
-        self.devices_tree.heading('mac_address', text='MAC Address')
-        self.devices_tree.heading('last_seen', text='Last Seen')
-        self.devices_tree.heading('status', text='Status')
-        self.devices_tree.heading('messages', text='Messages')
-        self.devices_tree.heading('ip_address', text='IP Address')
+        # Define headings; clicking one sorts by that column
+        for column, text in (('mac_address', 'MAC Address'), ('last_seen', 'Last Seen'),
+                             ('status', 'Status'), ('messages', 'Messages'), ('ip_address', 'IP Address')):
+            self.devices_tree.heading(column, text=text, command=lambda c=column: self.sort_devices(c))
         
         # Configure column widths
         self.devices_tree.column('mac_address', width=200, anchor=tk.W)
@@ -319,7 +1389,18 @@ class DashboardGUI:
         # Add scrollbars
         yscroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.devices_tree.yview)
         xscroll = ttk.Scrollbar(tree_frame, orient=tk.HORIZONTAL, command=self.devices_tree.xview)
-        self.devices_tree.configure(yscroll=ysroll.set, xscroll=xscroll.set)
+        self.devices_tree.configure(yscroll=yscroll.set, xscroll=xscroll.set)
+        
+        # Status colours are configured once, rows only switch tags
+        self.devices_tree.tag_configure('active', background='#d4edda')
+        self.devices_tree.tag_configure('inactive', background='#fff3cd')
+        self.devices_tree.tag_configure('error', background='#f8d7da')
+        
+        self.device_items = {}       # mac -> treeview item id
+        self.device_rows = {}        # mac -> (values, last seen datetime)
+        self.hidden_devices = set()  # macs detached by the current filter
+        self.device_sort = (None, False)
+        self.device_max_age = 0
         
         # Grid layout
         self.devices_tree.grid(row=0, column=0, sticky=tk.NSEW)
@@ -348,6 +1429,8 @@ class DashboardGUI:
             state=tk.DISABLED
         )
         self.message_log.pack(fill=tk.BOTH, expand=True)
+        self.message_log.tag_config("in", foreground="blue")
+        self.message_log.tag_config("out", foreground="green")
         
         # Add control buttons
         button_frame = ttk.Frame(self.messages_tab)
@@ -401,7 +1484,7 @@ class DashboardGUI:
         # Add scrollbars
         yscroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.errors_tree.yview)
         xscroll = ttk.Scrollbar(tree_frame, orient=tk.HORIZONTAL, command=self.errors_tree.xview)
-        self.errors_tree.configure(yscroll=ysroll.set, xscroll=xscroll.set)
+        self.errors_tree.configure(yscroll=yscroll.set, xscroll=xscroll.set)
         
         # Grid layout
         self.errors_tree.grid(row=0, column=0, sticky=tk.NSEW)
@@ -429,15 +1512,102 @@ class DashboardGUI:
         )
         clear_button.pack(side=tk.LEFT, padx=5)
         
-    def show_devices_menu(self, event):
-        item = self.devices_tree.identify_row(event.y)
-        if item:
-            self.devices_tree.selection_set(item)
-            self.devices_menu.post(event.x_root, event.y_root)
+    def setup_metrics_tab(self):
+        self.metrics_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.metrics_tab, text="Metrics")
         
-    def refresh_devices(self):
-        if self.server:
-            self.server.refresh_device_status()
+        ttk.Label(
+            self.metrics_tab,
+            text=f"Latency per stage in ms; Prometheus text on "
+                 f"http://{CONFIG['metrics']['host']}:{CONFIG['metrics']['port']}/metrics"
+        ).pack(anchor=tk.W)
+        
+        tree_frame = ttk.Frame(self.metrics_tab)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.metrics_tree = ttk.Treeview(
+            tree_frame,
+            columns=('stage', 'labels', 'count', 'p50', 'p95', 'p99', 'max'),
+            show='headings',
+            selectmode='browse'
+        )
+        for column, text, width in (('stage', 'Stage', 120), ('labels', 'Labels', 220), ('count', 'Count', 80),
+                                    ('p50', 'p50', 80), ('p95', 'p95', 80), ('p99', 'p99', 80), ('max', 'Max', 80)):
+            self.metrics_tree.heading(column, text=text)
+            self.metrics_tree.column(column, width=width, anchor=tk.W if column in ('stage', 'labels') else tk.E)
+            
+        yscroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.metrics_tree.yview)
+        self.metrics_tree.configure(yscroll=yscroll.set)
+        self.metrics_tree.grid(row=0, column=0, sticky=tk.NSEW)
+        yscroll.grid(row=0, column=1, sticky=tk.NS)
+        tree_frame.grid_rowconfigure(0, weight=1)
+        tree_frame.grid_columnconfigure(0, weight=1)
+        
+        self.counters_label = ttk.Label(self.metrics_tab, text="Counters: none yet", wraplength=900, justify=tk.LEFT)
+        self.counters_label.pack(anchor=tk.W, pady=(5, 0))
+        
+    def setup_slow_messages_tab(self):
+        self.slow_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.slow_tab, text="Slow messages")
+        
+        ttk.Label(
+            self.slow_tab,
+            text=f"Messages slower than {CONFIG['tracing']['slow_ms']}ms end to end "
+                 f"(also written to {CONFIG['tracing']['slow_log']}); select one for its spans"
+        ).pack(anchor=tk.W)
+        
+        panes = ttk.PanedWindow(self.slow_tab, orient=tk.VERTICAL)
+        panes.pack(fill=tk.BOTH, expand=True)
+        
+        tree_frame = ttk.Frame(panes)
+        self.slow_tree = ttk.Treeview(
+            tree_frame,
+            columns=('time', 'type', 'mac', 'total', 'payload'),
+            show='headings',
+            selectmode='browse'
+        )
+        for column, text, width in (('time', 'Time', 170), ('type', 'Type', 130), ('mac', 'MAC Address', 150),
+                                    ('total', 'Total ms', 80), ('payload', 'Payload', 300)):
+            self.slow_tree.heading(column, text=text)
+            self.slow_tree.column(column, width=width, anchor=tk.E if column == 'total' else tk.W)
+        yscroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.slow_tree.yview)
+        self.slow_tree.configure(yscroll=yscroll.set)
+        self.slow_tree.grid(row=0, column=0, sticky=tk.NSEW)
+        yscroll.grid(row=0, column=1, sticky=tk.NS)
+        tree_frame.grid_rowconfigure(0, weight=1)
+        tree_frame.grid_columnconfigure(0, weight=1)
+        panes.add(tree_frame, weight=2)
+        
+        self.slow_spans = scrolledtext.ScrolledText(panes, height=10, font=('Courier New', 9), state=tk.DISABLED)
+        panes.add(self.slow_spans, weight=1)
+        
+        self.slow_records = {}  # treeview item id -> trace record
+        self.slow_row_limit = CONFIG["tracing"]["gui_rows"]
+        self.slow_tree.bind("<<TreeviewSelect>>", lambda event: self.show_slow_spans())
+        
+    def show_slow_spans(self):
+        selected = self.slow_tree.selection()
+        record = self.slow_records.get(selected[0]) if selected else None
+        lines = []
+        if record:
+            lines.append(f"{record['type']} from {record['mac_address']}: {record['total_ms']:.3f}ms")
+            for span in record['spans']:
+                indent = "  " * span['depth']
+                lines.append(f"{span['start_ms']:10.3f}ms  {indent}{span['name']:<40s} {span['ms']:10.3f}ms")
+        self.slow_spans.config(state=tk.NORMAL)
+        self.slow_spans.delete(1.0, tk.END)
+        self.slow_spans.insert(tk.END, "\n".join(lines))
+        self.slow_spans.config(state=tk.DISABLED)
+        
+    def show_devices_menu(self, event):
+        item = self.devices_tree.identify_row(event.y)
+        if item:
+            self.devices_tree.selection_set(item)
+            self.devices_menu.post(event.x_root, event.y_root)
+        
+    def refresh_devices(self):
+        if self.server:
+            self.server.refresh_device_status()
         
     def disconnect_device(self):
         selected_item = self.devices_tree.selection()
@@ -457,12 +1627,110 @@ class DashboardGUI:
         
     def refresh_errors(self):
         if self.server:
-            self.server.refresh_error_logs()
+            # Query off the Tk thread; the rows come back through show_error_logs
+            threading.Thread(target=self.server.refresh_error_logs, daemon=True).start()
         
     def clear_errors(self):
         self.errors_tree.delete(*self.errors_tree.get_children())
         
+    # Thread-safe entry points. Any thread may call these; they only append to
+    # the event ring buffer, which drain_events applies on the Tk thread.
+    
+    def post(self, key, renderer, *args):
+        """Queue a GUI update; updates sharing a key within one frame collapse to the latest"""
+        self.events.append((key, renderer, args))
+        
+    def add_message(self, topic, message, direction):
+        if self.log_paused:
+            return
+        self.events.append((MESSAGE_EVENT, None, (datetime.now(), topic, message, direction)))
+        
     def update_connection_status(self, status, is_connected):
+        self.post('connection_status', self.render_connection_status, status, is_connected)
+        
+    def update_resource_usage(self, cpu_percent, mem_usage):
+        self.post('resource_usage', self.render_resource_usage, cpu_percent, mem_usage)
+        
+    def update_pool_stats(self, stats):
+        self.post('pool_stats', self.render_pool_stats, stats)
+        
+    def update_cache_stats(self, stats):
+        self.post('cache_stats', self.render_cache_stats, stats)
+        
+    def update_dispatcher_stats(self, shards):
+        self.post('dispatcher_stats', self.render_dispatcher_stats, shards)
+        
+    def update_admission_stats(self, stats):
+        self.post('admission_stats', self.render_admission_stats, stats)
+        
+    def update_protocol_stats(self, stats):
+        self.post('protocol_stats', self.render_protocol_stats, stats)
+        
+    def update_debounce_stats(self, stats):
+        self.post('debounce_stats', self.render_debounce_stats, stats)
+        
+    def update_status_cache_stats(self, stats):
+        self.post('status_cache_stats', self.render_status_cache_stats, stats)
+        
+    def update_push_stats(self, stats):
+        self.post('push_stats', self.render_push_stats, stats)
+        
+    def update_journal_stats(self, stats):
+        self.post('journal_stats', self.render_journal_stats, stats)
+        
+    def update_metrics(self, latencies, counters):
+        self.post('metrics', self.render_metrics, latencies, counters)
+        
+    def add_slow_message(self, record):
+        # Every slow message gets a row, so these are applied in order rather than coalesced
+        self.post(None, self.render_slow_message, record)
+        
+    def update_device_count(self, count):
+        self.post('device_count', self.render_device_count, count)
+        
+    def update_device_table(self, device_data):
+        self.post(('device', device_data['mac_address']), self.render_device_table, device_data)
+        
+    def add_error_to_table(self, error_data):
+        self.post(None, self.render_error_to_table, error_data)
+        
+    def update_message_stats(self, received, sent, rate):
+        self.post('message_stats', self.render_message_stats, received, sent, rate)
+        
+    def show_error_logs(self, rows):
+        self.post('error_logs', self.render_error_logs, rows)
+        
+    def update_thread_count(self, count):
+        self.post('thread_count', self.render_thread_count, count)
+        
+    def drain_events(self):
+        """Apply queued GUI updates once per frame on the Tk thread"""
+        try:
+            messages = []
+            ordered = []
+            latest = {}
+            for _ in range(len(self.events)):
+                key, renderer, args = self.events.popleft()
+                if key is MESSAGE_EVENT:
+                    messages.append(args)
+                elif key is None:
+                    ordered.append((renderer, args))
+                else:
+                    latest[key] = (renderer, args)
+                    
+            if messages:
+                # Anything older than the visible window would be trimmed right away
+                self.render_messages(messages[-self.log_line_limit:])
+            for renderer, args in ordered:
+                renderer(*args)
+            for renderer, args in latest.values():
+                renderer(*args)
+        except Exception as e:
+            logging.error(f"GUI update failed: {e}", exc_info=True)
+        finally:
+            self.root.after(self.frame_interval, self.drain_events)
+            
+    def render_connection_status(self, status, is_connected):
         color = "green" if is_connected else "red"
         self.connection_status.config(text=f"Status: {status}", foreground=color)
         
@@ -478,49 +1746,142 @@ class DashboardGUI:
             self.start_button.config(state=tk.NORMAL)
             self.stop_button.config(state=tk.DISABLED)
             
-    def update_resource_usage(self, cpu_percent, mem_usage):
+    def render_resource_usage(self, cpu_percent, mem_usage):
         self.resource_status.config(text=f"CPU: {cpu_percent}% | MEM: {mem_usage:.1f}MB")
             
-    def update_device_count(self, count):
-        self.device_count_label.config(text=f"Devices: {count}")
-        
-    def add_message(self, topic, message, direction):
-        if self.log_paused:
+    def render_pool_stats(self, stats):
+        self.pool_stats_label.config(
+            text=f"DB Pool: {stats['busy']}/{stats['open']} busy | "
+                 f"Wait: {stats['avg_wait_ms']:.1f}ms avg, {stats['max_wait_ms']:.0f}ms max | "
+                 f"Validation failures: {stats['validation_failures']} ({stats['reconnects']} reconnects)"
+        )
+            
+    def render_cache_stats(self, stats):
+        if stats is None:
+            self.bundle_cache_label.config(text="Bundle Cache: not used in plsql mode")
             return
+        self.bundle_cache_label.config(
+            text=f"Bundle Cache: {stats['hits']} hits / {stats['misses']} misses "
+                 f"({stats['hit_ratio']:.0%}) | {stats['evictions']} evicted | {stats['size']} cached"
+        )
             
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        direction_icon = "⬇️" if direction == "in" else "⬆️"
-        color = "blue" if direction == "in" else "green"
+    def render_status_cache_stats(self, stats):
+        self.status_cache_label.config(
+            text=f"Status Cache: {stats['hits']} hits / {stats['misses']} misses "
+                 f"({stats['hit_ratio']:.0%}) | {stats['invalidations']} invalidated | {stats['size']} cached"
+        )
+            
+    def render_slow_message(self, record):
+        item = self.slow_tree.insert('', 0, values=(
+            record['time'], record['type'], record['mac_address'],
+            f"{record['total_ms']:.1f}", record['payload']
+        ))
+        self.slow_records[item] = record
+        children = self.slow_tree.get_children()
+        for old in children[self.slow_row_limit:]:
+            self.slow_tree.delete(old)
+            self.slow_records.pop(old, None)
+            
+    def render_metrics(self, latencies, counters):
+        self.metrics_tree.delete(*self.metrics_tree.get_children())
+        for stage, labels, count, p50, p95, p99, slowest in latencies:
+            self.metrics_tree.insert('', tk.END, values=(
+                stage,
+                ", ".join(f"{key}={value}" for key, value in labels),
+                count,
+                f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}", f"{slowest:.2f}"
+            ))
+        self.counters_label.config(text="Counters: " + (" | ".join(
+            f"{name}{{{', '.join(f'{key}={label}' for key, label in labels)}}}: {value}"
+            for (name, labels), value in counters
+        ) or "none yet"))
+            
+    def render_push_stats(self, stats):
+        self.push_label.config(
+            text=f"Status Pushes: {stats['pushed']} sent | {stats['unchanged']} unchanged | "
+                 f"{stats['pending']} deadlines pending"
+        )
+            
+    def render_journal_stats(self, stats):
+        self.journal_label.config(
+            text=f"Journal: {stats['depth']} pending | {stats['replay_rate']:.1f}/sec replayed | "
+                 f"{stats['replay_failures']} failed passes | {stats['dead_lettered']} dead-lettered"
+        )
+            
+    def render_dispatcher_stats(self, shards):
+        depth = sum(shard['depth'] for shard in shards)
+        busiest = max(shards, key=lambda shard: shard['depth'])
+        processed = sum(shard['processed'] for shard in shards)
+        avg_wait = sum(shard['avg_wait_ms'] * shard['processed'] for shard in shards) / processed if processed else 0.0
+        self.dispatcher_label.config(
+            text=f"Queues: {depth} pending (shard {busiest['shard']}: {busiest['depth']}) | "
+                 f"Wait: {avg_wait:.1f}ms avg, {max(shard['max_wait_ms'] for shard in shards):.0f}ms max | "
+                 f"Shed: {sum(shard['shed'] for shard in shards)} "
+                 f"Rejected: {sum(shard['rejected'] for shard in shards)}"
+        )
+            
+    def render_admission_stats(self, stats):
+        rejected = ", ".join(f"{reason}: {count}" for reason, count in stats['rejected'].items()) or "0"
+        top = ", ".join(f"{mac} ({count})" for mac, count in stats['top_devices'][:3])
+        self.admission_label.config(
+            text=f"Rate Limited: {rejected}" + (f" | Top: {top}" if top else "")
+        )
+            
+    def render_protocol_stats(self, stats):
+        self.protocol_label.config(
+            text=f"Protocol v2: {stats['received']} messages from {stats['devices']} devices | "
+                 f"Duplicates: {stats['duplicates']} | Lost: {stats['lost']} | Restarts: {stats['restarts']}"
+        )
+            
+    def render_debounce_stats(self, stats):
+        top = ", ".join(f"{mac} ({count})" for mac, count in stats['top_devices'][:3])
+        self.debounce_label.config(
+            text=f"Repeated Scans: {stats['suppressed']} answered from memory" + (f" | Top: {top}" if top else "")
+        )
+            
+    def render_device_count(self, count):
+        self.device_count_label.config(text=f"Devices: {count}")
         
+    def render_messages(self, messages):
+        """Append a batch of messages to both logs in one insert each, then trim"""
+        recent_lines = []
+        log_chunks = []
+        for received_at, topic, message, direction in messages:
+            timestamp = received_at.strftime("%H:%M:%S.%f")[:-3]
+            direction_icon = "⬇️" if direction == "in" else "⬆️"
+            recent_lines.append(f"{timestamp} {direction_icon} {topic}: {message[:100]}\n")
+            log_chunks.append(f"{timestamp} {direction_icon} {topic}\n{message}\n{'-'*80}\n")
+            log_chunks.append(direction)
+            
         # Add to recent messages (dashboard)
-        recent_msg = f"{timestamp} {direction_icon} {topic}: {message[:100]}"
         self.recent_messages.config(state=tk.NORMAL)
-        self.recent_messages.insert(tk.END, recent_msg + "\n")
+        self.recent_messages.insert(tk.END, "".join(recent_lines))
+        self.trim_text(self.recent_messages, self.recent_line_limit)
         self.recent_messages.config(state=tk.DISABLED)
         self.recent_messages.see(tk.END)
         
         # Add to full message log
-        full_msg = f"{timestamp} {direction_icon} {topic}\n{message}\n{'-'*80}\n"
         self.message_log.config(state=tk.NORMAL)
-        self.message_log.tag_config(direction, foreground=color)
-        self.message_log.insert(tk.END, full_msg, direction)
+        self.message_log.insert(tk.END, *log_chunks)
+        self.trim_text(self.message_log, self.log_line_limit)
         self.message_log.config(state=tk.DISABLED)
         self.message_log.see(tk.END)
         
         # Update last message label
-        self.last_message_label.config(text=f"Last Message: {timestamp} ({direction_icon} {topic})")
+        received_at, topic, _, direction = messages[-1]
+        direction_icon = "⬇️" if direction == "in" else "⬆️"
+        self.last_message_label.config(
+            text=f"Last Message: {received_at.strftime('%H:%M:%S.%f')[:-3]} ({direction_icon} {topic})"
+        )
         
-    def update_device_table(self, device_data):
-        # Find existing item or add new one
-        mac_address = device_data['mac_address']
-        children = self.devices_tree.get_children()
-        item_id = None
+    def trim_text(self, widget, max_lines):
+        """Delete the oldest lines so a Text widget never exceeds max_lines"""
+        line_count = int(widget.index('end-1c').split('.')[0])
+        if line_count > max_lines:
+            widget.delete('1.0', f"{line_count - max_lines + 1}.0")
         
-        for child in children:
-            if self.devices_tree.item(child, 'values')[0] == mac_address:
-                item_id = child
-                break
-                
+    def render_device_table(self, device_data):
+        mac_address = device_data['mac_address']
         values = (
             device_data['mac_address'],
             device_data['last_seen'],
@@ -529,23 +1890,85 @@ class DashboardGUI:
             device_data.get('ip_address', 'N/A')
         )
         
-        if item_id:
-            self.devices_tree.item(item_id, values=values)
-        else:
-            item_id = self.devices_tree.insert('', tk.END, values=values)
-            
+        # Only repaint rows whose values actually changed
+        row = self.device_rows.get(mac_address)
+        if row is not None and row[0] == values:
+            return
+        last_seen = row[1] if row is not None and row[0][1] == values[1] else \
+            datetime.strptime(values[1], "%Y-%m-%d %H:%M:%S")
+        self.device_rows[mac_address] = (values, last_seen)
+        
         # Color status
         if device_data['status'] == "Active":
-            self.devices_tree.tag_configure('active', background='#d4edda')
-            self.devices_tree.item(item_id, tags=('active',))
+            tag = 'active'
         elif device_data['status'] == "Inactive":
-            self.devices_tree.tag_configure('inactive', background='#fff3cd')
-            self.devices_tree.item(item_id, tags=('inactive',))
+            tag = 'inactive'
         else:
-            self.devices_tree.tag_configure('error', background='#f8d7da')
-            self.devices_tree.item(item_id, tags=('error',))
+            tag = 'error'
             
-    def add_error_to_table(self, error_data):
+        item_id = self.device_items.get(mac_address)
+        if item_id is None:
+            self.device_items[mac_address] = self.devices_tree.insert('', tk.END, values=values, tags=(tag,))
+        else:
+            self.devices_tree.item(item_id, values=values, tags=(tag,))
+            
+        if self.device_filter_active():
+            self.set_device_visible(mac_address, self.device_matches_filter(mac_address))
+            
+    def device_filter_active(self):
+        return self.device_status_filter.get() != "All" or self.device_max_age > 0
+        
+    def device_matches_filter(self, mac_address):
+        values, last_seen = self.device_rows[mac_address]
+        status = self.device_status_filter.get()
+        if status != "All" and values[2] != status:
+            return False
+        if self.device_max_age and (datetime.now() - last_seen).total_seconds() > self.device_max_age * 60:
+            return False
+        return True
+        
+    def set_device_visible(self, mac_address, visible):
+        """Detach or reattach a row without touching the others"""
+        item_id = self.device_items[mac_address]
+        if visible and mac_address in self.hidden_devices:
+            self.hidden_devices.discard(mac_address)
+            self.devices_tree.move(item_id, '', tk.END)
+        elif not visible and mac_address not in self.hidden_devices:
+            self.hidden_devices.add(mac_address)
+            self.devices_tree.detach(item_id)
+            
+    def apply_device_filter(self):
+        try:
+            self.device_max_age = max(0, int(self.device_age_filter.get() or 0))
+        except ValueError:
+            self.device_max_age = 0
+            
+        for mac_address in self.device_rows:
+            self.set_device_visible(mac_address, self.device_matches_filter(mac_address))
+            
+        # Reattached rows land at the end, so restore the current ordering
+        if self.device_sort[0]:
+            self.sort_devices(self.device_sort[0], toggle=False)
+            
+    def sort_devices(self, column, toggle=True):
+        previous, reverse = self.device_sort
+        if toggle:
+            reverse = not reverse if previous == column else False
+        self.device_sort = (column, reverse)
+        
+        if column == 'last_seen':
+            key = lambda mac: self.device_rows[mac][1]
+        elif column == 'messages':
+            key = lambda mac: int(self.device_rows[mac][0][3])
+        else:
+            index = ('mac_address', 'last_seen', 'status', 'messages', 'ip_address').index(column)
+            key = lambda mac: str(self.device_rows[mac][0][index])
+            
+        visible = [mac for mac in self.device_rows if mac not in self.hidden_devices]
+        for position, mac_address in enumerate(sorted(visible, key=key, reverse=reverse)):
+            self.devices_tree.move(self.device_items[mac_address], '', position)
+            
+    def render_error_to_table(self, error_data):
         """Add a new error to the errors treeview"""
         self.errors_tree.insert('', tk.END, values=(
             error_data.get('timestamp', ''),
@@ -555,7 +1978,12 @@ class DashboardGUI:
             error_data.get('rfid', '')
         ))
             
-    def update_message_stats(self, received, sent, rate):
+    def render_error_logs(self, rows):
+        self.errors_tree.delete(*self.errors_tree.get_children())
+        for row in rows:
+            self.errors_tree.insert('', tk.END, values=row)
+            
+    def render_message_stats(self, received, sent, rate):
         self.message_stats_label.config(
             text=f"Messages: {rate:.1f}/sec | Total: R:{received} S:{sent}"
         )
@@ -568,7 +1996,7 @@ class DashboardGUI:
             self.uptime_label.config(text=f"Uptime: {hours:02d}:{minutes:02d}:{seconds:02d}")
         self.root.after(1000, self.update_uptime)
             
-    def update_thread_count(self, count):
+    def render_thread_count(self, count):
         self.threads_label.config(text=f"Active Threads: {count}")
         
     def start_server(self):
@@ -585,14 +2013,803 @@ class DashboardGUI:
             self.server = None
             self.update_connection_status("Disconnected", False)
 
-class DatabaseManager:
+class ErrorLogWriter:
+    """Background sink that batches error rows into RFID_SYSTEM_ERROR_LOGS"""
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.batch_size = CONFIG["error_log"]["batch_size"]
+        self.flush_interval = CONFIG["error_log"]["flush_interval"]
+        # deque with maxlen drops the oldest row when full
+        self.queue = deque(maxlen=CONFIG["error_log"]["queue_size"])
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="error_log_writer", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Stop the writer and flush whatever is still queued"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=10)
+            self.thread = None
+            
+    def enqueue(self, row):
+        """Queue a row without blocking on the database"""
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.stats['dropped'] += 1
+            self.queue.append(row)
+            self.stats['queued'] += 1
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify()
+                
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.queue)
+        return stats
+        
+    def run(self):
+        while True:
+            with self.condition:
+                if self.running and len(self.queue) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.batch_size))]
+                stopping = not self.running
+                
+            if batch:
+                self.write_batch(batch)
+            elif stopping:
+                break
+                
+    def write_batch(self, batch):
+        try:
+            self.db_manager.write_error_batch(batch)
+            with self.condition:
+                self.stats['written'] += len(batch)
+        except Exception as e:
+            with self.condition:
+                self.stats['failed'] += len(batch)
+            logging.error(f"Failed to write {len(batch)} error log rows: {e}")
+
+# MAC addresses and numbers vary between otherwise identical messages
+ERROR_TEMPLATE_PATTERN = re.compile(r"(?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}|\d+")
+
+class ErrorAggregator:
+    """Folds repeats of the same error into one row per window with first/last seen and a count"""
+    def __init__(self, writer):
+        self.writer = writer
+        self.window = CONFIG["error_log"]["aggregate_window"]
+        self.max_keys = CONFIG["error_log"]["aggregate_max_keys"]
+        self.open = {}  # key -> [first row, first seen, last seen, count, window deadline]
+        self.lock = threading.Lock()
+        self.stats = {'events': 0, 'rows': 0, 'bypassed': 0}
+        
+    def add(self, row):
+        """Count an event; rows with a stack trace are unique and go straight to the writer"""
+        if row['stack_trace']:
+            self.bypass(row)
+            return
+            
+        template = ERROR_TEMPLATE_PATTERN.sub("#", row['error_message'])
+        key = (row['error_type'], row['mac_address'], row['rfid'], template)
+        now = row['timestamp']
+        
+        with self.lock:
+            self.stats['events'] += 1
+            entry = self.open.get(key)
+            if entry is not None:
+                entry[2] = now
+                entry[3] += 1
+                return
+            if len(self.open) >= self.max_keys:
+                self.stats['bypassed'] += 1
+            else:
+                self.open[key] = [row, now, now, 1, time.monotonic() + self.window]
+                return
+        self.writer.enqueue(row)
+        
+    def bypass(self, row):
+        with self.lock:
+            self.stats['events'] += 1
+            self.stats['bypassed'] += 1
+        self.writer.enqueue(row)
+        
+    def flush(self, force=False):
+        """Emit one row for every window that has closed (all of them when force is set)"""
+        now = time.monotonic()
+        with self.lock:
+            due = [key for key, entry in self.open.items() if force or entry[4] <= now]
+            entries = [self.open.pop(key) for key in due]
+            self.stats['rows'] += len(entries)
+            
+        for row, first_seen, last_seen, count, _ in entries:
+            if count > 1:
+                summary = (f"Occurrences: {count}, first seen {first_seen:%Y-%m-%d %H:%M:%S}, "
+                           f"last seen {last_seen:%Y-%m-%d %H:%M:%S}")
+                details = f"{summary}; {row['error_details']}" if row['error_details'] else summary
+                row = dict(row, error_details=details[:4000], timestamp=last_seen)
+            self.writer.enqueue(row)
+            
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.open)
+        return stats
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters"""
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        
+    def get(self, key):
+        """Return the cached value, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+                
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+                
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+            
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+                
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+                
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+class WorkstationStatusCache:
+    """Per-MAC status answers, valid until a session event or the next threshold crossing"""
     def __init__(self):
-        self.pool = None
+        self.entries = {}  # mac -> (response, monotonic expiry or None)
+        self.generation = 0
         self.lock = threading.Lock()
-        self.initialize_pool()
+        self.stats = {'hits': 0, 'misses': 0, 'expirations': 0, 'invalidations': 0}
+        
+    def get(self, mac_address):
+        with self.lock:
+            entry = self.entries.get(mac_address)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self.stats['hits'] += 1
+                    return response
+                del self.entries[mac_address]
+                self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+            return None
+            
+    def put(self, mac_address, response, valid_for, generation):
+        """Store an answer computed at generation; dropped if an invalidation happened meanwhile"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            expires_at = None if valid_for is None else time.monotonic() + valid_for
+            self.entries[mac_address] = (response, expires_at)
+            
+    def invalidate(self, mac_address=None):
+        """Session listener: forget one MAC, or everything when mac_address is None"""
+        with self.lock:
+            self.generation += 1
+            if mac_address is None:
+                self.entries.clear()
+            elif self.entries.pop(mac_address, None) is not None:
+                self.stats['invalidations'] += 1
+                
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+class StatusPusher:
+    """Publishes workstation status changes without waiting for a poll.
+    
+    Every active bundle puts its warning and limit crossings on a min-heap of
+    deadlines; session events add an entry due right away. A single scheduler
+    job is armed for the earliest deadline. Entries for bundles that have since
+    ended are skipped when they come due, so each transition costs O(log n).
+    """
+    # Crossing a threshold is checked a moment late so the status has certainly changed
+    SLACK = 0.05
+    
+    def __init__(self, server):
+        self.server = server
+        self.push_delay = CONFIG["workstation"]["push_delay"]
+        self.heap = []  # (monotonic deadline, sequence, mac, bundle start time or None)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.job = None
+        self.armed_at = None
+        self.last_pushed = {}  # mac -> last status published
+        self.stats = {'pushed': 0, 'unchanged': 0, 'stale': 0}
+        
+    def on_session_change(self, mac_address):
+        """Session listener: recheck the MAC soon and queue its bundle's threshold crossings"""
+        sessions = self.server.sessions
+        macs = list(sessions.active_bundles) if mac_address is None else [mac_address]
+        now = time.monotonic()
+        with self.lock:
+            if mac_address is not None:
+                self.push(now + self.push_delay, mac_address, None)
+            for mac in macs:
+                active = sessions.active_bundle(mac)
+                if active is not None:
+                    self.push_thresholds(mac, active[2], now)
+        self.arm()
+        
+    def push_thresholds(self, mac_address, start_time, now):
+        elapsed = (datetime.now() - start_time).total_seconds()
+        for minutes in (CONFIG["workstation"]["warning_minutes"], CONFIG["workstation"]["limit_minutes"]):
+            remaining = minutes * 60 - elapsed
+            if remaining > 0:
+                self.push(now + remaining + self.SLACK, mac_address, start_time)
+                
+    def push(self, deadline, mac_address, start_time):
+        heapq.heappush(self.heap, (deadline, next(self.sequence), mac_address, start_time))
+        
+    def arm(self):
+        """Point the scheduler job at the earliest deadline if it is not already"""
+        with self.lock:
+            if not self.heap:
+                return
+            deadline = self.heap[0][0]
+            if self.job is not None and self.job.active and self.armed_at <= deadline:
+                return
+            if self.job is not None:
+                self.job.cancel()
+            self.armed_at = deadline
+            self.job = self.server.scheduler.call_later(
+                max(0.0, deadline - time.monotonic()), self.run_due, name="status_push"
+            )
+            
+    def run_due(self):
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            self.job = None
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+                
+        for _, _, mac_address, start_time in due:
+            if start_time is not None:
+                active = self.server.sessions.active_bundle(mac_address)
+                if active is None or active[2] != start_time:
+                    with self.lock:
+                        self.stats['stale'] += 1
+                    continue
+            self.publish_status(mac_address)
+        self.arm()
+        
+    def publish_status(self, mac_address):
+        status = self.server.get_workstation_status(mac_address)
+        # Compare and record under the lock so two threads cannot both push, or both skip, one change
+        with self.lock:
+            if status == CONFIG["responses"]["no_operator"]:
+                # Logged-out readers show the login prompt, not a status colour
+                self.last_pushed.pop(mac_address, None)
+                return
+            if self.last_pushed.get(mac_address) == status:
+                self.stats['unchanged'] += 1
+                return
+            self.last_pushed[mac_address] = status
+            self.stats['pushed'] += 1
+        self.server.publish_response(mac_address, status)
+        
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.heap)
+        return stats
+
+class RecordingClient:
+    """Passes publishes through to the MQTT client and keeps the payloads for replay"""
+    def __init__(self, client):
+        self.client = client
+        self.payloads = []
+        
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.payloads.append(payload)
+        return self.client.publish(topic, payload, qos=qos, retain=retain)
+
+class ScanDebouncer:
+    """Idempotency window for scans keyed by (mac, rfid), holding the responses the first scan got.
     
+    Every entry has the same hold-off, so insertion order is expiry order and
+    expired entries are always at the head of the OrderedDict.
+    """
+    def __init__(self):
+        self.hold_off = CONFIG["debounce"]["hold_off"]
+        self.max_entries = CONFIG["debounce"]["max_entries"]
+        self.entries = OrderedDict()  # (mac, rfid) -> (expires_at, responses)
+        self.lock = threading.Lock()
+        self.suppressed = defaultdict(int)
+        
+    def purge(self, now):
+        while self.entries:
+            key = next(iter(self.entries))
+            if self.entries[key][0] > now:
+                break
+            del self.entries[key]
+            
+    def lookup(self, mac_address, rfid):
+        """Responses to replay for a repeated scan, or None when the scan should be processed"""
+        now = time.monotonic()
+        with self.lock:
+            self.purge(now)
+            entry = self.entries.get((mac_address, rfid))
+            if entry is None:
+                return None
+            self.suppressed[mac_address] += 1
+            return entry[1]
+            
+    def remember(self, mac_address, rfid, responses):
+        key = (mac_address, rfid)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.hold_off, responses)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                
+    def get_stats(self):
+        with self.lock:
+            top_devices = sorted(self.suppressed.items(), key=lambda item: item[1], reverse=True)[:5]
+            return {
+                'suppressed': sum(self.suppressed.values()),
+                'window': len(self.entries),
+                'top_devices': top_devices
+            }
+
+class CardIndex:
+    """In-memory map of card number to (kind, id), reloaded in the background.
+    
+    A reload builds a new dict and swaps the reference, so readers never lock.
+    Cards missing from the snapshot are looked up once and unknown ones are
+    remembered for negative_ttl seconds.
+    """
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.refresh_interval = CONFIG["card_index"]["refresh_interval"]
+        self.negative_ttl = CONFIG["card_index"]["negative_ttl"]
+        self.cards = {}
+        self.unknown_cards = {}
+        self.loaded_at = None
+        self.job = None
+        
+    def start(self, scheduler):
+        self.refresh()
+        self.job = scheduler.call_every(self.refresh_interval, self.refresh, jitter=0.1, name="card_index_refresh")
+        
+    def stop(self):
+        if self.job:
+            self.job.cancel()
+            self.job = None
+            
+    def refresh(self):
+        """Reload all cards and swap the index atomically"""
+        try:
+            start = time.perf_counter()
+            cards = self.db_manager.load_card_index()
+            self.cards = cards
+            self.unknown_cards = {}
+            self.loaded_at = datetime.now()
+            logging.info(f"Card index loaded {len(cards)} cards in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logging.error(f"Card index refresh failed: {e}", exc_info=True)
+            
+    @traced
+    def classify(self, rfid):
+        """Return (kind, id) for a card number"""
+        entry = self.cards.get(rfid)
+        if entry is not None:
+            return entry
+            
+        expiry = self.unknown_cards.get(rfid)
+        if expiry is not None and expiry > time.monotonic():
+            return (CARD_UNKNOWN, None)
+            
+        # Card issued since the last reload, or a genuinely unknown card
+        entry = self.db_manager.lookup_card(rfid)
+        if entry[0] == CARD_UNKNOWN:
+            self.unknown_cards[rfid] = time.monotonic() + self.negative_ttl
+        else:
+            self.cards[rfid] = entry
+        return entry
+
+class SessionStore:
+    """Authoritative in-memory state of every workstation.
+    
+    Holds the logged-in operator and active bundle per MAC, plus a reverse
+    index from bundle RFID to the MAC it is active on. It is hydrated from
+    MACHINE_OPERATOR_SCANS and GARMENT_BUNDLE_SCANS at startup and kept in
+    step by MQTTServer, which writes every transition through to Oracle.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.login_ttl = timedelta(hours=CONFIG["session"]["login_hours"])
+        self.operators = {}       # mac -> (rfid, login_time)
+        self.operator_macs = {}   # operator rfid -> mac
+        self.active_bundles = {}  # mac -> (rfid, bundle_id, start_time)
+        self.bundle_macs = {}     # bundle rfid -> mac where it is active
+        self.scanned = {}         # (bundle_id, mac) scanned before -> start_time
+        self.listeners = []       # called with the MAC whose state changed, None for all
+        
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        
+    def notify(self, mac_address):
+        for listener in self.listeners:
+            listener(mac_address)
+        
+    def hydrate(self, logins, bundle_scans):
+        """Load state from (rfid, mac, login_time) and (rfid, mac, bundle_id, start, end) rows"""
+        with self.lock:
+            self.operators.clear()
+            self.operator_macs.clear()
+            self.active_bundles.clear()
+            self.bundle_macs.clear()
+            self.scanned.clear()
+            
+            # Rows are ordered by time so the latest login per MAC wins
+            for rfid, mac_address, login_time in logins:
+                self.login(rfid, mac_address, login_time)
+                
+            for rfid, mac_address, bundle_id, start_time, end_time in bundle_scans:
+                self.scanned[(bundle_id, mac_address)] = start_time
+                if end_time is None:
+                    self.active_bundles[mac_address] = (rfid, bundle_id, start_time)
+                    self.bundle_macs[rfid] = mac_address
+                    
+            logging.info(
+                f"Session state loaded: {len(self.operators)} operators, "
+                f"{len(self.active_bundles)} active bundles"
+            )
+            self.notify(None)
+            
+    def operator_at(self, mac_address):
+        """Return the RFID of the operator logged in at a MAC, if the login is still valid"""
+        session = self.operators.get(mac_address)
+        if session is None or datetime.now() - session[1] > self.login_ttl:
+            return None
+        return session[0]
+        
+    def login_expires_at(self, mac_address):
+        """When the login at a MAC lapses, or None if nobody is logged in there"""
+        session = self.operators.get(mac_address)
+        if session is None:
+            return None
+        return session[1] + self.login_ttl
+        
+    def login(self, rfid, mac_address, login_time):
+        with self.lock:
+            # An operator works one machine at a time
+            previous_mac = self.operator_macs.get(rfid)
+            if previous_mac and previous_mac != mac_address:
+                self.operators.pop(previous_mac, None)
+                self.notify(previous_mac)
+                
+            previous = self.operators.get(mac_address)
+            if previous and previous[0] != rfid:
+                self.operator_macs.pop(previous[0], None)
+                
+            self.operators[mac_address] = (rfid, login_time)
+            self.operator_macs[rfid] = mac_address
+            self.notify(mac_address)
+            
+    def active_bundle(self, mac_address):
+        """Return (rfid, bundle_id, start_time) of the bundle active at a MAC, or None"""
+        return self.active_bundles.get(mac_address)
+        
+    def bundle_location(self, rfid):
+        """Return the MAC where a bundle RFID is currently active, or None"""
+        return self.bundle_macs.get(rfid)
+        
+    def has_scanned(self, bundle_id, mac_address):
+        return (bundle_id, mac_address) in self.scanned
+        
+    def claim_bundle(self, rfid, mac_address, bundle_id, start_time):
+        """Atomically mark a bundle active at a MAC; returns the conflicting MAC if any"""
+        with self.lock:
+            other_mac = self.bundle_macs.get(rfid)
+            if other_mac is not None and other_mac != mac_address:
+                return other_mac
+            self.active_bundles[mac_address] = (rfid, bundle_id, start_time)
+            self.bundle_macs[rfid] = mac_address
+            self.scanned[(bundle_id, mac_address)] = start_time
+            self.notify(mac_address)
+            return None
+            
+    def release_bundle(self, mac_address, bundle_id, forget_scan=False):
+        """Clear the active bundle at a MAC; forget_scan undoes a failed claim"""
+        with self.lock:
+            active = self.active_bundles.get(mac_address)
+            if active is None or active[1] != bundle_id:
+                return
+            del self.active_bundles[mac_address]
+            if self.bundle_macs.get(active[0]) == mac_address:
+                del self.bundle_macs[active[0]]
+            if forget_scan:
+                self.scanned.pop((bundle_id, mac_address), None)
+            self.notify(mac_address)
+            
+    def prune_history(self):
+        """Forget finished bundle scans that started before the history window, as hydrate would"""
+        since = datetime.now() - timedelta(days=CONFIG["session"]["bundle_history_days"])
+        with self.lock:
+            active = {(bundle[1], mac) for mac, bundle in self.active_bundles.items()}
+            expired = [scan for scan, start_time in self.scanned.items()
+                       if start_time < since and scan not in active]
+            for scan in expired:
+                del self.scanned[scan]
+        if expired:
+            logging.info(f"Forgot {len(expired)} bundle scans older than "
+                         f"{CONFIG['session']['bundle_history_days']} days")
+
+# Anonymous PL/SQL block that runs the whole bundle scan decision in one round
+# trip. A DBMS_LOCK on the bundle RFID serializes concurrent scans of the same
+# bundle and is released on COMMIT/ROLLBACK.
+BUNDLE_SCAN_BLOCK = """
+DECLARE
+    v_logged_in   NUMBER;
+    v_other_mac   {bundle_scans}.MAC_ADDRESS%TYPE;
+    v_bundle_id   {bundle}.{bundle_id}%TYPE;
+    v_scanned     NUMBER;
+    v_active      NUMBER;
+    v_lock_id     NUMBER;
+    v_lock_status INTEGER;
+BEGIN
+    :transition := NULL;
+    :bundle_id := NULL;
+
+    SELECT COUNT(*) INTO v_logged_in FROM {scan}
+     WHERE MAC_ADDRESS = :mac_address
+       AND SCAN_TIME >= SYSDATE - :login_hours / 24;
+    IF v_logged_in = 0 THEN
+        :response := :login_required;
+        RETURN;
+    END IF;
+
+    SELECT ORA_HASH('RFID_BUNDLE_' || :rfid, 1073741823) INTO v_lock_id FROM DUAL;
+    v_lock_status := DBMS_LOCK.REQUEST(v_lock_id, DBMS_LOCK.X_MODE, :lock_timeout, TRUE);
+    IF v_lock_status NOT IN (0, 4) THEN
+        :response := :error_generic;
+        :transition := 'LOCK_TIMEOUT';
+        RETURN;
+    END IF;
+
+    SELECT MAX(MAC_ADDRESS) INTO v_other_mac FROM {bundle_scans}
+     WHERE RFID = :rfid AND END_TIME IS NULL AND MAC_ADDRESS <> :mac_address;
+    IF v_other_mac IS NOT NULL THEN
+        :response := :bundle_active_elsewhere || v_other_mac;
+        ROLLBACK;
+        RETURN;
+    END IF;
+
+    SELECT COUNT(*) INTO v_active FROM {bundle_scans}
+     WHERE MAC_ADDRESS = :mac_address AND END_TIME IS NULL AND RFID <> :rfid;
+    IF v_active > 0 THEN
+        :response := :previous_bundle_active;
+        ROLLBACK;
+        RETURN;
+    END IF;
+
+    BEGIN
+        SELECT {bundle_id} INTO v_bundle_id FROM {bundle}
+         WHERE {bundle_rfid} = :rfid AND ROWNUM = 1;
+    EXCEPTION
+        WHEN NO_DATA_FOUND THEN
+            :response := :error_generic;
+            :transition := 'NOT_FOUND';
+            ROLLBACK;
+            RETURN;
+    END;
+    :bundle_id := v_bundle_id;
+
+    SELECT COUNT(*), COUNT(CASE WHEN END_TIME IS NULL THEN 1 END)
+      INTO v_scanned, v_active
+      FROM {bundle_scans}
+     WHERE BUNDLE_ID = v_bundle_id AND MAC_ADDRESS = :mac_address;
+
+    IF v_scanned = 0 THEN
+        INSERT INTO {bundle_scans} (RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME)
+        VALUES (:rfid, :mac_address, v_bundle_id, :event_time);
+        :response := :bundle_started;
+        :transition := 'STARTED';
+    ELSIF v_active > 0 THEN
+        UPDATE {bundle_scans} SET END_TIME = :event_time
+         WHERE BUNDLE_ID = v_bundle_id AND MAC_ADDRESS = :mac_address AND END_TIME IS NULL;
+        :response := :bundle_ended;
+        :transition := 'ENDED';
+    ELSE
+        :response := :bundle_completed;
+    END IF;
+
+    COMMIT;
+END;
+"""
+
+def db_now():
+    """Current time truncated to the whole second that the DATE columns keep.
+    
+    Login and bundle times are matched back against stored rows when journal
+    entries are replayed, so they must not carry precision the column drops.
+    """
+    return datetime.now().replace(microsecond=0)
+
+class StorageBackend(ABC):
+    """Persistence for the server: cards, operator logins, bundle scans and error logs.
+    
+    Workstation status is worked out in memory from logins and bundle scans, so
+    backends only store those. Subclasses implement the round trips; error log
+    aggregation and batching are shared. The login, bundle start and bundle end
+    writes must be idempotent so StateJournal entries can be replayed. A backend
+    that leaves any abstract method out fails when it is constructed.
+    """
+    def __init__(self):
+        self.error_writer = ErrorLogWriter(self)
+        self.error_aggregator = ErrorAggregator(self.error_writer)
+        self.open()
+        self.error_writer.start()
+        
+    @abstractmethod
+    def open(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def close_connections(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def get_pool_stats(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def write_error_batch(self, rows):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def fetch_error_logs(self, limit=1000):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def load_card_index(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def lookup_card(self, rfid):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def fetch_bundle_id(self, rfid):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def load_operator_logins(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def load_bundle_scans(self):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def insert_operator_login(self, rfid, mac_address, login_time):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def insert_bundle_start(self, rfid, mac_address, bundle_id, start_time):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def update_bundle_end(self, bundle_id, mac_address, end_time):
+        raise NotImplementedError
+        
+    @abstractmethod
+    def run_bundle_scan_block(self, rfid, mac_address, event_time):
+        raise NotImplementedError
+        
+    def log_error(self, error_type, error_message, error_details=None, 
+                 mac_address=None, rfid=None, topic=None, 
+                 message_content=None, stack_trace=None, aggregate=True):
+        """Queue an error for RFID_SYSTEM_ERROR_LOGS; repeats are aggregated, then written in batches"""
+        try:
+            row = {
+                'error_type': error_type[:100],
+                'error_message': error_message[:4000],
+                'error_details': str(error_details)[:4000] if error_details else None,
+                'mac_address': mac_address[:20] if mac_address else None,
+                'rfid': rfid[:50] if rfid else None,
+                'topic': topic[:100] if topic else None,
+                'message_content': str(message_content)[:4000] if message_content else None,
+                'stack_trace': str(stack_trace)[:4000] if stack_trace else None,
+                'timestamp': datetime.now()
+            }
+            if aggregate:
+                self.error_aggregator.add(row)
+            else:
+                self.error_aggregator.bypass(row)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to queue error log: {e}", exc_info=True)
+            return False
+            
+    def close(self):
+        """Flush pending error logs and close the database connections"""
+        self.error_aggregator.flush(force=True)
+        self.error_writer.stop()
+        stats = self.error_writer.get_stats()
+        if stats['dropped'] or stats['failed']:
+            logging.warning(f"Error log writer dropped {stats['dropped']} and failed {stats['failed']} rows")
+        aggregated = self.error_aggregator.get_stats()
+        logging.info(f"Error log aggregation: {aggregated['events']} events written as "
+                     f"{aggregated['rows'] + aggregated['bypassed']} rows")
+        self.close_connections()
+
+class OracleStorage(StorageBackend):
+    """Oracle through a cx_Oracle session pool"""
+    def __init__(self):
+        self.pool = None
+        self.ping_interval = CONFIG["database"]["pool"]["ping_interval"]
+        # Monotonic time any connection was last returned; sessions are idle at least this long
+        self.last_release = time.monotonic()
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'acquires': 0,
+            'acquire_wait_total': 0.0,
+            'acquire_wait_max': 0.0,
+            'validations': 0,
+            'validation_failures': 0,
+            'reconnects': 0
+        }
+        super().__init__()
+    
+    def open(self):
+        self.initialize_pool()
+        
     def initialize_pool(self):
         try:
+            # Imported here so the sqlite backend runs without the Oracle client
+            import cx_Oracle
             dsn = cx_Oracle.makedsn(
                 CONFIG["database"]["host"],
                 CONFIG["database"]["port"],
@@ -608,6 +2825,7 @@ class DatabaseManager:
                 increment=CONFIG["database"]["pool"]["increment"],
                 threaded=True,
                 timeout=CONFIG["database"]["pool"]["timeout"],
+                ping_interval=CONFIG["database"]["pool"]["ping_interval"],
                 encoding="UTF-8"
             )
             
@@ -625,81 +2843,936 @@ class DatabaseManager:
             logging.error(error_msg, exc_info=True)
             raise Exception(error_msg)
     
+    @contextmanager
     def get_connection(self):
-        """Get a connection from the pool with validation"""
-        with self.lock:
+        """Check out a pooled connection and return it to the pool afterwards.
+        
+        The pool is thread-safe, so no lock is held around acquire. The pool
+        itself pings a session that sat idle longer than ping_interval. When no
+        connection at all was returned for that long, every session is that
+        stale, so the one handed out is also pinged here, where a failure can be
+        counted and the session replaced. The wait includes the replacement.
+        """
+        start = time.perf_counter()
+        try:
+            conn = self.pool.acquire()
+            if time.monotonic() - self.last_release > self.ping_interval:
+                conn = self.validate_connection(conn)
+        except Exception as e:
+            error_msg = f"Failed to get database connection: {str(e)}"
+            logging.error(error_msg, exc_info=True)
+            raise Exception(error_msg)
+        self.record_acquire(time.perf_counter() - start)
+        
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+            self.last_release = time.monotonic()
+            
+    def validate_connection(self, conn):
+        """Ping a connection after the pool sat idle; a dead one is dropped and replaced"""
+        try:
+            conn.ping()
+            with self.stats_lock:
+                self.stats['validations'] += 1
+            return conn
+        except Exception as e:
+            with self.stats_lock:
+                self.stats['validations'] += 1
+                self.stats['validation_failures'] += 1
+            logging.warning(f"Dropping stale database connection: {e}")
             try:
-                conn = self.pool.acquire()
+                self.pool.drop(conn)
+            except Exception:
+                pass
                 
-                # Validate connection
-                try:
-                    with conn.cursor() as cursor:
-                        cursor.execute("SELECT 1 FROM DUAL")
-                        if cursor.fetchone()[0] != 1:
-                            conn.close()
-                            raise Exception("Connection validation failed")
-                except:
-                    conn.close()
-                    raise
+        conn = self.pool.acquire()
+        with self.stats_lock:
+            self.stats['reconnects'] += 1
+        return conn
+        
+    def record_acquire(self, wait):
+        with self.stats_lock:
+            self.stats['acquires'] += 1
+            self.stats['acquire_wait_total'] += wait
+            if wait > self.stats['acquire_wait_max']:
+                self.stats['acquire_wait_max'] = wait
+                
+    def get_pool_stats(self):
+        """Snapshot of pool occupancy and checkout counters"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        acquires = stats['acquires']
+        return {
+            'busy': self.pool.busy if self.pool else 0,
+            'open': self.pool.opened if self.pool else 0,
+            'max': CONFIG["database"]["pool"]["max"],
+            'acquires': acquires,
+            'avg_wait_ms': (stats['acquire_wait_total'] / acquires * 1000) if acquires else 0.0,
+            'max_wait_ms': stats['acquire_wait_max'] * 1000,
+            'validations': stats['validations'],
+            'validation_failures': stats['validation_failures'],
+            'reconnects': stats['reconnects']
+        }
+    
+    @timed("db")
+    def write_error_batch(self, rows):
+        """Insert a batch of error rows in a single round trip"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {CONFIG['tables']['error_logs']} "
+                    "(ERROR_TYPE, ERROR_MESSAGE, ERROR_DETAILS, MAC_ADDRESS, "
+                    "RFID, TOPIC, MESSAGE_CONTENT, STACK_TRACE, TIMESTAMP) "
+                    "VALUES (:error_type, :error_message, :error_details, :mac_address, "
+                    ":rfid, :topic, :message_content, :stack_trace, :timestamp)",
+                    rows
+                )
+                conn.commit()
+
+    @timed("db")
+    def fetch_error_logs(self, limit=1000):
+        """Most recent error log rows for the dashboard"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT TO_CHAR(TIMESTAMP, 'YYYY-MM-DD HH24:MI:SS'), ERROR_TYPE, "
+                    "ERROR_MESSAGE, MAC_ADDRESS, RFID "
+                    f"FROM {CONFIG['tables']['error_logs']} "
+                    "ORDER BY TIMESTAMP DESC FETCH FIRST :limit ROWS ONLY",
+                    {'limit': limit}
+                )
+                return cursor.fetchall()
+                
+    @timed("db")
+    def load_card_index(self):
+        """Fetch every employee and bundle card as {card: (kind, id)}"""
+        columns = CONFIG["columns"]
+        cards = {}
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.arraysize = 5000
+                cursor.execute(
+                    f"SELECT {columns['bundle_rfid']}, {columns['bundle_id']} "
+                    f"FROM {CONFIG['tables']['bundle']}"
+                )
+                for rfid, bundle_id in cursor:
+                    cards[str(rfid)] = (CARD_BUNDLE, bundle_id)
+                    
+                # Employee cards take precedence, matching the scan order
+                cursor.execute(
+                    f"SELECT {columns['employee_card']}, {columns['employee_id']} "
+                    f"FROM {CONFIG['tables']['employee']}"
+                )
+                for card, employee_id in cursor:
+                    cards[str(card)] = (CARD_EMPLOYEE, employee_id)
+        return cards
+        
+    @timed("db")
+    def lookup_card(self, rfid):
+        """Classify a single card directly against the database"""
+        columns = CONFIG["columns"]
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {columns['employee_id']} FROM {CONFIG['tables']['employee']} "
+                    f"WHERE {columns['employee_card']} = :rfid",
+                    {'rfid': rfid}
+                )
+                row = cursor.fetchone()
+                if row:
+                    return (CARD_EMPLOYEE, row[0])
+                    
+                cursor.execute(
+                    f"SELECT {columns['bundle_id']} FROM {CONFIG['tables']['bundle']} "
+                    f"WHERE {columns['bundle_rfid']} = :rfid",
+                    {'rfid': rfid}
+                )
+                row = cursor.fetchone()
+                if row:
+                    return (CARD_BUNDLE, row[0])
+        return (CARD_UNKNOWN, None)
+
+    @timed("db")
+    def fetch_bundle_id(self, rfid):
+        """Look up the bundle id for an RFID in the cutting bundle view"""
+        columns = CONFIG["columns"]
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {columns['bundle_id']} FROM {CONFIG['tables']['bundle']} "
+                    f"WHERE {columns['bundle_rfid']} = :rfid",
+                    {'rfid': rfid}
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+
+    @timed("db")
+    def load_operator_logins(self):
+        """Fetch operator logins from the current shift window, oldest first"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.arraysize = 1000
+                cursor.execute(
+                    f"SELECT RFID, MAC_ADDRESS, SCAN_TIME FROM {CONFIG['tables']['scan']} "
+                    "WHERE SCAN_TIME >= SYSDATE - :login_hours / 24 "
+                    "ORDER BY SCAN_TIME",
+                    {'login_hours': CONFIG["session"]["login_hours"]}
+                )
+                return cursor.fetchall()
+                
+    @timed("db")
+    def load_bundle_scans(self):
+        """Fetch active bundles plus recently completed bundle scans"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.arraysize = 5000
+                cursor.execute(
+                    "SELECT RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME, END_TIME "
+                    f"FROM {CONFIG['tables']['bundle_scans']} "
+                    "WHERE END_TIME IS NULL OR START_TIME >= SYSDATE - :history_days "
+                    "ORDER BY START_TIME",
+                    {'history_days': CONFIG["session"]["bundle_history_days"]}
+                )
+                return cursor.fetchall()
                 
-                return conn
+    @timed("db")
+    def insert_operator_login(self, rfid, mac_address, login_time):
+        """Idempotent: a login already recorded with the same card, MAC and time is not inserted again"""
+        scan = CONFIG['tables']['scan']
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {scan} (RFID, MAC_ADDRESS, SCAN_TIME) "
+                    "SELECT :rfid, :mac_address, :scan_time FROM DUAL WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {scan} WHERE RFID = :rfid AND MAC_ADDRESS = :mac_address "
+                    "AND SCAN_TIME = :scan_time)",
+                    {'rfid': rfid, 'mac_address': mac_address, 'scan_time': login_time}
+                )
+                conn.commit()
+                
+    @timed("db")
+    def insert_bundle_start(self, rfid, mac_address, bundle_id, start_time):
+        """Idempotent on bundle, MAC and start time"""
+        bundle_scans = CONFIG['tables']['bundle_scans']
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {bundle_scans} (RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME) "
+                    "SELECT :rfid, :mac_address, :bundle_id, :start_time FROM DUAL WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {bundle_scans} WHERE BUNDLE_ID = :bundle_id "
+                    "AND MAC_ADDRESS = :mac_address AND START_TIME = :start_time)",
+                    {'rfid': rfid, 'mac_address': mac_address,
+                     'bundle_id': bundle_id, 'start_time': start_time}
+                )
+                conn.commit()
+                
+    @timed("db")
+    def update_bundle_end(self, bundle_id, mac_address, end_time):
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {CONFIG['tables']['bundle_scans']} SET END_TIME = :end_time "
+                    "WHERE BUNDLE_ID = :bundle_id AND MAC_ADDRESS = :mac_address "
+                    "AND END_TIME IS NULL",
+                    {'end_time': end_time, 'bundle_id': bundle_id, 'mac_address': mac_address}
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+                
+    @timed("db")
+    def run_bundle_scan_block(self, rfid, mac_address, event_time):
+        """Run the bundle scan decision server-side; returns (response, transition, bundle_id)"""
+        sql = BUNDLE_SCAN_BLOCK.format(
+            scan=CONFIG["tables"]["scan"],
+            bundle_scans=CONFIG["tables"]["bundle_scans"],
+            bundle=CONFIG["tables"]["bundle"],
+            bundle_id=CONFIG["columns"]["bundle_id"],
+            bundle_rfid=CONFIG["columns"]["bundle_rfid"]
+        )
+        responses = CONFIG["responses"]
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                response = cursor.var(str)
+                transition = cursor.var(str)
+                bundle_id = cursor.var(int)
+                cursor.execute(sql, {
+                    'rfid': rfid,
+                    'mac_address': mac_address,
+                    'event_time': event_time,
+                    'login_hours': CONFIG["session"]["login_hours"],
+                    'lock_timeout': CONFIG["bundle_scan"]["lock_timeout"],
+                    'login_required': responses["login_required"],
+                    'bundle_active_elsewhere': responses["bundle_active_elsewhere"],
+                    'previous_bundle_active': responses["previous_bundle_active"],
+                    'error_generic': responses["error_generic"],
+                    'bundle_started': responses["bundle_started"],
+                    'bundle_ended': responses["bundle_ended"],
+                    'bundle_completed': responses["bundle_completed"],
+                    'response': response,
+                    'transition': transition,
+                    'bundle_id': bundle_id
+                })
+                return response.getvalue(), transition.getvalue(), bundle_id.getvalue()
+
+    def close_connections(self):
+        if self.pool:
+            try:
+                self.pool.close()
+                logging.info("Database connection pool closed")
             except Exception as e:
-                error_msg = f"Failed to get database connection: {str(e)}"
-                logging.error(error_msg, exc_info=True)
-                raise Exception(error_msg)
+                logging.error(f"Error closing database pool: {e}")
+
+def to_db_time(value):
+    """datetime as sortable ISO text, the way the sqlite backend stores times"""
+    return value.isoformat(sep=" ", timespec="microseconds") if value else None
     
-    def log_error(self, error_type, error_message, error_details=None, 
-                 mac_address=None, rfid=None, topic=None, 
-                 message_content=None, stack_trace=None):
-        """Log error to RFID_SYSTEM_ERROR_LOGS table"""
+def from_db_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+class SQLiteStorage(StorageBackend):
+    """Embedded SQLite in WAL mode, for lines that run without Oracle.
+    
+    Uses the same table and column names as Oracle. Each thread keeps its own
+    connection; WAL lets the dashboard and error writer read while a worker
+    writes. Times are stored as ISO text, which sorts chronologically.
+    """
+    def __init__(self):
+        self.path = CONFIG["storage"]["sqlite_path"]
+        self.synchronous = CONFIG["storage"]["sqlite_synchronous"]
+        self.busy_timeout = CONFIG["storage"]["sqlite_busy_timeout"]
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.round_trips = 0
+        super().__init__()
+        
+    def open(self):
+        conn = self.connection()
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logging.warning(f"SQLite database {self.path} is in {mode} mode, not WAL")
+        self.create_schema(conn)
+        logging.info(f"SQLite storage opened at {self.path}")
+        
+    def connection(self):
+        """This thread's connection, opened on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: statements autocommit unless a transaction is begun explicitly
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        with self.lock:
+            self.round_trips += 1
+        return conn
+        
+    def create_schema(self, conn):
+        tables = CONFIG["tables"]
+        columns = CONFIG["columns"]
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS {tables['employee']} (
+                {columns['employee_card']} TEXT PRIMARY KEY, {columns['employee_id']} INTEGER);
+            CREATE TABLE IF NOT EXISTS {tables['bundle']} (
+                {columns['bundle_rfid']} TEXT PRIMARY KEY, {columns['bundle_id']} INTEGER);
+            CREATE TABLE IF NOT EXISTS {tables['scan']} (
+                RFID TEXT, MAC_ADDRESS TEXT, SCAN_TIME TEXT);
+            CREATE INDEX IF NOT EXISTS {tables['scan']}_MAC_TIME ON {tables['scan']} (MAC_ADDRESS, SCAN_TIME);
+            CREATE INDEX IF NOT EXISTS {tables['scan']}_TIME ON {tables['scan']} (SCAN_TIME);
+            CREATE TABLE IF NOT EXISTS {tables['bundle_scans']} (
+                RFID TEXT, MAC_ADDRESS TEXT, BUNDLE_ID INTEGER, START_TIME TEXT, END_TIME TEXT);
+            CREATE INDEX IF NOT EXISTS {tables['bundle_scans']}_BUNDLE ON {tables['bundle_scans']} (BUNDLE_ID, MAC_ADDRESS);
+            CREATE INDEX IF NOT EXISTS {tables['bundle_scans']}_RFID ON {tables['bundle_scans']} (RFID, END_TIME);
+            CREATE INDEX IF NOT EXISTS {tables['bundle_scans']}_MAC ON {tables['bundle_scans']} (MAC_ADDRESS, END_TIME);
+            CREATE INDEX IF NOT EXISTS {tables['bundle_scans']}_START ON {tables['bundle_scans']} (START_TIME);
+            CREATE TABLE IF NOT EXISTS {tables['error_logs']} (
+                ERROR_TYPE TEXT, ERROR_MESSAGE TEXT, ERROR_DETAILS TEXT, MAC_ADDRESS TEXT, RFID TEXT,
+                TOPIC TEXT, MESSAGE_CONTENT TEXT, STACK_TRACE TEXT, TIMESTAMP TEXT);
+            CREATE INDEX IF NOT EXISTS {tables['error_logs']}_TIME ON {tables['error_logs']} (TIMESTAMP);
+        """)
+        
+    def close_connections(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.error(f"Error closing SQLite connection: {e}")
+        logging.info("SQLite storage closed")
+        
+    def get_pool_stats(self):
+        """Same keys as the Oracle pool; every thread holds one connection, so nothing waits"""
+        with self.lock:
+            open_connections = len(self.connections)
+            round_trips = self.round_trips
+        return {
+            'busy': 0,
+            'open': open_connections,
+            'max': open_connections,
+            'acquires': round_trips,
+            'avg_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'validations': 0,
+            'validation_failures': 0,
+            'reconnects': 0
+        }
+        
+    @timed("db")
+    def write_error_batch(self, rows):
+        conn = self.connection()
+        conn.execute("BEGIN")
         try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        f"INSERT INTO {CONFIG['tables']['error_logs']} "
-                        "(ERROR_TYPE, ERROR_MESSAGE, ERROR_DETAILS, MAC_ADDRESS, "
-                        "RFID, TOPIC, MESSAGE_CONTENT, STACK_TRACE, TIMESTAMP) "
-                        "VALUES (:error_type, :error_message, :error_details, :mac_address, "
-                        ":rfid, :topic, :message_content, :stack_trace, SYSTIMESTAMP)",
-                        {
-                            'error_type': error_type[:100],
-                            'error_message': error_message[:4000],
-                            'error_details': str(error_details)[:4000] if error_details else None,
-                            'mac_address': mac_address[:20] if mac_address else None,
-                            'rfid': rfid[:50] if rfid else None,
-                            'topic': topic[:100] if topic else None,
-                            'message_content': str(message_content)[:4000] if message_content else None,
-                            'stack_trace': str(stack_trace)[:4000] if stack_trace else None
-                        }
-                    )
-                    conn.commit()
-                    return True
+            conn.executemany(
+                f"INSERT INTO {CONFIG['tables']['error_logs']} "
+                "(ERROR_TYPE, ERROR_MESSAGE, ERROR_DETAILS, MAC_ADDRESS, "
+                "RFID, TOPIC, MESSAGE_CONTENT, STACK_TRACE, TIMESTAMP) "
+                "VALUES (:error_type, :error_message, :error_details, :mac_address, "
+                ":rfid, :topic, :message_content, :stack_trace, :timestamp)",
+                [dict(row, timestamp=to_db_time(row['timestamp'])) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+            
+    @timed("db")
+    def fetch_error_logs(self, limit=1000):
+        return self.connection().execute(
+            "SELECT SUBSTR(TIMESTAMP, 1, 19), ERROR_TYPE, ERROR_MESSAGE, MAC_ADDRESS, RFID "
+            f"FROM {CONFIG['tables']['error_logs']} ORDER BY TIMESTAMP DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        
+    @timed("db")
+    def load_card_index(self):
+        columns = CONFIG["columns"]
+        conn = self.connection()
+        cards = {}
+        for rfid, bundle_id in conn.execute(
+                f"SELECT {columns['bundle_rfid']}, {columns['bundle_id']} FROM {CONFIG['tables']['bundle']}"):
+            cards[str(rfid)] = (CARD_BUNDLE, bundle_id)
+        # Employee cards take precedence, matching the scan order
+        for card, employee_id in conn.execute(
+                f"SELECT {columns['employee_card']}, {columns['employee_id']} FROM {CONFIG['tables']['employee']}"):
+            cards[str(card)] = (CARD_EMPLOYEE, employee_id)
+        return cards
+        
+    @timed("db")
+    def lookup_card(self, rfid):
+        columns = CONFIG["columns"]
+        conn = self.connection()
+        row = conn.execute(
+            f"SELECT {columns['employee_id']} FROM {CONFIG['tables']['employee']} "
+            f"WHERE {columns['employee_card']} = ?",
+            (rfid,)
+        ).fetchone()
+        if row:
+            return (CARD_EMPLOYEE, row[0])
+        bundle_id = self.select_bundle_id(conn, rfid)
+        if bundle_id is not None:
+            return (CARD_BUNDLE, bundle_id)
+        return (CARD_UNKNOWN, None)
+        
+    @timed("db")
+    def fetch_bundle_id(self, rfid):
+        return self.select_bundle_id(self.connection(), rfid)
+        
+    def select_bundle_id(self, conn, rfid):
+        columns = CONFIG["columns"]
+        row = conn.execute(
+            f"SELECT {columns['bundle_id']} FROM {CONFIG['tables']['bundle']} "
+            f"WHERE {columns['bundle_rfid']} = ? LIMIT 1",
+            (rfid,)
+        ).fetchone()
+        return row[0] if row else None
+        
+    @timed("db")
+    def load_operator_logins(self):
+        since = datetime.now() - timedelta(hours=CONFIG["session"]["login_hours"])
+        rows = self.connection().execute(
+            f"SELECT RFID, MAC_ADDRESS, SCAN_TIME FROM {CONFIG['tables']['scan']} "
+            "WHERE SCAN_TIME >= ? ORDER BY SCAN_TIME",
+            (to_db_time(since),)
+        ).fetchall()
+        return [(rfid, mac_address, from_db_time(scan_time)) for rfid, mac_address, scan_time in rows]
+        
+    @timed("db")
+    def load_bundle_scans(self):
+        since = datetime.now() - timedelta(days=CONFIG["session"]["bundle_history_days"])
+        rows = self.connection().execute(
+            "SELECT RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME, END_TIME "
+            f"FROM {CONFIG['tables']['bundle_scans']} "
+            "WHERE END_TIME IS NULL OR START_TIME >= ? ORDER BY START_TIME",
+            (to_db_time(since),)
+        ).fetchall()
+        return [
+            (rfid, mac_address, bundle_id, from_db_time(start_time), from_db_time(end_time))
+            for rfid, mac_address, bundle_id, start_time, end_time in rows
+        ]
+        
+    @timed("db")
+    def insert_operator_login(self, rfid, mac_address, login_time):
+        scan = CONFIG['tables']['scan']
+        self.connection().execute(
+            f"INSERT INTO {scan} (RFID, MAC_ADDRESS, SCAN_TIME) "
+            "SELECT :rfid, :mac_address, :scan_time WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {scan} WHERE RFID = :rfid AND MAC_ADDRESS = :mac_address AND SCAN_TIME = :scan_time)",
+            {'rfid': rfid, 'mac_address': mac_address, 'scan_time': to_db_time(login_time)}
+        )
+        
+    @timed("db")
+    def insert_bundle_start(self, rfid, mac_address, bundle_id, start_time):
+        bundle_scans = CONFIG['tables']['bundle_scans']
+        self.connection().execute(
+            f"INSERT INTO {bundle_scans} (RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME) "
+            "SELECT :rfid, :mac_address, :bundle_id, :start_time WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {bundle_scans} WHERE BUNDLE_ID = :bundle_id "
+            "AND MAC_ADDRESS = :mac_address AND START_TIME = :start_time)",
+            {'rfid': rfid, 'mac_address': mac_address, 'bundle_id': bundle_id,
+             'start_time': to_db_time(start_time)}
+        )
+        
+    @timed("db")
+    def update_bundle_end(self, bundle_id, mac_address, end_time):
+        cursor = self.connection().execute(
+            f"UPDATE {CONFIG['tables']['bundle_scans']} SET END_TIME = ? "
+            "WHERE BUNDLE_ID = ? AND MAC_ADDRESS = ? AND END_TIME IS NULL",
+            (to_db_time(end_time), bundle_id, mac_address)
+        )
+        return cursor.rowcount > 0
+        
+    @timed("db")
+    def run_bundle_scan_block(self, rfid, mac_address, event_time):
+        """BUNDLE_SCAN_BLOCK in one IMMEDIATE transaction; the database write lock stands in for DBMS_LOCK"""
+        responses = CONFIG["responses"]
+        conn = self.connection()
+        since = event_time - timedelta(hours=CONFIG["session"]["login_hours"])
+        logged_in = conn.execute(
+            f"SELECT 1 FROM {CONFIG['tables']['scan']} WHERE MAC_ADDRESS = ? AND SCAN_TIME >= ? LIMIT 1",
+            (mac_address, to_db_time(since))
+        ).fetchone()
+        if not logged_in:
+            return responses["login_required"], None, None
+            
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return responses["error_generic"], "LOCK_TIMEOUT", None
+        try:
+            result = self.bundle_scan_transition(conn, rfid, mac_address, event_time)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+            
+    def bundle_scan_transition(self, conn, rfid, mac_address, event_time):
+        responses = CONFIG["responses"]
+        bundle_scans = CONFIG["tables"]["bundle_scans"]
+        other_mac = conn.execute(
+            f"SELECT MAX(MAC_ADDRESS) FROM {bundle_scans} "
+            "WHERE RFID = ? AND END_TIME IS NULL AND MAC_ADDRESS <> ?",
+            (rfid, mac_address)
+        ).fetchone()[0]
+        if other_mac is not None:
+            return responses["bundle_active_elsewhere"] + other_mac, None, None
+            
+        previous_active = conn.execute(
+            f"SELECT 1 FROM {bundle_scans} WHERE MAC_ADDRESS = ? AND END_TIME IS NULL AND RFID <> ? LIMIT 1",
+            (mac_address, rfid)
+        ).fetchone()
+        if previous_active:
+            return responses["previous_bundle_active"], None, None
+            
+        bundle_id = self.select_bundle_id(conn, rfid)
+        if bundle_id is None:
+            return responses["error_generic"], "NOT_FOUND", None
+            
+        scanned, active = conn.execute(
+            f"SELECT COUNT(*), COUNT(CASE WHEN END_TIME IS NULL THEN 1 END) FROM {bundle_scans} "
+            "WHERE BUNDLE_ID = ? AND MAC_ADDRESS = ?",
+            (bundle_id, mac_address)
+        ).fetchone()
+        if scanned == 0:
+            conn.execute(
+                f"INSERT INTO {bundle_scans} (RFID, MAC_ADDRESS, BUNDLE_ID, START_TIME) VALUES (?, ?, ?, ?)",
+                (rfid, mac_address, bundle_id, to_db_time(event_time))
+            )
+            return responses["bundle_started"], "STARTED", bundle_id
+        if active:
+            conn.execute(
+                f"UPDATE {bundle_scans} SET END_TIME = ? "
+                "WHERE BUNDLE_ID = ? AND MAC_ADDRESS = ? AND END_TIME IS NULL",
+                (to_db_time(event_time), bundle_id, mac_address)
+            )
+            return responses["bundle_ended"], "ENDED", bundle_id
+        return responses["bundle_completed"], None, bundle_id
+
+class JournalBatch:
+    """Entries that share one commit; appenders wait on done"""
+    __slots__ = ('entries', 'done', 'error')
+    
+    def __init__(self):
+        self.entries = []
+        self.done = threading.Event()
+        self.error = None
+
+class StateJournal:
+    """Append-only local journal of session writes, forwarded to storage by JournalReplayer.
+    
+    Entries are rows in a SQLite table in WAL mode with synchronous=FULL. Appends
+    from all workers within commit_interval share one transaction and fsync, and
+    append() returns only once its batch is on disk, so an operator is never told
+    about a transition that a crash could lose.
+    """
+    REPLAYABLE = ("insert_operator_login", "insert_bundle_start", "update_bundle_end")
+    
+    def __init__(self):
+        self.path = CONFIG["journal"]["path"]
+        self.commit_interval = CONFIG["journal"]["commit_interval"]
+        self.max_batch = CONFIG["journal"]["max_batch"]
+        self.condition = threading.Condition()
+        self.batch = JournalBatch()
+        self.running = False
+        self.thread = None
+        self.stats = {'appended': 0, 'commits': 0, 'commit_failures': 0, 'replayed': 0, 'replay_failures': 0,
+                      'dead_lettered': 0}
+        self.last_rate_check = (time.monotonic(), 0)
+        
+        # The committer thread writes through conn; the replayer reads and deletes through reader
+        self.conn = self.connect()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS JOURNAL (
+                SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+                OPERATION TEXT NOT NULL,
+                ARGS TEXT NOT NULL,
+                CREATED TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS JOURNAL_DEAD (
+                SEQ INTEGER PRIMARY KEY,
+                OPERATION TEXT NOT NULL,
+                ARGS TEXT NOT NULL,
+                CREATED TEXT NOT NULL,
+                ERROR TEXT NOT NULL);
+        """)
+        self.reader = self.connect()
+        self.depth = self.conn.execute("SELECT COUNT(*) FROM JOURNAL").fetchone()[0]
+        if self.depth:
+            logging.warning(f"Journal {self.path} holds {self.depth} entries not yet in the database")
+        self.stats['dead_lettered'] = self.conn.execute("SELECT COUNT(*) FROM JOURNAL_DEAD").fetchone()[0]
+        if self.stats['dead_lettered']:
+            logging.warning(f"Journal {self.path} holds {self.stats['dead_lettered']} entries the database "
+                            f"rejected (table JOURNAL_DEAD)")
+            
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="journal_committer", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Commit whatever is pending, then close; unreplayed entries stay for the next start"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=10)
+            self.thread = None
+        self.conn.close()
+        self.reader.close()
+        
+    def append(self, operation, fields):
+        """Durably record a storage call; returns once it is on disk"""
+        entry = (operation, json.dumps(fields, default=to_db_time), to_db_time(datetime.now()))
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("Journal is not running")
+            batch = self.batch
+            batch.entries.append(entry)
+            if len(batch.entries) == 1 or len(batch.entries) >= self.max_batch:
+                self.condition.notify_all()
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+            
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.batch.entries:
+                    self.condition.wait()
+                if self.running and self.commit_interval and len(self.batch.entries) < self.max_batch:
+                    # Let concurrent workers join this commit
+                    self.condition.wait(self.commit_interval)
+                batch, self.batch = self.batch, JournalBatch()
+                stopping = not self.running
+                
+            if batch.entries:
+                self.commit(batch)
+            elif stopping:
+                break
+                
+    def commit(self, batch):
+        start = time.perf_counter()
+        try:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT INTO JOURNAL (OPERATION, ARGS, CREATED) VALUES (?, ?, ?)", batch.entries)
+            self.conn.execute("COMMIT")
         except Exception as e:
-            logging.error(f"Failed to log error to database: {e}", exc_info=True)
-            return False
+            logging.error(f"Failed to commit {len(batch.entries)} journal entries: {e}", exc_info=True)
+            try:
+                self.conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            batch.error = e
+            with self.condition:
+                self.stats['commit_failures'] += 1
+        else:
+            METRICS.observe("journal_commit", time.perf_counter() - start)
+            with self.condition:
+                self.stats['appended'] += len(batch.entries)
+                self.stats['commits'] += 1
+                self.depth += len(batch.entries)
+                self.condition.notify_all()
+        batch.done.set()
+        
+    def read(self, limit=None):
+        """Oldest entries as (seq, operation, fields), with times converted back to datetime"""
+        rows = self.reader.execute(
+            "SELECT SEQ, OPERATION, ARGS FROM JOURNAL ORDER BY SEQ LIMIT ?",
+            (-1 if limit is None else limit,)
+        ).fetchall()
+        entries = []
+        for seq, operation, args in rows:
+            fields = json.loads(args)
+            for name in fields:
+                if name.endswith("_time"):
+                    fields[name] = from_db_time(fields[name])
+            entries.append((seq, operation, fields))
+        return entries
+        
+    def remove(self, last_seq, count):
+        """Forget entries up to last_seq once they are in the database"""
+        self.reader.execute("DELETE FROM JOURNAL WHERE SEQ <= ?", (last_seq,))
+        with self.condition:
+            self.depth -= count
+            self.stats['replayed'] += count
+            
+    def dead_letter(self, seq, error):
+        """Move an entry the database keeps rejecting to JOURNAL_DEAD, so later entries can be replayed"""
+        self.reader.execute("BEGIN")
+        try:
+            self.reader.execute(
+                "INSERT OR REPLACE INTO JOURNAL_DEAD (SEQ, OPERATION, ARGS, CREATED, ERROR) "
+                "SELECT SEQ, OPERATION, ARGS, CREATED, ? FROM JOURNAL WHERE SEQ = ?",
+                (str(error), seq)
+            )
+            self.reader.execute("DELETE FROM JOURNAL WHERE SEQ = ?", (seq,))
+            self.reader.execute("COMMIT")
+        except Exception:
+            self.reader.execute("ROLLBACK")
+            raise
+        with self.condition:
+            self.depth -= 1
+            self.stats['dead_lettered'] += 1
+            
+    def overlay(self, logins, bundle_scans):
+        """Apply unreplayed entries to the rows SessionStore.hydrate loads from storage"""
+        logins = list(logins)
+        bundle_scans = [list(row) for row in bundle_scans]
+        for _, operation, fields in self.read():
+            if operation == "insert_operator_login":
+                logins.append((fields['rfid'], fields['mac_address'], fields['login_time']))
+            elif operation == "insert_bundle_start":
+                bundle_scans.append([fields['rfid'], fields['mac_address'], fields['bundle_id'],
+                                     fields['start_time'], None])
+            elif operation == "update_bundle_end":
+                for row in bundle_scans:
+                    if row[2] == fields['bundle_id'] and row[1] == fields['mac_address'] and row[4] is None:
+                        row[4] = fields['end_time']
+        logins.sort(key=lambda row: row[2])
+        return logins, bundle_scans
+        
+    def get_stats(self):
+        """Counters plus replay rate since the previous call"""
+        now = time.monotonic()
+        with self.condition:
+            stats = dict(self.stats)
+            stats['depth'] = self.depth
+        last_time, last_replayed = self.last_rate_check
+        stats['replay_rate'] = (stats['replayed'] - last_replayed) / (now - last_time) if now > last_time else 0.0
+        self.last_rate_check = (now, stats['replayed'])
+        return stats
+
+class JournalReplayer:
+    """Background thread that forwards journal entries to storage, oldest first.
+    
+    Storage writes are idempotent on their natural keys (card, MAC and event
+    time), so an entry written just before a crash and replayed again on the
+    next start is not duplicated. After a failure the same entries are retried
+    with exponential backoff, keeping the database in journal order. An entry
+    the database rejects max_attempts times is moved to JOURNAL_DEAD instead of
+    holding up every entry behind it.
+    """
+    # DB-API errors about the statement or its data, and Python errors from a malformed
+    # entry; anything else (connection lost, pool exhausted) is an outage and retried
+    REJECTIONS = ("IntegrityError", "DataError", "ProgrammingError", "NotSupportedError")
+    
+    def __init__(self, journal, db_manager):
+        self.journal = journal
+        self.db_manager = db_manager
+        self.batch_size = CONFIG["journal"]["replay_batch"]
+        self.retry_delay = CONFIG["journal"]["retry_delay"]
+        self.retry_max_delay = CONFIG["journal"]["retry_max_delay"]
+        self.max_attempts = CONFIG["journal"]["max_attempts"]
+        self.failing_seq = None
+        self.attempts = 0
+        self.delay = 0
+        self.retry_at = 0
+        self.running = False
+        self.thread = None
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="journal_replayer", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        with self.journal.condition:
+            self.running = False
+            self.journal.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=10)
+            self.thread = None
+            
+    def run(self):
+        condition = self.journal.condition
+        while True:
+            with condition:
+                while self.running:
+                    wait = self.retry_at - time.monotonic()
+                    if wait > 0:
+                        condition.wait(wait)
+                    elif self.journal.depth:
+                        break
+                    else:
+                        condition.wait()
+                if not self.running:
+                    break
+            self.replay_batch()
+            
+    def is_rejection(self, error):
+        """True when retrying cannot help: the database refused this entry's data"""
+        return isinstance(error, (TypeError, KeyError, ValueError)) or type(error).__name__ in self.REJECTIONS
+        
+    def replay_batch(self):
+        entries = self.journal.read(self.batch_size)
+        applied = 0
+        failure = None
+        try:
+            for seq, operation, fields in entries:
+                if operation in StateJournal.REPLAYABLE:
+                    if getattr(self.db_manager, operation)(**fields) is False:
+                        # Expected when an entry is replayed again after a restart
+                        logging.warning(f"Journal entry {seq} ({operation} {fields}) matched no open row")
+                else:
+                    logging.error(f"Skipping journal entry {seq} with unknown operation {operation}")
+                applied += 1
+        except Exception as e:
+            failure = e
+        if applied:
+            self.journal.remove(entries[applied - 1][0], applied)
+            METRICS.increment("journal_replayed", applied)
+            
+        if failure is None:
+            if self.delay:
+                logging.info(f"Database reachable again, replaying {self.journal.depth} journal entries")
+            self.delay = 0
+            self.failing_seq = None
+            return
+            
+        seq, operation, fields = entries[applied]
+        if self.is_rejection(failure):
+            if seq != self.failing_seq:
+                self.failing_seq, self.attempts = seq, 0
+            self.attempts += 1
+            if self.attempts >= self.max_attempts:
+                logging.error(f"Database rejected journal entry {seq} ({operation} {fields}) "
+                              f"{self.attempts} times, moving it to JOURNAL_DEAD: {failure}")
+                try:
+                    self.journal.dead_letter(seq, failure)
+                except Exception as e:
+                    logging.error(f"Failed to dead-letter journal entry {seq}: {e}", exc_info=True)
+                else:
+                    self.failing_seq = None
+                    METRICS.increment("journal_dead_lettered")
+                    return
+                    
+        self.delay = min(max(self.delay * 2, self.retry_delay), self.retry_max_delay)
+        self.retry_at = time.monotonic() + self.delay
+        with self.journal.condition:
+            self.journal.stats['replay_failures'] += 1
+        logging.warning(f"Journal replay failed at entry {seq}, retrying in {self.delay}s "
+                        f"({self.journal.depth} entries pending): {failure}")
 
-    def close(self):
-        """Close the connection pool"""
-        if self.pool:
-            try:
-                self.pool.close()
-                logging.info("Database connection pool closed")
-            except Exception as e:
-                logging.error(f"Error closing database pool: {e}")
+STORAGE_BACKENDS = {
+    "oracle": OracleStorage,
+    "sqlite": SQLiteStorage
+}
+
+def create_storage():
+    """The backend named in CONFIG["storage"]["backend"]"""
+    backend = CONFIG["storage"]["backend"]
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend]()
 
 class MQTTServer:
-    def __init__(self, gui):
-        self.gui = gui
-        self.db_manager = DatabaseManager()
-        self.thread_pool = ThreadPoolExecutor(
-            max_workers=CONFIG["threading"]["max_workers"],
-            thread_name_prefix="mqtt_worker",
-            maxsize=CONFIG["threading"]["queue_size"]
-        )
+    def __init__(self, observer=None, db_manager=None):
+        self.observer = observer or ServerObserver()
+        self.db_manager = db_manager or create_storage()
+        self.card_index = CardIndex(self.db_manager)
+        self.bundle_cache = LRUCache(CONFIG["bundle_cache"]["max_size"], CONFIG["bundle_cache"]["ttl"])
+        self.sessions = SessionStore()
+        self.status_cache = WorkstationStatusCache()
+        self.sessions.add_listener(self.status_cache.invalidate)
+        self.status_pusher = StatusPusher(self)
+        self.metrics_server = MetricsServer()
+        self.trace_sample_rate = CONFIG["tracing"]["sample_rate"]
+        self.slow_threshold = CONFIG["tracing"]["slow_ms"] / 1000
+        self.slow_log = SlowMessageLog()
+        if CONFIG["workstation"]["push_status"]:
+            self.sessions.add_listener(self.status_pusher.on_session_change)
+        self.bundle_scan_mode = CONFIG["bundle_scan"]["mode"]
+        self.journal = self.journal_replayer = None
+        if CONFIG["journal"]["enabled"]:
+            if self.bundle_scan_mode == "session":
+                self.journal = StateJournal()
+                self.journal_replayer = JournalReplayer(self.journal, self.db_manager)
+            else:
+                logging.warning("Journal not started: it needs the \"session\" bundle_scan mode")
+        self.dispatcher = DeviceDispatcher(self.process_message)
+        self.sequences = SequenceTracker()
+        self.debouncer = ScanDebouncer()
+        self.handlers = {
+            MESSAGE_LOGIN_STATUS: self.handle_login_status,
+            MESSAGE_WORKSTATION_STATUS: self.handle_workstation_status,
+            MESSAGE_SCAN: self.handle_scan
+        }
+        self.admission = AdmissionController()
         self.connected_devices = set()
         self.device_last_seen = {}
         self.device_message_count = defaultdict(int)
         self.device_ip_address = {}
+        self.heartbeat_anomalies = {}  # mac -> [count, last payload] since the last summary
         self.message_count = {'received': 0, 'sent': 0}
         self.message_rate = 0
         self.client = None
@@ -707,14 +3780,54 @@ class MQTTServer:
         self.running = False
         self.lock = threading.Lock()
         self.resource_monitor = ResourceMonitor(self)
+        self.scheduler = Scheduler()
+        self.reconnect_job = None
+        
+        # Initialize observer
+        self.observer.update_connection_status(self.connection_status, False)
         
-        # Initialize GUI
-        self.gui.update_connection_status(self.connection_status, False)
+    def handle_heartbeat(self, mac_address, payload, ip_address=None):
+        """Heartbeat fast path: presence is updated in memory only, never in the database"""
+        self.device_heartbeat(mac_address, ip_address)
+        
+        # Firmware sends "alive"; newer clients send {"timestamp": ...}
+        if payload == "alive":
+            return
+        if payload[:1] == "{" and payload[-1:] == "}":
+            try:
+                if "timestamp" in json.loads(payload):
+                    return
+            except ValueError:
+                pass
         
+        # Anything else is counted and reported in the periodic summary
+        with self.lock:
+            anomaly = self.heartbeat_anomalies.get(mac_address)
+            if anomaly is None:
+                self.heartbeat_anomalies[mac_address] = [1, payload[:200]]
+            else:
+                anomaly[0] += 1
+                anomaly[1] = payload[:200]
+                
+    def flush_heartbeat_anomalies(self):
+        """Log one row per device summarising malformed heartbeats since the last flush"""
+        with self.lock:
+            anomalies, self.heartbeat_anomalies = self.heartbeat_anomalies, {}
+            
+        for mac_address, (count, sample) in anomalies.items():
+            logging.warning(f"{count} malformed heartbeat(s) from {mac_address}")
+            self.db_manager.log_error(
+                error_type="Heartbeat Format",
+                error_message=f"{count} malformed heartbeat(s) since last summary",
+                error_details=f"Last payload: {sample}",
+                mac_address=mac_address
+            )
+    
     def device_heartbeat(self, mac_address, ip_address=None):
         """Update device last seen timestamp and notify GUI"""
+        now = datetime.now()
         with self.lock:
-            self.device_last_seen[mac_address] = datetime.now()
+            self.device_last_seen[mac_address] = now
             
             if ip_address:
                 self.device_ip_address[mac_address] = ip_address
@@ -722,24 +3835,21 @@ class MQTTServer:
             if mac_address not in self.connected_devices:
                 self.connected_devices.add(mac_address)
                 logging.info(f"New device connected: {mac_address}")
-                self.gui.update_device_count(len(self.connected_devices))
+                self.observer.update_device_count(len(self.connected_devices))
             
             # Update device table
             device_data = {
                 'mac_address': mac_address,
-                'last_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'last_seen': now.strftime("%Y-%m-%d %H:%M:%S"),
                 'status': "Active",
                 'message_count': self.device_message_count[mac_address],
                 'ip_address': self.device_ip_address.get(mac_address, 'N/A')
             }
             
-            self.gui.update_device_table(device_data)
+            self.observer.update_device_table(device_data)
     
     def check_device_timeouts(self):
-        """Check for inactive devices and update GUI"""
-        if not self.running:
-            return
-            
+        """Check for inactive devices and update GUI (runs on the scheduler)"""
         try:
             timeout = datetime.now() - timedelta(minutes=CONFIG["device"]["timeout_minutes"])
             inactive_devices = []
@@ -747,7 +3857,7 @@ class MQTTServer:
             with self.lock:
                 for mac, last_seen in list(self.device_last_seen.items()):
                     if last_seen < timeout:
-                        inactive_devices.append(mac)
+                        inactive_devices.append((mac, last_seen))
                         self.connected_devices.discard(mac)
                         del self.device_last_seen[mac]
                         if mac in self.device_ip_address:
@@ -761,14 +3871,14 @@ class MQTTServer:
                             'message_count': self.device_message_count[mac],
                             'ip_address': self.device_ip_address.get(mac, 'N/A')
                         }
-                        self.gui.update_device_table(device_data)
+                        self.observer.update_device_table(device_data)
             
             if inactive_devices:
-                logging.info(f"Devices timed out: {', '.join(inactive_devices)}")
-                self.gui.update_device_count(len(self.connected_devices))
+                logging.info(f"Devices timed out: {', '.join(mac for mac, _ in inactive_devices)}")
+                self.observer.update_device_count(len(self.connected_devices))
                 
                 # Log the timeout events
-                for mac in inactive_devices:
+                for mac, last_seen in inactive_devices:
                     self.db_manager.log_error(
                         error_type="Device Timeout",
                         error_message=f"Device {mac} timed out",
@@ -783,38 +3893,25 @@ class MQTTServer:
                 error_message=str(e),
                 stack_trace=traceback.format_exc()
             )
-        
-        finally:
-            # Schedule next check if still running
-            if self.running:
-                threading.Timer(60.0, self.check_device_timeouts).start()
     
     def increment_message_count(self, direction='received'):
-        """Increment message count and calculate rate"""
+        """Increment message count; the stats tick reports it"""
         with self.lock:
             self.message_count[direction] += 1
             self.resource_monitor.message_count += 1
             
-        # Update GUI stats periodically
-        now = time.time()
-        if hasattr(self, 'last_stats_update'):
-            if now - self.last_stats_update >= 1.0:
-                with self.lock:
-                    rate = self.resource_monitor.message_rate
-                    self.gui.update_message_stats(
-                        self.message_count['received'],
-                        self.message_count['sent'],
-                        rate
-                    )
-                    self.last_stats_update = now
-        else:
-            self.last_stats_update = now
+    def publish_message_stats(self):
+        """Stats tick: push message totals and rate to the observer once a second"""
+        with self.lock:
+            received = self.message_count['received']
+            sent = self.message_count['sent']
+        self.observer.update_message_stats(received, sent, self.resource_monitor.message_rate)
     
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             self.connection_status = "Connected to broker"
             logging.info("Connected to MQTT broker")
-            self.gui.update_connection_status(self.connection_status, True)
+            self.observer.update_connection_status(self.connection_status, True)
             
             # Subscribe to topics with proper QoS
             subscribe_topics = [
@@ -829,8 +3926,10 @@ class MQTTServer:
             client.publish("nodemcu/server/status", "online", qos=2, retain=True)
             self.increment_message_count('sent')
             
-            # Start resource monitoring
-            self.resource_monitor.start()
+            # A successful connect ends any pending retry chain
+            if self.reconnect_job:
+                self.reconnect_job.cancel()
+                self.reconnect_job = None
             
         else:
             self.connection_status = f"Connection failed (code {rc})"
@@ -841,11 +3940,10 @@ class MQTTServer:
                 error_message=error_message,
                 error_details=f"Connection return code: {rc}"
             )
-            self.gui.update_connection_status(self.connection_status, False)
+            self.observer.update_connection_status(self.connection_status, False)
             
             # Attempt reconnect
-            if self.running:
-                threading.Timer(CONFIG["mqtt"]["reconnect_delay"], self.reconnect_client).start()
+            self.schedule_reconnect()
     
     def on_disconnect(self, client, userdata, rc):
         self.connection_status = "Disconnected from broker"
@@ -856,20 +3954,32 @@ class MQTTServer:
             error_message=error_message,
             error_details=f"Disconnection return code: {rc}"
         )
-        self.gui.update_connection_status(self.connection_status, False)
+        self.observer.update_connection_status(self.connection_status, False)
         
         # Attempt reconnect if we didn't initiate the disconnect
-        if self.running and rc != 0:
-            threading.Timer(CONFIG["mqtt"]["reconnect_delay"], self.reconnect_client).start()
+        if rc != 0:
+            self.schedule_reconnect()
+            
+    def schedule_reconnect(self):
+        """Start one backoff retry chain; a flapping broker never gets a second one"""
+        if not self.running or (self.reconnect_job and self.reconnect_job.active):
+            return
+        self.reconnect_job = self.scheduler.call_with_backoff(
+            self.reconnect_client,
+            CONFIG["mqtt"]["reconnect_delay"],
+            CONFIG["mqtt"]["reconnect_max_delay"],
+            name="mqtt_reconnect"
+        )
     
     def reconnect_client(self):
-        """Attempt to reconnect the MQTT client"""
+        """Attempt to reconnect the MQTT client; returns True when no retry is needed"""
         if not self.running or not self.client:
-            return
+            return True
             
         try:
             logging.info("Attempting to reconnect to MQTT broker...")
             self.client.reconnect()
+            return True
         except Exception as e:
             logging.error(f"Reconnect failed: {e}")
             self.db_manager.log_error(
@@ -877,51 +3987,78 @@ class MQTTServer:
                 error_message=str(e),
                 stack_trace=traceback.format_exc()
             )
-            
-            # Schedule another reconnect attempt
-            if self.running:
-                threading.Timer(CONFIG["mqtt"]["reconnect_delay"], self.reconnect_client).start()
+            return False
     
+    def receive(self, msg):
+        """Count an incoming message and show it in the message log; returns the decoded payload"""
+        self.increment_message_count('received')
+        payload = msg.payload.decode().strip()
+        self.observer.add_message(msg.topic, payload, "in")
+        return payload
+        
     def on_message(self, client, userdata, msg):
+        """Fallback for topics without a registered callback"""
         try:
-            self.increment_message_count('received')
+            payload = self.receive(msg)
+            logging.debug(f"Ignoring message on unrouted topic {msg.topic}: {payload[:50]}")
+        except Exception as e:
+            logging.error(f"Error in on_message handler: {e}", exc_info=True)
             
-            payload = msg.payload.decode().strip()
-            topic = msg.topic
+    def record_network_wait(self, msg, kind):
+        """Time the message spent in paho between arriving on the socket and reaching us"""
+        arrived = getattr(msg, 'timestamp', 0)
+        if arrived:
+            METRICS.observe("network_wait", time.monotonic() - arrived, type=kind)
+        METRICS.increment("messages", type=kind)
             
-            # Extract IP address from message if available
-            ip_address = None
-            if hasattr(msg, 'ip_address'):
-                ip_address = msg.ip_address
+    def on_heartbeat(self, client, userdata, msg):
+        """nodemcu/+/heartbeat: handled on the network thread, without touching the database"""
+        try:
+            self.record_network_wait(msg, "heartbeat")
+            payload = self.receive(msg)
+            self.handle_heartbeat(msg.topic.split('/')[1], payload, getattr(msg, 'ip_address', None))
+        except Exception as e:
+            logging.error(f"Error handling heartbeat on {msg.topic}: {e}", exc_info=True)
             
-            # Notify GUI of incoming message
-            self.gui.add_message(topic, payload, "in")
+    def on_status(self, client, userdata, msg):
+        """nodemcu/+/status: any status report counts as the device being present"""
+        try:
+            payload = self.receive(msg)
+            mac_address = msg.topic.split('/')[1]
+            # The wildcard also matches our own retained nodemcu/server/status
+            if not mac_address or mac_address.strip(MAC_CHARS):
+                return
+            self.device_heartbeat(mac_address, getattr(msg, 'ip_address', None))
+            logging.debug(f"Status from {mac_address}: {payload[:50]}")
+        except Exception as e:
+            logging.error(f"Error handling status on {msg.topic}: {e}", exc_info=True)
             
-            # Handle heartbeat messages first
-            if "heartbeat" in topic.lower():
-                mac_address = topic.split('/')[1]
-                self.device_heartbeat(mac_address, ip_address)
+    def on_rfid(self, client, userdata, msg):
+        """nodemcu/rfid: parse once, then queue on the device's shard"""
+        received_at = time.perf_counter()
+        payload = topic = None
+        try:
+            if msg.payload and msg.payload[0] == PROTOCOL_V2:
+                self.on_rfid_v2(client, msg, received_at)
+                return
                 
-                try:
-                    # Try to parse as JSON
-                    json_msg = json.loads(payload)
-                    if "timestamp" in json_msg:
-                        logging.debug(f"JSON heartbeat from {mac_address}, timestamp: {json_msg['timestamp']}")
-                        return
-                except json.JSONDecodeError:
-                    # Not JSON, treat as text
-                    logging.debug(f"Text heartbeat from {mac_address}")
-                    self.db_manager.log_error(
-                        error_type="Heartbeat Format",
-                        error_message="Non-JSON heartbeat received",
-                        error_details=payload,
-                        mac_address=mac_address
-                    )
+            payload = self.receive(msg)
+            topic = msg.topic
+            
+            parsed = parse_rfid_payload(payload)
+            self.record_network_wait(msg, parsed[0] if parsed else "malformed")
+            if parsed is None:
+                error_message = f"Unrecognized message format: {payload}"
+                logging.warning(error_message)
+                self.db_manager.log_error(
+                    error_type="Message Format",
+                    error_message=error_message,
+                    error_details=payload,
+                    topic=topic
+                )
                 return
                 
-            # Process the message in a thread
-            future = self.thread_pool.submit(self.process_message, msg)
-            future.add_done_callback(self.handle_process_result)
+            self.submit(client, topic, payload, parsed, received_at)
             
         except Exception as e:
             error_message = f"Error in on_message handler: {str(e)}"
@@ -933,99 +4070,111 @@ class MQTTServer:
                 stack_trace=traceback.format_exc()
             )
 
-    def handle_process_result(self, future):
-        """Handle the result of message processing"""
-        try:
-            future.result()  # This will re-raise any exceptions from the process
-        except Exception as e:
-            logging.error(f"Message processing failed: {e}", exc_info=True)
-
-    def process_message(self, msg):
-        """Process an MQTT message in a thread"""
-        try:
-            payload = msg.payload.decode().strip()
-            topic = msg.topic
-            client = msg._client  # Access the client from the message
-            
-            # Handle login status
-            if payload.startswith("loginstatus"):
-                mac_address = payload.split()[1]
-                response_topic = f"nodemcu/{mac_address}/response"
-                status = self.check_mac_login_status(mac_address)
-                response = "LOW" if status else "HIGH"
-                client.publish(response_topic, response, qos=1)
-                self.increment_message_count('sent')
-                self.gui.add_message(response_topic, response, "out")
-                logging.info(f"Login status for {mac_address}: {'Logged in' if status else 'Not logged in'}")
-                return
-                
-            # Handle workstation status
-            if payload.startswith("workstationstatus"):
-                mac_address = payload.split()[1]
-                response_topic = f"nodemcu/{mac_address}/response"
-                
-                # First check if there's an operator logged in
-                operator_logged_in = self.check_mac_login_status(mac_address)
-                if not operator_logged_in:
-                    response = CONFIG["responses"]["no_operator"]
-                    client.publish(response_topic, response, qos=1)
-                    self.increment_message_count('sent')
-                    self.gui.add_message(response_topic, response, "out")
-                    logging.info(f"No operator logged in at {mac_address}, skipping status check")
-                    
-                    # Log the no operator event
-                    self.db_manager.log_error(
-                        error_type="Workstation Status",
-                        error_message="No operator logged in",
-                        mac_address=mac_address,
-                        error_details="Workstation status requested but no operator logged in"
-                    )
-                    return
-                    
-                # If operator is logged in, get the status
-                response = self.get_workstation_status(mac_address)
-                client.publish(response_topic, response, qos=1)
+    def on_rfid_v2(self, client, msg, received_at):
+        """v2 frame on nodemcu/rfid: duplicates are dropped by sequence number before queueing"""
+        self.increment_message_count('received')
+        decoded = parse_v2_payload(msg.payload)
+        self.record_network_wait(msg, decoded[0][0] if decoded else "malformed")
+        if decoded is None:
+            payload = msg.payload.hex()
+            self.observer.add_message(msg.topic, f"v2 {payload}", "in")
+            logging.warning(f"Malformed v2 frame: {payload}")
+            self.db_manager.log_error(
+                error_type="Message Format",
+                error_message="Malformed v2 frame",
+                error_details=payload,
+                topic=msg.topic
+            )
+            return
+            
+        parsed, sequence, device_time = decoded
+        kind, mac_address, rfid = parsed
+        payload = f"v2 {kind} {rfid or '-'} {mac_address} seq={sequence} t={device_time}"
+        self.observer.add_message(msg.topic, payload, "in")
+        
+        if self.sequences.is_duplicate(mac_address, sequence):
+            # The device retransmits when it missed our answer; send it again
+            frames = self.sequences.cached_responses(mac_address, sequence)
+            logging.debug(f"Duplicate v2 message {sequence} from {mac_address}, "
+                          f"{len(frames) if frames else 'no'} responses re-sent")
+            for frame in frames or ():
+                client.publish(f"nodemcu/{mac_address}/v2/response", frame, qos=1)
                 self.increment_message_count('sent')
-                self.gui.add_message(response_topic, response, "out")
-                logging.info(f"Workstation status for {mac_address}: {response}")
-                return
-
-            # Process RFID scans
-            match = re.search(r'ID:\s*([0-9A-Fa-f]+)\s*Mac ID:\s*([0-9A-Fa-f:]+)', payload)
-            if not match:
-                error_message = f"Unrecognized message format: {payload}"
-                logging.warning(error_message)
-                self.db_manager.log_error(
-                    error_type="Message Format",
-                    error_message=error_message,
-                    error_details=payload,
-                    topic=topic
-                )
-                return
-
-            rfid, mac_address = match.groups()
-            self.device_heartbeat(mac_address)
-            self.device_message_count[mac_address] += 1
-            response_topic = f"nodemcu/{mac_address}/response"
-            logging.info(f"RFID Scan - Card: {rfid}, Device: {mac_address}")
+            return
+        if self.submit(client, msg.topic, payload, parsed, received_at, sequence):
+            self.sequences.accept(mac_address, sequence)
+        
+    def start_trace(self, topic, payload, received_at):
+        """A new Trace for a sampled message, None otherwise"""
+        rate = self.trace_sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        return Trace(topic, payload, received_at)
+        
+    def submit(self, client, topic, payload, parsed, received_at, sequence=None):
+        """Admit a parsed message and queue it on the device's shard; True once it is queued"""
+        kind, mac_address, _ = parsed
+        is_poll = kind is not MESSAGE_SCAN
+        rejection = self.admission.admit(mac_address)
+        if rejection is not None:
+            logging.debug(f"Rate limited ({rejection}) message from {mac_address}")
+            METRICS.increment("rejected", type=kind, reason=rejection)
+            if not is_poll:
+                self.reject_scan(client, mac_address, sequence)
+            return False
+            
+        item = InboundMessage(client, topic, payload, parsed, sequence, received_at,
+                              self.start_trace(topic, payload, received_at))
+        item.queued_at = time.perf_counter()
+        METRICS.observe("receive", item.queued_at - received_at, type=kind)
+        if item.trace is not None:
+            item.trace.add("receive", received_at, item.queued_at)
+        if not self.dispatcher.submit(mac_address, item, is_poll):
+            METRICS.increment("rejected", type=kind, reason="queue_full")
+            logging.warning(f"Worker queue full, dropped message from {mac_address}: {payload[:50]}")
+            if not is_poll:
+                self.reject_scan(client, mac_address, sequence)
+            return False
+        return True
+        
+    def reject_scan(self, client, mac_address, sequence):
+        """Tell the operator to scan again rather than leave the reader hanging"""
+        client, response_topic = self.responder(client, mac_address, sequence)
+        response = CONFIG["responses"]["error_generic"]
+        client.publish(response_topic, response, qos=1)
+        self.increment_message_count('sent')
+        self.observer.add_message(response_topic, response, "out")
+        
+    def publish_response(self, mac_address, response):
+        """Unsolicited response to a device, in the protocol it last spoke"""
+        if not self.client:
+            return
+        # Devices that send v2 frames get v2 pushes; sequence 0 marks them as unsolicited
+        sequence = 0 if mac_address in self.sequences.last_sequence else None
+        client, response_topic = self.responder(self.client, mac_address, sequence)
+        client.publish(response_topic, response, qos=1)
+        self.increment_message_count('sent')
+        self.observer.add_message(response_topic, response, "out")
+        
+    def responder(self, client, mac_address, sequence):
+        """Client and topic for replies; v2 requests get v2 frames on their own topic"""
+        if sequence is None:
+            return client, f"nodemcu/{mac_address}/response"
+        return V2ResponseClient(client, sequence), f"nodemcu/{mac_address}/v2/response"
 
-            if self.is_employee_card(rfid):
-                self.process_employee_scan(rfid, mac_address, client, response_topic)
-            elif self.is_bundle_card(rfid):
-                self.process_bundle_scan(rfid, mac_address, client, response_topic)
-            else:
-                response = CONFIG["responses"]["unauthorized"]
-                client.publish(response_topic, response, qos=1)
-                self.increment_message_count('sent')
-                self.gui.add_message(response_topic, response, "out")
-                logging.warning(f"Unauthorized card: {rfid}")
-                self.db_manager.log_error(
-                    error_type="Authorization",
-                    error_message="Unauthorized RFID card scanned",
-                    mac_address=mac_address,
-                    rfid=rfid,
-                    error_details="Card not found in employee or bundle systems"
-                )
+    def process_message(self, item):
+        """Run the handler for a parsed nodemcu/rfid message on a dispatcher worker"""
+        kind, mac_address, topic, payload, trace = item.kind, item.mac_address, item.topic, item.payload, item.trace
+        responder, response_topic = self.responder(item.client, mac_address, item.sequence)
+        client = TimedClient(responder)
+        start = time.perf_counter()
+        if trace is not None:
+            trace.add("queue_wait", item.queued_at, start)
+            # Spans inside the handler nest under it
+            trace.depth = 1
+            TRACE_CONTEXT.trace = trace
+        try:
+            self.handlers[kind](client, mac_address, item.rfid, response_topic)
             
         except Exception as e:
             error_message = f"Message processing error: {str(e)}"
@@ -1037,12 +4186,109 @@ class MQTTServer:
                 stack_trace=traceback.format_exc()
             )
             
-            # Send error response if we have the client and topic
-            if 'response_topic' in locals() and client:
-                response = CONFIG["responses"]["error_generic"]
+            # Send error response
+            response = CONFIG["responses"]["error_generic"]
+            client.publish(response_topic, response, qos=1)
+            self.increment_message_count('sent')
+            self.observer.add_message(response_topic, response, "out")
+            
+        finally:
+            if item.sequence is not None:
+                self.sequences.remember_responses(mac_address, item.sequence, responder.sent)
+            end = time.perf_counter()
+            total = end - item.received_at
+            METRICS.observe("handle", end - start, type=kind)
+            METRICS.observe("end_to_end", total, type=kind)
+            if trace is not None:
+                TRACE_CONTEXT.trace = None
+                trace.depth = 0
+                trace.add(f"handle {kind}", start, end)
+                if total >= self.slow_threshold:
+                    self.report_slow_message(trace.to_record(kind, mac_address, total))
+                    
+    def report_slow_message(self, record):
+        METRICS.increment("slow_messages", type=record['type'])
+        try:
+            self.slow_log.write(record)
+        except Exception as e:
+            logging.error(f"Failed to write slow message log: {e}")
+        self.observer.add_slow_message(record)
+            
+    def handle_login_status(self, client, mac_address, rfid, response_topic):
+        """loginstatus <mac>: LOW when an operator is logged in, HIGH otherwise"""
+        status = self.check_mac_login_status(mac_address)
+        response = "LOW" if status else "HIGH"
+        client.publish(response_topic, response, qos=1)
+        self.increment_message_count('sent')
+        self.observer.add_message(response_topic, response, "out")
+        logging.info(f"Login status for {mac_address}: {'Logged in' if status else 'Not logged in'}")
+        
+    def handle_workstation_status(self, client, mac_address, rfid, response_topic):
+        """workstationstatus <mac>: bundle timer colour, or no-operator"""
+        response = self.get_workstation_status(mac_address)
+        if response == CONFIG["responses"]["no_operator"]:
+            client.publish(response_topic, response, qos=1)
+            self.increment_message_count('sent')
+            self.observer.add_message(response_topic, response, "out")
+            logging.info(f"No operator logged in at {mac_address}, skipping status check")
+            
+            # Log the no operator event
+            self.db_manager.log_error(
+                error_type="Workstation Status",
+                error_message="No operator logged in",
+                mac_address=mac_address,
+                error_details="Workstation status requested but no operator logged in"
+            )
+            return
+            
+        client.publish(response_topic, response, qos=1)
+        self.increment_message_count('sent')
+        self.observer.add_message(response_topic, response, "out")
+        logging.info(f"Workstation status for {mac_address}: {response}")
+        
+    def handle_scan(self, client, mac_address, rfid, response_topic):
+        """ID: <card> Mac ID: <mac>: answer repeats from memory, process everything else"""
+        self.device_heartbeat(mac_address)
+        self.device_message_count[mac_address] += 1
+        
+        # A card held on the reader is read again and again; answer repeats from memory
+        responses = self.debouncer.lookup(mac_address, rfid)
+        if responses is not None:
+            logging.debug(f"Repeated scan of {rfid} at {mac_address} within hold-off, replaying response")
+            for response in responses:
                 client.publish(response_topic, response, qos=1)
                 self.increment_message_count('sent')
-                self.gui.add_message(response_topic, response, "out")
+                self.observer.add_message(response_topic, response, "out")
+            return
+            
+        logging.info(f"RFID Scan - Card: {rfid}, Device: {mac_address}")
+        recorder = RecordingClient(client)
+        self.route_scan(recorder, mac_address, rfid, response_topic)
+        
+        # Failures are not cached, so the operator can simply scan again
+        if recorder.payloads and CONFIG["responses"]["error_generic"] not in recorder.payloads:
+            self.debouncer.remember(mac_address, rfid, recorder.payloads)
+                
+    def route_scan(self, client, mac_address, rfid, response_topic):
+        """Send the card to the employee or bundle flow"""
+        card_kind, card_id = self.card_index.classify(rfid)
+        if card_kind == CARD_EMPLOYEE:
+            self.process_employee_scan(rfid, mac_address, client, response_topic)
+        elif card_kind == CARD_BUNDLE:
+            self.process_bundle_scan(rfid, mac_address, client, response_topic, card_id)
+        else:
+            response = CONFIG["responses"]["unauthorized"]
+            client.publish(response_topic, response, qos=1)
+            self.increment_message_count('sent')
+            self.observer.add_message(response_topic, response, "out")
+            logging.warning(f"Unauthorized card: {rfid}")
+            self.db_manager.log_error(
+                error_type="Authorization",
+                error_message="Unauthorized RFID card scanned",
+                mac_address=mac_address,
+                rfid=rfid,
+                error_details="Card not found in employee or bundle systems"
+            )
 
     def process_employee_scan(self, rfid, mac_address, client, response_topic):
         """Process an employee RFID scan"""
@@ -1064,11 +4310,11 @@ class MQTTServer:
                 # First send LOW signal (matches NodeMCU code)
                 client.publish(response_topic, "LOW", qos=1)
                 self.increment_message_count('sent')
-                self.gui.add_message(response_topic, "LOW", "out")
+                self.observer.add_message(response_topic, "LOW", "out")
                 # Then send the success message
                 client.publish(response_topic, response, qos=1)
                 self.increment_message_count('sent')
-                self.gui.add_message(response_topic, response, "out")
+                self.observer.add_message(response_topic, response, "out")
                 logging.info(f"Employee {rfid} login successful")
             else:
                 response = CONFIG["responses"]["error_generic"]
@@ -1084,10 +4330,18 @@ class MQTTServer:
         
         client.publish(response_topic, response, qos=1)
         self.increment_message_count('sent')
-        self.gui.add_message(response_topic, response, "out")
+        self.observer.add_message(response_topic, response, "out")
 
-    def process_bundle_scan(self, rfid, mac_address, client, response_topic):
-        """Process a bundle RFID scan"""
+    def process_bundle_scan(self, rfid, mac_address, client, response_topic, indexed_id=None):
+        """Process a bundle RFID scan; indexed_id is the card index's answer, when the caller has it"""
+        if self.bundle_scan_mode == "plsql":
+            response = self.run_bundle_scan_transaction(rfid, mac_address)
+            client.publish(response_topic, response, qos=1)
+            self.increment_message_count('sent')
+            self.observer.add_message(response_topic, response, "out")
+            logging.info(f"Response sent: {response}")
+            return
+            
         if not self.check_mac_login_status(mac_address):
             response = CONFIG["responses"]["login_required"]
             logging.warning("Operator login required")
@@ -1099,7 +4353,7 @@ class MQTTServer:
             )
             client.publish(response_topic, response, qos=1)
             self.increment_message_count('sent')
-            self.gui.add_message(response_topic, response, "out")
+            self.observer.add_message(response_topic, response, "out")
             return
 
         # Check if bundle is active on another MAC address
@@ -1117,7 +4371,7 @@ class MQTTServer:
             )
             client.publish(response_topic, response, qos=1)
             self.increment_message_count('sent')
-            self.gui.add_message(response_topic, response, "out")
+            self.observer.add_message(response_topic, response, "out")
             return
 
         # Check if another bundle is active on this MAC
@@ -1133,10 +4387,10 @@ class MQTTServer:
             )
             client.publish(response_topic, response, qos=1)
             self.increment_message_count('sent')
-            self.gui.add_message(response_topic, response, "out")
+            self.observer.add_message(response_topic, response, "out")
             return
 
-        current_bundle_id = self.get_bundle_id(rfid)
+        current_bundle_id = self.get_bundle_id(rfid, fallback=indexed_id)
         if current_bundle_id is None:
             response = CONFIG["responses"]["error_generic"]
             error_message = f"No bundle found for RFID: {rfid}"
@@ -1149,7 +4403,7 @@ class MQTTServer:
             )
             client.publish(response_topic, response, qos=1)
             self.increment_message_count('sent')
-            self.gui.add_message(response_topic, response, "out")
+            self.observer.add_message(response_topic, response, "out")
             return
 
         # Check if this bundle_id has been scanned before
@@ -1157,6 +4411,8 @@ class MQTTServer:
             if self.is_bundle_active(current_bundle_id, mac_address):
                 if self.update_bundle_end_time(current_bundle_id, mac_address):
                     response = CONFIG["responses"]["bundle_ended"]
+                    # The tag may be re-issued to a new bundle once this one ends
+                    self.bundle_cache.invalidate(rfid)
                     logging.info(f"Bundle {rfid} ended")
                 else:
                     response = CONFIG["responses"]["error_generic"]
@@ -1190,11 +4446,205 @@ class MQTTServer:
 
         client.publish(response_topic, response, qos=1)
         self.increment_message_count('sent')
-        self.gui.add_message(response_topic, response, "out")
+        self.observer.add_message(response_topic, response, "out")
         logging.info(f"Response sent: {response}")
 
-    # Database operation methods remain largely the same as in your original code
-    # but with additional error handling and logging
+    @traced
+    def run_bundle_scan_transaction(self, rfid, mac_address):
+        """Process a bundle scan in a single PL/SQL round trip and mirror the result in memory"""
+        event_time = db_now()
+        try:
+            response, transition, bundle_id = self.db_manager.run_bundle_scan_block(rfid, mac_address, event_time)
+        except Exception as e:
+            error_message = f"Bundle scan transaction failed: {e}"
+            logging.error(error_message, exc_info=True)
+            self.db_manager.log_error(
+                error_type="Bundle Error",
+                error_message=error_message,
+                mac_address=mac_address,
+                rfid=rfid,
+                stack_trace=traceback.format_exc()
+            )
+            return CONFIG["responses"]["error_generic"]
+            
+        if transition == "STARTED":
+            self.sessions.claim_bundle(rfid, mac_address, bundle_id, event_time)
+        elif transition == "ENDED":
+            active = self.sessions.active_bundle(mac_address)
+            if active is not None:
+                self.sessions.release_bundle(mac_address, active[1])
+        elif transition is not None:
+            self.db_manager.log_error(
+                error_type="Bundle Error",
+                error_message=f"Bundle scan transaction returned {transition}",
+                mac_address=mac_address,
+                rfid=rfid
+            )
+        elif response == CONFIG["responses"]["login_required"]:
+            self.db_manager.log_error(
+                error_type="Authorization",
+                error_message="Operator login required for bundle scan",
+                mac_address=mac_address,
+                rfid=rfid
+            )
+        elif response != CONFIG["responses"]["bundle_completed"]:
+            self.db_manager.log_error(
+                error_type="Bundle Conflict",
+                error_message=f"Bundle scan rejected: {response}",
+                mac_address=mac_address,
+                rfid=rfid
+            )
+        return response
+        
+    @traced
+    def get_bundle_id(self, rfid, fallback=None):
+        """Resolve a bundle RFID to its bundle id, skipping the view on cache hits.
+        
+        fallback, the card index's id for the card, answers when the view cannot
+        be read, so scans are still served while the journal covers an outage.
+        """
+        bundle_id = self.bundle_cache.get(rfid)
+        if bundle_id is None:
+            try:
+                bundle_id = self.db_manager.fetch_bundle_id(rfid)
+            except Exception as e:
+                if fallback is None:
+                    raise
+                logging.warning(f"Bundle lookup for {rfid} failed, using the card index: {e}")
+                return fallback
+            if bundle_id is not None:
+                self.bundle_cache.put(rfid, bundle_id)
+        return bundle_id
+
+    # Workstation state checks are answered from the session store; every
+    # transition is written through to Oracle before the store is updated
+    
+    @traced
+    def check_mac_login_status(self, mac_address):
+        """Check whether an operator is logged in at a workstation"""
+        return self.sessions.operator_at(mac_address) is not None
+        
+    @traced
+    def is_rfid_already_logged_in(self, rfid, mac_address):
+        """Check whether this operator is already logged in at this workstation"""
+        return self.sessions.operator_at(mac_address) == rfid
+        
+    @traced
+    def record_write(self, operation, **fields):
+        """Persist a session change: to the journal when it is on, straight to storage otherwise.
+        
+        Returns what storage returned, or None when the write was journaled.
+        """
+        if self.journal is not None:
+            self.journal.append(operation, fields)
+            return None
+        return getattr(self.db_manager, operation)(**fields)
+            
+    @traced
+    def insert_employee_login(self, rfid, mac_address):
+        """Record an operator login"""
+        login_time = db_now()
+        try:
+            self.record_write("insert_operator_login", rfid=rfid, mac_address=mac_address, login_time=login_time)
+        except Exception as e:
+            logging.error(f"Failed to insert login for {rfid} at {mac_address}: {e}", exc_info=True)
+            return False
+        self.sessions.login(rfid, mac_address, login_time)
+        return True
+        
+    @traced
+    def is_bundle_active_on_other_mac(self, rfid, mac_address):
+        """Return the MAC where this bundle is active, if it is not this one"""
+        other_mac = self.sessions.bundle_location(rfid)
+        return other_mac if other_mac and other_mac != mac_address else None
+        
+    @traced
+    def is_other_bundle_active(self, mac_address, rfid):
+        """Check whether a different bundle is still active at this workstation"""
+        active = self.sessions.active_bundle(mac_address)
+        return active is not None and active[0] != rfid
+        
+    @traced
+    def is_bundle_already_scanned(self, bundle_id, mac_address):
+        return self.sessions.has_scanned(bundle_id, mac_address)
+        
+    @traced
+    def is_bundle_active(self, bundle_id, mac_address):
+        active = self.sessions.active_bundle(mac_address)
+        return active is not None and active[1] == bundle_id
+        
+    @traced
+    def insert_bundle_scan(self, rfid, mac_address, bundle_id):
+        """Start a bundle at a workstation"""
+        start_time = db_now()
+        other_mac = self.sessions.claim_bundle(rfid, mac_address, bundle_id, start_time)
+        if other_mac:
+            logging.warning(f"Bundle {rfid} was claimed by {other_mac} concurrently")
+            return False
+            
+        try:
+            self.record_write("insert_bundle_start", rfid=rfid, mac_address=mac_address,
+                              bundle_id=bundle_id, start_time=start_time)
+        except Exception as e:
+            self.sessions.release_bundle(mac_address, bundle_id, forget_scan=True)
+            logging.error(f"Failed to insert bundle scan {bundle_id} at {mac_address}: {e}", exc_info=True)
+            return False
+        return True
+        
+    @traced
+    def update_bundle_end_time(self, bundle_id, mac_address):
+        """End the active bundle at a workstation"""
+        try:
+            ended = self.record_write("update_bundle_end", bundle_id=bundle_id, mac_address=mac_address,
+                                      end_time=db_now())
+        except Exception as e:
+            logging.error(f"Failed to end bundle {bundle_id} at {mac_address}: {e}", exc_info=True)
+            return False
+        if ended is False:
+            # The store had the bundle active but the database has no open row for it;
+            # releasing it here brings the two back in step
+            error_message = f"Bundle {bundle_id} at {mac_address} had no open scan row to end"
+            logging.warning(error_message)
+            self.db_manager.log_error(
+                error_type="Bundle Error",
+                error_message=error_message,
+                mac_address=mac_address
+            )
+        self.sessions.release_bundle(mac_address, bundle_id)
+        return True
+        
+    @traced
+    def get_workstation_status(self, mac_address):
+        """Answer to a status poll, served from the status cache while it is still valid"""
+        response = self.status_cache.get(mac_address)
+        if response is None:
+            generation = self.status_cache.generation
+            response, valid_for = self.compute_workstation_status(mac_address)
+            self.status_cache.put(mac_address, response, valid_for, generation)
+        return response
+        
+    def compute_workstation_status(self, mac_address):
+        """Status colour from how long the active bundle has been running, and the
+        seconds until it changes by itself (None when only a session event can change it)"""
+        now = datetime.now()
+        login_expires_at = self.sessions.login_expires_at(mac_address)
+        if login_expires_at is None or login_expires_at <= now:
+            return CONFIG["responses"]["no_operator"], None
+        valid_for = (login_expires_at - now).total_seconds()
+            
+        active = self.sessions.active_bundle(mac_address)
+        if active is None:
+            return CONFIG["responses"]["status_green"], valid_for
+            
+        elapsed = (now - active[2]).total_seconds()
+        warning = CONFIG["workstation"]["warning_minutes"] * 60
+        limit = CONFIG["workstation"]["limit_minutes"] * 60
+        if elapsed >= limit:
+            return CONFIG["responses"]["status_red"], valid_for
+        if elapsed >= warning:
+            return CONFIG["responses"]["status_yellow"], min(valid_for, limit - elapsed)
+        return CONFIG["responses"]["status_green"], min(valid_for, warning - elapsed)
+    
     
     def setup_mqtt_client(self):
         """Create and configure the MQTT client"""
@@ -1210,6 +4660,11 @@ class MQTTServer:
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         
+        # Route each subscription straight to its handler
+        self.client.message_callback_add("nodemcu/rfid", self.on_rfid)
+        self.client.message_callback_add("nodemcu/+/heartbeat", self.on_heartbeat)
+        self.client.message_callback_add("nodemcu/+/status", self.on_status)
+        
         # Set will message
         self.client.will_set(
             "nodemcu/server/status",
@@ -1235,6 +4690,19 @@ class MQTTServer:
         try:
             logging.info("Starting MQTT RFID Server")
             self.running = True
+            logins = self.db_manager.load_operator_logins()
+            bundle_scans = self.db_manager.load_bundle_scans()
+            if self.journal is not None:
+                # Changes still waiting in the journal are newer than the database
+                logins, bundle_scans = self.journal.overlay(logins, bundle_scans)
+                self.journal.start()
+                self.journal_replayer.start()
+            self.sessions.hydrate(logins, bundle_scans)
+            self.scheduler.start()
+            if CONFIG["metrics"]["enabled"]:
+                self.metrics_server.start()
+            self.card_index.start(self.scheduler)
+            self.dispatcher.start()
             self.client = self.setup_mqtt_client()
             
             self.client.connect(
@@ -1246,8 +4714,29 @@ class MQTTServer:
             # Start network loop
             self.client.loop_start()
             
-            # Start device timeout checker
-            self.check_device_timeouts()
+            # Periodic jobs: device timeouts, stats tick, resource monitoring
+            self.scheduler.call_every(
+                CONFIG["device"]["timeout_check_interval"],
+                self.check_device_timeouts,
+                name="device_timeouts"
+            )
+            self.scheduler.call_every(1.0, self.publish_message_stats, name="message_stats")
+            self.scheduler.call_every(
+                CONFIG["error_log"]["flush_interval"],
+                self.db_manager.error_aggregator.flush,
+                name="error_aggregation"
+            )
+            self.scheduler.call_every(
+                CONFIG["device"]["heartbeat_anomaly_interval"],
+                self.flush_heartbeat_anomalies,
+                name="heartbeat_anomalies"
+            )
+            self.scheduler.call_every(
+                CONFIG["session"]["history_prune_interval"],
+                self.sessions.prune_history,
+                name="session_history"
+            )
+            self.resource_monitor.start(self.scheduler)
             
             return True
             
@@ -1259,19 +4748,25 @@ class MQTTServer:
                 error_message=error_message,
                 stack_trace=traceback.format_exc()
             )
-            self.running = False
+            # Callers discard a server that failed to start, so release everything it
+            # brought up, the metrics port included, before Start Server is tried again
+            self.stop()
             return False
     
     def stop(self):
-        """Stop the MQTT server"""
+        """Stop the MQTT server; also tears down what a failed start() left running"""
         logging.info("Shutting down server...")
         self.running = False
         
         try:
+            # Stop every timer job before tearing anything down
+            self.scheduler.stop()
+            
             if self.client:
                 # Publish offline status before disconnecting
-                self.client.publish("nodemcu/server/status", "offline", qos=2, retain=True)
-                self.increment_message_count('sent')
+                if self.client.is_connected():
+                    self.client.publish("nodemcu/server/status", "offline", qos=2, retain=True)
+                    self.increment_message_count('sent')
                 
                 # Disconnect cleanly
                 self.client.disconnect()
@@ -1279,9 +4774,19 @@ class MQTTServer:
                 
             # Stop resource monitoring
             self.resource_monitor.stop()
+            self.metrics_server.stop()
+            self.card_index.stop()
+            
+            # Drain and stop the workers
+            self.dispatcher.stop()
             
-            # Shutdown thread pool
-            self.thread_pool.shutdown(wait=True)
+            # Workers no longer append; what the replayer has not forwarded stays in the journal
+            if self.journal is not None:
+                self.journal_replayer.stop()
+                self.journal.stop()
+            
+            # Queue the last heartbeat summary before the error writer closes
+            self.flush_heartbeat_anomalies()
             
             # Close database pool
             self.db_manager.close()
@@ -1297,12 +4802,6 @@ class MQTTServer:
                 stack_trace=traceback.format_exc()
             )
     
-    def throttle_messages(self):
-        """Reduce message processing rate when threshold exceeded"""
-        logging.warning("Message rate threshold exceeded, throttling messages")
-        # Reduce thread pool size temporarily
-        self.thread_pool._max_workers = max(10, self.thread_pool._max_workers // 2)
-        
     def refresh_device_status(self):
         """Refresh all device statuses in the GUI"""
         with self.lock:
@@ -1314,25 +4813,12 @@ class MQTTServer:
                     'message_count': self.device_message_count.get(mac, 0),
                     'ip_address': self.device_ip_address.get(mac, 'N/A')
                 }
-                self.gui.update_device_table(device_data)
+                self.observer.update_device_table(device_data)
                 
     def refresh_error_logs(self):
         """Refresh error logs from database"""
         try:
-            self.gui.errors_tree.delete(*self.gui.errors_tree.get_children())
-            
-            with self.db_manager.get_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        f"SELECT TO_CHAR(TIMESTAMP, 'YYYY-MM-DD HH24:MI:SS'), ERROR_TYPE, "
-                        "ERROR_MESSAGE, MAC_ADDRESS, RFID "
-                        f"FROM {CONFIG['tables']['error_logs']} "
-                        "ORDER BY TIMESTAMP DESC LIMIT 1000"
-                    )
-                    
-                    for row in cursor:
-                        self.gui.errors_tree.insert('', tk.END, values=row)
-                        
+            self.observer.show_error_logs(self.db_manager.fetch_error_logs())
         except Exception as e:
             logging.error(f"Error refreshing error logs: {e}", exc_info=True)
             
@@ -1347,7 +4833,7 @@ class MQTTServer:
                     del self.device_ip_address[mac_address]
                     
                 logging.info(f"Forcefully disconnected device: {mac_address}")
-                self.gui.update_device_count(len(self.connected_devices))
+                self.observer.update_device_count(len(self.connected_devices))
                 
                 # Update device table
                 device_data = {
@@ -1357,20 +4843,57 @@ class MQTTServer:
                     'message_count': self.device_message_count.get(mac_address, 0),
                     'ip_address': 'N/A'
                 }
-                self.gui.update_device_table(device_data)
+                self.observer.update_device_table(device_data)
                 
                 return True
         return False
 
+def run_dashboard():
+    """Run the server behind the Tk dashboard"""
+    load_tk()
+    root = tk.Tk()
+    
+    # Create the GUI
+    gui = DashboardGUI(root)
+    
+    # Start the application
+    root.mainloop()
+
+def run_headless():
+    """Run the server without a GUI until SIGINT or SIGTERM"""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    
+    server = MQTTServer(LoggingObserver())
+    if not server.start():
+        sys.exit(1)
+        
+    while not stop_event.wait(1.0):
+        pass
+    server.stop()
+
 def main():
+    parser = argparse.ArgumentParser(description="MQTT RFID Server")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run without the Tk dashboard (for systemd or containers)"
+    )
+    parser.add_argument(
+        "--storage",
+        choices=sorted(STORAGE_BACKENDS),
+        help='storage backend, overriding CONFIG["storage"]["backend"]'
+    )
+    args = parser.parse_args()
+    if args.storage:
+        CONFIG["storage"]["backend"] = args.storage
+    
     try:
-        root = tk.Tk()
-        
-        # Create the GUI
-        gui = DashboardGUI(root)
-        
-        # Start the application
-        root.mainloop()
+        if args.headless:
+            run_headless()
+        else:
+            run_dashboard()
         
     except Exception as e:
         logging.error(f"Fatal error in main: {e}", exc_info=True)
@@ -0,0 +1,86 @@
+"""Compare bundle scan latency between the "session" and "plsql" modes.
+
+Runs against the database configured in CONFIG and writes real rows, so point
+it at a test schema. Each iteration logs an operator in once, then starts and
+ends every bundle card given on the command line.
+
+    python tools/bench_bundle_scan.py --mac AA:BB:CC:DD:EE:FF \\
+        --employee 0001234567 --bundles 0007654321 0007654322 --iterations 50
+"""
+import argparse
+import statistics
+import time
+
+from server_module import load_server_module
+
+server_module = load_server_module()
+
+class NullClient:
+    def publish(self, topic, payload, qos=0, retain=False):
+        pass
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run_mode(server, mode, args):
+    server.bundle_scan_mode = mode
+    client = NullClient()
+    topic = f"nodemcu/{args.mac}/response"
+    server.process_employee_scan(args.employee, args.mac, client, topic)
+    
+    samples = []
+    for _ in range(args.iterations):
+        for rfid in args.bundles:
+            # First scan starts the bundle, second scan ends it
+            for _ in range(2):
+                start = time.perf_counter()
+                server.process_bundle_scan(rfid, args.mac, client, topic)
+                samples.append((time.perf_counter() - start) * 1000)
+        # Allow the same bundles to start again on the next iteration
+        reset_bundles(server, args)
+    return samples
+
+def reset_bundles(server, args):
+    """Remove the benchmark's bundle scans from the database and the session store"""
+    with server.db_manager.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {server_module.CONFIG['tables']['bundle_scans']} "
+                "WHERE MAC_ADDRESS = :mac_address AND RFID = :rfid",
+                [{'mac_address': args.mac, 'rfid': rfid} for rfid in args.bundles]
+            )
+            conn.commit()
+    server.sessions.scanned = {
+        scan: start_time for scan, start_time in server.sessions.scanned.items() if scan[1] != args.mac
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mac", required=True)
+    parser.add_argument("--employee", required=True, help="employee card number")
+    parser.add_argument("--bundles", nargs="+", required=True, help="bundle card numbers")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    
+    server = server_module.MQTTServer()
+    server.sessions.hydrate(
+        server.db_manager.load_operator_logins(),
+        server.db_manager.load_bundle_scans()
+    )
+    try:
+        reset_bundles(server, args)
+        for mode in ("session", "plsql"):
+            samples = run_mode(server, mode, args)
+            print(
+                f"{mode:8s} scans={len(samples):5d} "
+                f"mean={statistics.mean(samples):7.2f}ms "
+                f"p50={percentile(samples, 50):7.2f}ms "
+                f"p95={percentile(samples, 95):7.2f}ms "
+                f"p99={percentile(samples, 99):7.2f}ms"
+            )
+    finally:
+        server.db_manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measure per-message parse cost of nodemcu/rfid payloads.
+
+"before" is the original chain of startswith checks followed by an uncompiled
+re.search; "after" is parse_rfid_payload from the server. No broker or
+database is needed.
+
+    python tools/bench_parse.py --number 200000
+"""
+import argparse
+import re
+import timeit
+
+from server_module import load_server_module
+
+server_module = load_server_module()
+
+MAC = "AA:BB:CC:DD:EE:FF"
+PAYLOADS = {
+    "scan": f"ID: 0012345678 Mac ID: {MAC}",
+    "loginstatus": f"loginstatus {MAC}",
+    "workstationstatus": f"workstationstatus {MAC}",
+    "malformed": "ID: ??? Mac ID: ???"
+}
+
+def parse_before(payload):
+    """The dispatch logic process_message used before topic routing"""
+    if "heartbeat" in "nodemcu/rfid".lower():
+        return None
+    if payload.startswith("loginstatus"):
+        return "loginstatus", payload.split()[1], None
+    if payload.startswith("workstationstatus"):
+        return "workstationstatus", payload.split()[1], None
+    match = re.search(r'ID:\s*([0-9A-Fa-f]+)\s*Mac ID:\s*([0-9A-Fa-f:]+)', payload)
+    if not match:
+        return None
+    rfid, mac_address = match.groups()
+    return "scan", mac_address, rfid
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000, help="calls per payload and parser")
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    parse_after = server_module.parse_rfid_payload
+    print(f"{'payload':18s} {'before':>10s} {'after':>10s} {'speedup':>8s}")
+    for name, payload in PAYLOADS.items():
+        results = []
+        for func in (parse_before, parse_after):
+            best = min(timeit.repeat(lambda: func(payload), number=args.number, repeat=args.repeat))
+            results.append(best / args.number * 1e9)
+        before, after = results
+        print(f"{name:18s} {before:8.0f}ns {after:8.0f}ns {before / after:7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Benchmark the message-processing pipeline in-process, without a broker or Oracle.
+
+Parsed nodemcu/rfid messages are queued on the server's DeviceDispatcher and
+handled by MQTTServer.process_message against a fake MQTT client and an
+in-memory FakeDatabase. Every database round trip sleeps for --db-latency ms.
+With --storage sqlite the SQLite backend is used instead, on a temporary file.
+Three workloads are run at each worker count:
+
+    scan               login, then bundle start / bundle end on fresh bundle cards
+    loginstatus        loginstatus polls from every device
+    workstationstatus  polls from logged-in devices, half of them with a bundle active
+
+Each run reports messages/sec and latency percentiles from queueing to the
+handler returning. By default every message is queued at once, so latency
+includes the backlog; --rate offers them at a fixed rate instead. A separate
+single-threaded pass under tracemalloc reports the peak and retained memory
+allocated per message. Results can be written as JSON and compared against an
+earlier file; the exit status is 1 on regression.
+
+    python tools/bench_pipeline.py --workers 1 4 16 --db-latency 2 --output after.json \\
+        --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from server_module import load_server_module
+
+server_module = load_server_module()
+CONFIG = server_module.CONFIG
+
+WORKLOADS = ("scan", "loginstatus", "workstationstatus")
+
+def employee_card(device):
+    return f"1{device:09d}"
+
+def bundle_card(device, cycle):
+    return f"2{device:05d}{cycle:04d}"
+
+def device_mac(device):
+    return "02:00:00:{:02X}:{:02X}:{:02X}".format(device >> 16 & 0xFF, device >> 8 & 0xFF, device & 0xFF)
+
+class FakeDatabase:
+    """In-memory stand-in for a StorageBackend; each round trip sleeps for latency seconds"""
+    def __init__(self, cards, latency):
+        self.cards = cards
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.logins = []
+        self.bundle_scans = []
+        self.round_trips = 0
+        self.errors = 0
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def load_card_index(self):
+        self.round_trip()
+        return dict(self.cards)
+
+    def lookup_card(self, rfid):
+        self.round_trip()
+        return self.cards.get(rfid, (server_module.CARD_UNKNOWN, None))
+
+    def fetch_bundle_id(self, rfid):
+        self.round_trip()
+        kind, card_id = self.cards.get(rfid, (None, None))
+        return card_id if kind == server_module.CARD_BUNDLE else None
+
+    def load_operator_logins(self):
+        return list(self.logins)
+
+    def load_bundle_scans(self):
+        return list(self.bundle_scans)
+
+    def insert_operator_login(self, rfid, mac_address, login_time):
+        self.round_trip()
+        with self.lock:
+            self.logins.append((rfid, mac_address, login_time))
+
+    def insert_bundle_start(self, rfid, mac_address, bundle_id, start_time):
+        self.round_trip()
+        with self.lock:
+            self.bundle_scans.append([rfid, mac_address, bundle_id, start_time, None])
+
+    def update_bundle_end(self, bundle_id, mac_address, end_time):
+        self.round_trip()
+        with self.lock:
+            for scan in self.bundle_scans:
+                if scan[2] == bundle_id and scan[1] == mac_address and scan[4] is None:
+                    scan[4] = end_time
+                    return True
+        return False
+
+    def log_error(self, error_type, error_message, **details):
+        with self.lock:
+            self.errors += 1
+        return True
+
+    def get_pool_stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+class NullClient:
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+
+def build_messages(workload, devices, count):
+    """Raw payloads in arrival order, plus the cards the fake database must know"""
+    cards = {employee_card(device): (server_module.CARD_EMPLOYEE, 1000 + device) for device in range(devices)}
+    messages = []
+    if workload == "scan":
+        # Per device: login, then start and end bundle after bundle
+        per_device = max(1, count // devices)
+        scripts = []
+        for device in range(devices):
+            script = [f"ID: {employee_card(device)} Mac ID: {device_mac(device)}"]
+            cycle = 0
+            while len(script) < per_device:
+                card = bundle_card(device, cycle)
+                cards[card] = (server_module.CARD_BUNDLE, device * 10000 + cycle)
+                script += [f"ID: {card} Mac ID: {device_mac(device)}"] * 2
+                cycle += 1
+            scripts.append(script[:per_device])
+        # Interleave devices so every shard stays busy
+        for position in range(per_device):
+            messages += [script[position] for script in scripts]
+    else:
+        for device in range(devices):
+            cards[bundle_card(device, 0)] = (server_module.CARD_BUNDLE, device * 10000)
+        messages = [f"{workload} {device_mac(index % devices)}" for index in range(count)]
+    return messages, cards
+
+def make_server(workload, devices, messages, cards, args):
+    CONFIG["threading"]["shards"] = args.workers_now
+    CONFIG["threading"]["queue_size"] = len(messages) + 1
+    CONFIG["threading"]["full_policy"] = "block"
+    # Scripted scans repeat bundle cards faster than a person would
+    CONFIG["debounce"]["hold_off"] = 0
+    CONFIG["bundle_scan"]["mode"] = "session"
+    CONFIG["tracing"]["sample_rate"] = args.trace_sample_rate
+
+    if args.storage == "sqlite":
+        storage = sqlite_storage(cards, args)
+    else:
+        storage = FakeDatabase(cards, args.db_latency / 1000)
+    server = server_module.MQTTServer(db_manager=storage)
+    server.card_index.refresh()
+    client = NullClient()
+    if workload == "workstationstatus":
+        # Log everyone in and start a bundle on every other device, via the scan handlers directly
+        for device in range(devices):
+            mac = device_mac(device)
+            topic = f"nodemcu/{mac}/response"
+            server.process_employee_scan(employee_card(device), mac, client, topic)
+            if device % 2:
+                server.process_bundle_scan(bundle_card(device, 0), mac, client, topic)
+    return server, client
+
+def sqlite_storage(cards, args):
+    """A fresh SQLite database holding the workload's cards"""
+    args.databases += 1
+    CONFIG["storage"]["sqlite_path"] = os.path.join(args.database_dir, f"bench-{args.databases}.db")
+    storage = server_module.SQLiteStorage()
+    employees = [(card, card_id) for card, (kind, card_id) in cards.items() if kind == server_module.CARD_EMPLOYEE]
+    bundles = [(card, card_id) for card, (kind, card_id) in cards.items() if kind == server_module.CARD_BUNDLE]
+    conn = storage.connection()
+    conn.executemany(f"INSERT INTO {CONFIG['tables']['employee']} VALUES (?, ?)", employees)
+    conn.executemany(f"INSERT INTO {CONFIG['tables']['bundle']} VALUES (?, ?)", bundles)
+    return storage
+
+def inbound(server, client, payload):
+    parsed = server_module.parse_rfid_payload(payload)
+    received_at = time.perf_counter()
+    item = server_module.InboundMessage(client, "nodemcu/rfid", payload, parsed, None, received_at,
+                                        server.start_trace("nodemcu/rfid", payload, received_at))
+    item.queued_at = received_at
+    return item
+
+def run_throughput(workload, devices, messages, cards, args):
+    server, client = make_server(workload, devices, messages, cards, args)
+    latencies = []
+    done = threading.Event()
+    remaining = [len(messages)]
+    remaining_lock = threading.Lock()
+
+    def handler(item):
+        try:
+            server.process_message(item)
+        finally:
+            latencies.append(time.perf_counter() - item.received_at)
+            with remaining_lock:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    done.set()
+
+    server.dispatcher.handler = handler
+    server.dispatcher.start()
+    start = time.perf_counter()
+    interval = 1 / args.rate if args.rate else 0
+    for index, payload in enumerate(messages):
+        if interval:
+            delay = start + index * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        item = inbound(server, client, payload)
+        server.dispatcher.submit(item.mac_address, item, item.kind is not server_module.MESSAGE_SCAN)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    server.dispatcher.stop()
+    server.db_manager.close()
+
+    latencies.sort()
+    return {
+        'messages': len(messages),
+        'elapsed_s': elapsed,
+        'msgs_per_s': len(messages) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'db_round_trips_per_msg': server.db_manager.round_trips / len(messages),
+        'responses_per_msg': client.published / len(messages)
+    }
+
+def run_allocations(workload, devices, messages, cards, args):
+    """Peak and retained bytes per message, calling process_message on this thread"""
+    args.workers_now = 1
+    server, client = make_server(workload, devices, messages, cards, args)
+    items = [inbound(server, client, payload) for payload in messages]
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    peak_total = 0
+    for item in items:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        server.process_message(item)
+        peak_total += tracemalloc.get_traced_memory()[1] - before
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    server.db_manager.close()
+    return {
+        'peak_bytes_per_msg': peak_total / len(items),
+        'retained_bytes_per_msg': retained / len(items)
+    }
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def compare(results, baseline, tolerance):
+    """Print changes against an earlier results file; returns True if anything regressed"""
+    regressed = False
+    print(f"\n{'workload':18s} {'workers':>7s} {'msgs/s':>16s} {'p95':>16s}")
+    for workload, runs in results['results'].items():
+        for workers, run in runs['throughput'].items():
+            before = baseline.get('results', {}).get(workload, {}).get('throughput', {}).get(workers)
+            if before is None:
+                continue
+            rate = run['msgs_per_s'] / before['msgs_per_s'] - 1
+            p95 = run['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+            flag = ""
+            if rate < -tolerance or p95 > tolerance:
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"{workload:18s} {workers:>7s} {rate:+15.1%} {p95:+15.1%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="dispatcher shard counts to run")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20000, help="messages per workload and worker count")
+    parser.add_argument("--storage", choices=("fake", "sqlite"), default="fake")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="ms slept per fake database round trip")
+    parser.add_argument("--rate", type=float, default=0, help="messages/sec offered (0 = all at once)")
+    parser.add_argument("--trace-sample-rate", type=float, default=CONFIG["tracing"]["sample_rate"])
+    parser.add_argument("--alloc-messages", type=int, default=2000, help="messages in the tracemalloc pass")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed fractional slowdown before flagging")
+    parser.add_argument("--log-level", default="WARNING", help="server log level during the runs")
+    args = parser.parse_args()
+    # The server logs every message at INFO; that would measure the console instead
+    logging.getLogger().setLevel(args.log_level)
+
+    results = {
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'settings': {
+            'devices': args.devices,
+            'messages': args.messages,
+            'storage': args.storage,
+            'db_latency_ms': args.db_latency,
+            'rate': args.rate,
+            'trace_sample_rate': args.trace_sample_rate
+        },
+        'results': {}
+    }
+    print(f"{'workload':18s} {'workers':>7s} {'msgs/s':>10s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    # Only used with --storage sqlite
+    args.database_dir = tempfile.mkdtemp(prefix="bench_pipeline-")
+    args.databases = 0
+    try:
+        for workload in args.workloads:
+            runs = {'throughput': {}}
+            for workers in args.workers:
+                args.workers_now = workers
+                messages, cards = build_messages(workload, args.devices, args.messages)
+                run = runs['throughput'][str(workers)] = run_throughput(workload, args.devices, messages, cards, args)
+                print(f"{workload:18s} {workers:7d} {run['msgs_per_s']:10.0f} {run['p50_ms']:7.2f}ms "
+                      f"{run['p95_ms']:7.2f}ms {run['p99_ms']:7.2f}ms")
+            messages, cards = build_messages(workload, args.devices, args.alloc_messages)
+            runs['allocations'] = run_allocations(workload, args.devices, messages, cards, args)
+            print(f"{workload:18s} {'':7s} allocations: {runs['allocations']['peak_bytes_per_msg']:.0f} B peak, "
+                  f"{runs['allocations']['retained_bytes_per_msg']:.0f} B retained per message")
+            results['results'][workload] = runs
+    finally:
+        shutil.rmtree(args.database_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""Simulate a fleet of NodeMCU terminals against an MQTT broker and measure response latency.
+
+Every virtual terminal behaves like Client(NodeMCU).ino. It connects and
+subscribes to nodemcu/<mac>/response, then sends loginstatus and an "alive"
+heartbeat. It polls workstationstatus while an operator is logged in and scans
+cards in a login -> bundle start -> bundle end cycle. The server answers each
+terminal in order, so requests are matched to responses in order to measure
+latency per message type.
+
+Cards must exist in the database for logins and bundles to succeed. Unknown
+cards still go through the whole pipeline and get UNAUTHORIZED_CARD.
+
+    python tools/load_generator.py --broker localhost --terminals 1000 --duration 300 \\
+        --employees 0001234567 0001234568 --bundles 0007654321 0007654322 \\
+        --speed 10 --misbehaving 0.02 --storm-every 60
+
+Thousands of terminals need as many sockets; raise `ulimit -n` first.
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+from collections import defaultdict, deque
+
+# Firmware timings in seconds (HEARTBEAT_INTERVAL, STATUS_CHECK_INTERVAL, ...)
+HEARTBEAT_INTERVAL = 30
+LOGIN_STATUS_INTERVAL = 30
+WORKSTATION_STATUS_INTERVAL = 5
+RECONNECT_INTERVAL = 5
+
+# Which responses answer which request; everything else answers a scan
+POLL_RESPONSES = {
+    "loginstatus": {"LOW", "HIGH"},
+    "workstationstatus": {"STATUS_GREEN", "STATUS_YELLOW", "STATUS_RED", "NO_OPERATOR"}
+}
+# The server also pushes these on its own when a workstation changes colour
+PUSHED_STATUSES = {"STATUS_GREEN", "STATUS_YELLOW", "STATUS_RED"}
+LOGGED_IN = {"LOW", "LOGIN_SUCCESS", "LOGIN_EXISTS"}
+LOGGED_OUT = {"HIGH", "NO_OPERATOR", "LOGIN_REQUIRED"}
+
+class MQTTConnection:
+    """Just enough MQTT 3.1.1 for a terminal: CONNECT, SUBSCRIBE, QoS 0/1 PUBLISH and keepalive"""
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.reader = None
+        self.writer = None
+        self.packet_id = 0
+        self.connected = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.tasks = []
+
+    async def connect(self, host, port, client_id, keepalive):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        variable_header = encode_string("MQTT") + bytes((4, 0x02)) + struct.pack(">H", keepalive)
+        self.send(0x10, variable_header + encode_string(client_id))
+        header, body = await asyncio.wait_for(self.read_packet(), timeout=10)
+        if header >> 4 != 2 or len(body) < 2 or body[1] != 0:
+            raise ConnectionError(f"CONNACK refused: {body.hex()}")
+        self.connected.set()
+        self.tasks = [
+            asyncio.create_task(self.read_loop()),
+            asyncio.create_task(self.ping_loop(keepalive))
+        ]
+
+    async def subscribe(self, topic, qos=0):
+        self.send(0x82, struct.pack(">H", self.next_packet_id()) + encode_string(topic) + bytes((qos,)))
+
+    def publish(self, topic, payload, qos=0):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack(">H", self.next_packet_id())
+        self.send(0x30 | (qos << 1), body + payload)
+
+    def send(self, header, body):
+        if self.writer is None or self.writer.is_closing():
+            raise ConnectionError("not connected")
+        self.writer.write(bytes((header,)) + encode_length(len(body)) + body)
+
+    def next_packet_id(self):
+        self.packet_id = self.packet_id % 65535 + 1
+        return self.packet_id
+
+    async def read_packet(self):
+        header = (await self.reader.readexactly(1))[0]
+        length = 0
+        for shift in range(0, 28, 7):
+            byte = (await self.reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+        return header, await self.reader.readexactly(length) if length else b""
+
+    async def read_loop(self):
+        try:
+            while True:
+                header, body = await self.read_packet()
+                if header >> 4 != 3:
+                    continue  # SUBACK, PUBACK, PINGRESP
+                qos = (header >> 1) & 0x03
+                topic_length = struct.unpack_from(">H", body)[0]
+                topic = body[2:2 + topic_length].decode()
+                offset = 2 + topic_length
+                if qos:
+                    self.send(0x40, body[offset:offset + 2])
+                    offset += 2
+                self.on_message(topic, body[offset:])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.closed.set()
+
+    async def ping_loop(self, keepalive):
+        try:
+            while True:
+                await asyncio.sleep(keepalive / 2)
+                self.send(0xC0, b"")
+        except (ConnectionError, OSError):
+            pass
+
+    def drop(self, clean=False):
+        """Close the socket; without clean there is no DISCONNECT, like a terminal losing power"""
+        if self.writer is not None and not self.writer.is_closing():
+            if clean:
+                self.writer.write(b"\xe0\x00")
+            self.writer.close()
+        for task in self.tasks:
+            task.cancel()
+        self.closed.set()
+
+def encode_string(value):
+    data = value.encode()
+    return struct.pack(">H", len(data)) + data
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # request type -> seconds
+        self.counters = defaultdict(int)
+        self.responses = defaultdict(int)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def summary(self, elapsed):
+        latency = {}
+        for kind, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            latency[kind] = {
+                'count': len(ordered),
+                'p50_ms': percentile(ordered, 50) * 1000,
+                'p95_ms': percentile(ordered, 95) * 1000,
+                'p99_ms': percentile(ordered, 99) * 1000,
+                'max_ms': ordered[-1] * 1000
+            }
+        return {
+            'elapsed_s': elapsed,
+            'sent_per_s': self.counters['sent'] / elapsed if elapsed else 0.0,
+            'received_per_s': self.counters['received'] / elapsed if elapsed else 0.0,
+            'counters': dict(sorted(self.counters.items())),
+            'responses': dict(sorted(self.responses.items())),
+            'latency': latency
+        }
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class VirtualTerminal:
+    """One simulated NodeMCU: the firmware's timers plus an operator working through bundles"""
+    def __init__(self, index, args, stats):
+        self.args = args
+        self.stats = stats
+        self.mac = "02:00:{:02X}:{:02X}:{:02X}:{:02X}".format(*struct.pack(">I", index))
+        self.employee = args.employees[index % len(args.employees)]
+        self.bundles = args.bundles[index % len(args.bundles):] + args.bundles[:index % len(args.bundles)]
+        self.misbehaviour = None
+        self.connection = None
+        self.logged_in = False
+        self.outstanding = deque()  # (request type, sent at)
+
+    async def run(self, stop):
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+        while not stop.is_set():
+            self.connection = MQTTConnection(self.on_message)
+            try:
+                await self.connection.connect(
+                    self.args.broker, self.args.port, f"NodeMCU-{self.mac}-{int(time.time() * 1000)}", self.args.keepalive
+                )
+                self.stats.count('connects')
+                await self.connection.subscribe(f"nodemcu/{self.mac}/response")
+                await self.session(stop)
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                self.stats.count('connect_failures')
+            finally:
+                self.connection.drop()
+            if not stop.is_set():
+                self.stats.count('reconnects')
+                await asyncio.sleep(RECONNECT_INTERVAL / self.args.speed * random.uniform(0.5, 1.5))
+
+    async def session(self, stop):
+        """Firmware behaviour while connected; returns when the connection drops"""
+        self.request("loginstatus", f"loginstatus {self.mac}")
+        self.heartbeat()
+        tasks = [
+            asyncio.create_task(self.every(HEARTBEAT_INTERVAL, self.heartbeat)),
+            asyncio.create_task(self.every(LOGIN_STATUS_INTERVAL, self.login_status)),
+            asyncio.create_task(self.every(WORKSTATION_STATUS_INTERVAL, self.workstation_status)),
+            asyncio.create_task(self.misbehave() if self.misbehaviour else self.operator())
+        ]
+        stopped = asyncio.create_task(stop.wait())
+        closed = asyncio.create_task(self.connection.closed.wait())
+        await asyncio.wait([stopped, closed], return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks + [stopped, closed]:
+            task.cancel()
+        self.outstanding.clear()
+
+    async def every(self, interval, action):
+        interval /= self.args.speed
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            action()
+            await asyncio.sleep(interval)
+
+    def heartbeat(self):
+        self.publish(f"nodemcu/{self.mac}/heartbeat", "alive")
+        self.stats.count('heartbeats')
+
+    def login_status(self):
+        self.request("loginstatus", f"loginstatus {self.mac}")
+
+    def workstation_status(self):
+        if self.logged_in:
+            self.request("workstationstatus", f"workstationstatus {self.mac}")
+
+    def scan(self, card):
+        self.request("scan", f"ID: {card} Mac ID: {self.mac}")
+
+    async def operator(self):
+        """Log in, then start and end bundles one after another"""
+        await asyncio.sleep(random.uniform(1, 5) / self.args.speed)
+        self.scan(self.employee)
+        for cycle in range(1 << 30):
+            bundle = self.bundles[cycle % len(self.bundles)]
+            await asyncio.sleep(random.uniform(2, 10) / self.args.speed)
+            self.scan(bundle)
+            await asyncio.sleep(self.args.work_time / self.args.speed * random.uniform(0.5, 1.5))
+            self.scan(bundle)
+
+    async def misbehave(self):
+        if self.misbehaviour == "garbage":
+            # Corrupt serial reads and firmware bugs
+            while True:
+                await asyncio.sleep(random.uniform(0.5, 2))
+                self.publish("nodemcu/rfid", random.choice(
+                    ["ID: Mac ID:", "loginstatus", "\x02\x03", "ID: ZZZZ Mac ID: ??", bytes(random.randrange(256) for _ in range(20))]
+                ))
+                self.stats.count('garbage_sent')
+        elif self.misbehaviour == "stuck_card":
+            # A card left on the reader is read over and over
+            while True:
+                await asyncio.sleep(0.05)
+                self.scan(self.employee)
+        elif self.misbehaviour == "bad_heartbeat":
+            while True:
+                await asyncio.sleep(1)
+                self.publish(f"nodemcu/{self.mac}/heartbeat", "{not json")
+
+    def request(self, kind, payload):
+        self.expire_outstanding()
+        self.outstanding.append((kind, time.perf_counter()))
+        self.publish("nodemcu/rfid", payload)
+        self.stats.count(f"sent_{kind}")
+
+    def publish(self, topic, payload):
+        try:
+            self.connection.publish(topic, payload)
+            self.stats.count('sent')
+        except (ConnectionError, OSError):
+            self.stats.count('send_failures')
+
+    def expire_outstanding(self):
+        deadline = time.perf_counter() - self.args.timeout
+        while self.outstanding and self.outstanding[0][1] < deadline:
+            kind, _ = self.outstanding.popleft()
+            self.stats.count(f"timeout_{kind}")
+
+    def on_message(self, topic, payload):
+        now = time.perf_counter()
+        response = payload.decode(errors="replace")
+        self.stats.count('received')
+        self.stats.responses[response.split("_AT_")[0] if "_AT_" in response else response] += 1
+        if response in LOGGED_IN:
+            self.logged_in = True
+        elif response in LOGGED_OUT:
+            self.logged_in = False
+
+        # The server sends LOW ahead of LOGIN_SUCCESS; that belongs to the scan, not a poll
+        if response == "LOW" and self.outstanding and self.outstanding[0][0] == "scan":
+            return
+        # A status only answers a poll at the head; otherwise it is a push and must not
+        # pop the scans queued ahead of a later workstationstatus
+        if response in PUSHED_STATUSES and not (self.outstanding and self.outstanding[0][0] == "workstationstatus"):
+            self.stats.count('unsolicited')
+            return
+
+        for position, (kind, sent_at) in enumerate(self.outstanding):
+            if response in POLL_RESPONSES.get(kind, ()) or (kind == "scan" and not any(
+                    response in answers for answers in POLL_RESPONSES.values())):
+                # Responses come back in request order, so anything ahead of the match was never answered
+                for _ in range(position):
+                    skipped, _ = self.outstanding.popleft()
+                    self.stats.count(f"unanswered_{skipped}")
+                self.outstanding.popleft()
+                self.stats.latencies[kind].append(now - sent_at)
+                return
+        # Status pushes and repeated responses arrive without a request
+        self.stats.count('unsolicited')
+
+async def reconnect_storms(terminals, args, stop):
+    """Every storm_every seconds, cut a share of the fleet off at once, as after an access point reboot"""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=args.storm_every)
+        except asyncio.TimeoutError:
+            victims = random.sample(terminals, max(1, int(len(terminals) * args.storm_fraction)))
+            for terminal in victims:
+                if terminal.connection:
+                    terminal.connection.drop()
+            terminals[0].stats.count('storm_drops', len(victims))
+            print(f"reconnect storm: dropped {len(victims)} terminals")
+
+async def report(stats, args, stop, started):
+    last = dict(stats.counters)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=args.report_interval)
+        except asyncio.TimeoutError:
+            pass
+        counters = dict(stats.counters)
+        sent = counters.get('sent', 0) - last.get('sent', 0)
+        received = counters.get('received', 0) - last.get('received', 0)
+        last = counters
+        scans = sorted(stats.latencies.get("scan", ()))
+        p95 = f"{percentile(scans, 95) * 1000:.1f}ms" if scans else "-"
+        print(f"{time.monotonic() - started:7.0f}s sent {sent / args.report_interval:8.1f}/s "
+              f"received {received / args.report_interval:8.1f}/s scan p95 {p95} "
+              f"connects {counters.get('connects', 0)}")
+
+async def main_async(args):
+    stats = Stats()
+    terminals = [VirtualTerminal(index, args, stats) for index in range(args.terminals)]
+    for terminal in random.sample(terminals, int(len(terminals) * args.misbehaving)):
+        terminal.misbehaviour = random.choice(("garbage", "stuck_card", "bad_heartbeat"))
+
+    stop = asyncio.Event()
+    started = time.monotonic()
+    tasks = [asyncio.create_task(terminal.run(stop)) for terminal in terminals]
+    tasks.append(asyncio.create_task(report(stats, args, stop, started)))
+    if args.storm_every:
+        tasks.append(asyncio.create_task(reconnect_storms(terminals, args, stop)))
+
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.summary(time.monotonic() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--terminals", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--ramp", type=float, default=10, help="spread initial connects over this many seconds")
+    parser.add_argument("--employees", nargs="+", default=["0000000001"], help="employee card numbers")
+    parser.add_argument("--bundles", nargs="+", default=["0000000100"], help="bundle card numbers")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide firmware timers by this factor")
+    parser.add_argument("--work-time", type=float, default=60, help="mean seconds a bundle stays active, divided by --speed")
+    parser.add_argument("--keepalive", type=int, default=60)
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a request counts as timed out")
+    parser.add_argument("--misbehaving", type=float, default=0.0, help="share of terminals sending bad traffic")
+    parser.add_argument("--storm-every", type=float, default=0, help="seconds between reconnect storms (0 = none)")
+    parser.add_argument("--storm-fraction", type=float, default=0.5, help="share of terminals dropped per storm")
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args()
+
+    summary = asyncio.run(main_async(args))
+
+    print(f"\nsent {summary['sent_per_s']:.1f}/s, received {summary['received_per_s']:.1f}/s "
+          f"over {summary['elapsed_s']:.0f}s")
+    print(f"{'request':18s} {'count':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for kind, latency in summary['latency'].items():
+        print(f"{kind:18s} {latency['count']:8d} {latency['p50_ms']:7.1f}ms {latency['p95_ms']:7.1f}ms "
+              f"{latency['p99_ms']:7.1f}ms {latency['max_ms']:7.1f}ms")
+    print("counters: " + ", ".join(f"{name}={value}" for name, value in summary['counters'].items()))
+    print("responses: " + ", ".join(f"{name}={value}" for name, value in summary['responses'].items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import importlib.util
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "MQTT Server.py")
+
+def load_server_module():
+    """Import "MQTT Server.py" (its file name is not a valid module name)"""
+    spec = importlib.util.spec_from_file_location("mqtt_server", SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module